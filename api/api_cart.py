@@ -1,23 +1,37 @@
 import datetime
+import logging
 
 from decimal import Decimal
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException
 from sqlmodel import Session, select
 from typing_extensions import Annotated, Sequence
 
 from db.models import Cart, CartItem, CartItemReadAll, Order, OrderItem, OrderRead, Product, User
 from schemas.cart import CartUpdate
-from services.crud_user import is_only_user
+from services.cart_store import CartStore, get_cart_store
+from services.crud_user import get_user_shard_session, is_only_user
+from services.invoices import generate_invoice
+from services.product_events import notify_product_changes
+from services.promotions import CartLine, claim_voucher, get_promotion_engine, release_voucher
+from services.recommendations import record_order_products
+from services.stock import release_stock, reserve_stock
+from services.suggestions import get_suggestion_index
 from utils.deps import get_session
+from utils.response import FastSerializationRoute
 
-carts_router = APIRouter()
+logger = logging.getLogger(__name__)
+
+carts_router = APIRouter(route_class=FastSerializationRoute)
 
 @carts_router.get("/{username}/checkout/", status_code=200, response_model=OrderRead)
-async def checkout_cart(username: str, session: Annotated[Session, Depends(get_session)], current_user: Annotated[User, Depends(is_only_user)]):
+async def checkout_cart(username: str, session: Annotated[Session, Depends(get_user_shard_session)], primary: Annotated[Session, Depends(get_session)], current_user: Annotated[User, Depends(is_only_user)], cart_store: Annotated[CartStore, Depends(get_cart_store)], background_tasks: BackgroundTasks, voucher: str | None = None):
     if username != current_user.username:
         raise HTTPException(status_code=403, detail="Unauthorized to checkout other user's cart")
     
+    # pending cart changes are written first, checkout works on the cart tables
+    cart_store.flush_user(current_user.id) # type: ignore
+    
     user_cart = session.exec(select(Cart).where(Cart.user == current_user)).one_or_none()
     
     if user_cart is None:
@@ -28,100 +42,84 @@ async def checkout_cart(username: str, session: Annotated[Session, Depends(get_s
     if len(cart_items) == 0:
         raise HTTPException(status_code=404, detail="Cart is empty")
     
-    user_order = Order(user=current_user, created_at=datetime.datetime.now(datetime.UTC)) # type: ignore
-    
-    session.add(user_order)
-    session.commit()
-    session.refresh(user_order)
-    
-    total_price = 0
+    products = {product.id: product for product in session.exec(select(Product).where(Product.id.in_([item.product_id for item in cart_items]))).all()} # type: ignore
+    cart_lines = []
     
     for item in cart_items:
-        product = session.get(Product, item.product_id)
+        product = products.get(item.product_id)
         if product is None:
             raise HTTPException(status_code=404, detail="Product not found")
         if product.available_quantity < item.quantity:
             raise HTTPException(status_code=409, detail="Not enough stock")
-        product.available_quantity -= item.quantity
-        total_price += product.original_price * item.quantity
-        
-        order_item = OrderItem(quantity=item.quantity, product=product, order=user_order, created_at=datetime.datetime.now(datetime.UTC))
-        
-        session.add(order_item)
-        session.add(product)
+        cart_lines.append(CartLine(product_id=product.id, category_id=product.category_id, vendor_id=product.vendor_id, original_price=product.original_price, quantity=item.quantity)) # type: ignore
+    
+    # the whole cart is priced in one pass over the promotion rules held in memory
+    promotion_rules = get_promotion_engine().rules
+    priced_lines = promotion_rules.price_cart(cart_lines, voucher)
+    voucher_id = promotion_rules.vouchers[voucher][0].id if voucher is not None else None
+    ordered_quantities = {item.product_id: item.quantity for item in cart_items}
+    
+    # Stock and vouchers live on the primary, the order on the user's shard. Without shards both are the same
+    # session and commit together. With shards the stock is taken first and put back if the order cannot be stored
+    sharded = primary is not session
+    if voucher_id is not None:
+        claim_voucher(primary, voucher_id)
+    # followers of the products get the new stock once it commits
+    notify_product_changes(primary, reserve_stock(primary, ordered_quantities))
+    if sharded:
+        primary.commit()
+    
+    now = datetime.datetime.now(datetime.UTC)
+    total_price = sum((line.amount for line in priced_lines), Decimal(0))
+    user_order = Order(user_id=current_user.id, total_price=total_price.quantize(Decimal("0.01")), created_at=now) # type: ignore
+    session.add(user_order)
+    
+    for item, line in zip(cart_items, priced_lines):
+        session.add(OrderItem(quantity=item.quantity, unit_price=line.unit_price, promotion_id=line.promotion_id, product_id=item.product_id, order=user_order, created_at=now))
         session.delete(item)
     
-    user_order.total_price = Decimal(total_price).quantize(Decimal("0.01"))
-    session.add(user_order)
     session.delete(user_cart)
-    session.commit()
+    try:
+        session.commit()
+    except Exception as e:
+        session.rollback()
+        if not sharded:
+            raise
+        logger.exception("Storing the order of user %s failed, putting the stock back", current_user.id)
+        if voucher_id is not None:
+            release_voucher(primary, voucher_id)
+        notify_product_changes(primary, release_stock(primary, ordered_quantities))
+        primary.commit()
+        raise HTTPException(status_code=503, detail="Checkout failed, please try again") from e
+    
+    cart_store.discard(current_user.id) # type: ignore
+    # "customers also bought" counts live on the primary, updated after the order is committed
+    record_order_products(primary, ordered_quantities) # type: ignore
+    get_suggestion_index().add_sales(ordered_quantities) # type: ignore
     session.refresh(user_order)
+    # rendered in the process pool once the response is sent
+    background_tasks.add_task(generate_invoice, user_order.id, current_user.id) # type: ignore
     return user_order
 
 @carts_router.get("/{username}/", status_code=200, response_model=Sequence[CartItemReadAll])
-async def get_user_cart(username: str, session: Annotated[Session, Depends(get_session)], current_user: Annotated[User, Depends(is_only_user)]):
+async def get_user_cart(username: str, session: Annotated[Session, Depends(get_user_shard_session)], current_user: Annotated[User, Depends(is_only_user)], cart_store: Annotated[CartStore, Depends(get_cart_store)]):
     if username != current_user.username:
         raise HTTPException(status_code=403, detail="Unauthorized to view other user's cart")
     
-    cart = session.exec(select(Cart).where(Cart.user == current_user)).one_or_none()
-    
-    if cart is not None:
-        cart_items = session.exec(select(CartItem).where(CartItem.cart == cart)).all()
-
-    else:
-        user_cart = Cart(user=current_user, created_at=datetime.datetime.now(datetime.UTC))
-        session.add(user_cart)
-        session.commit()
-        session.refresh(user_cart)
-        cart_items = session.exec(select(CartItem).where(CartItem.cart == user_cart)).all()
-        
-    return cart_items
+    return cart_store.get_items(session, current_user.id) # type: ignore
 
 @carts_router.put("/{username}/{cart_item_id}/update/", status_code=200, response_model=CartItemReadAll)
-async def update_cart_items(username: str, cart_item_id: int, req: CartUpdate, session: Annotated[Session, Depends(get_session)], current_user: Annotated[User, Depends(is_only_user)]):
+async def update_cart_items(username: str, cart_item_id: int, req: CartUpdate, session: Annotated[Session, Depends(get_user_shard_session)], current_user: Annotated[User, Depends(is_only_user)], cart_store: Annotated[CartStore, Depends(get_cart_store)]):
     if username != current_user.username:
         raise HTTPException(status_code=403, detail="Unauthorized to update other user's cart")
     
-    cart_item = session.exec(select(CartItem).join(Cart).where(CartItem.id == cart_item_id and Cart.user == current_user)).one_or_none()
-    
-    user_cart = session.exec(select(Cart).where(Cart.user == current_user)).one_or_none()
-    
-    if user_cart is None:
-        raise HTTPException(status_code=404, detail="Cart not found")
-    
-    if cart_item is None:
-        raise HTTPException(status_code=404, detail="Cart item not found")
-
-    product = session.get(Product, cart_item.product_id)
-    
-    if product is None:
-        raise HTTPException(status_code=404, detail="Product not found")
-    
     cart_item_data = req.model_dump(exclude_unset=True)
-    for key, value in cart_item_data.items():
-        if key == "quantity" and product.available_quantity < value:
-            raise HTTPException(status_code=409, detail="Not enough stock")
-        setattr(cart_item, key, value)
-    
-    cart_item.updated_at = datetime.datetime.now(datetime.UTC)
-    user_cart.updated_at = datetime.datetime.now(datetime.UTC)
-    
-    session.add(user_cart)
-    session.add(cart_item)
-    session.commit()
-    session.refresh(cart_item)
-    return cart_item
+    return cart_store.update_item(session, current_user.id, cart_item_id, cart_item_data.get("quantity")) # type: ignore
 
 @carts_router.delete("/{username}/{cart_item_id}/delete/", status_code=204)
-async def remove_cart_item(username: str, cart_item_id: int, session: Annotated[Session, Depends(get_session)], current_user: Annotated[User, Depends(is_only_user)]):
+async def remove_cart_item(username: str, cart_item_id: int, session: Annotated[Session, Depends(get_user_shard_session)], current_user: Annotated[User, Depends(is_only_user)], cart_store: Annotated[CartStore, Depends(get_cart_store)]):
     if current_user.username != username:
         raise HTTPException(status_code=403, detail="Unauthorized to delete other user's cart")
     
-    cart_item = session.exec(select(CartItem).join(Cart).where(CartItem.id == cart_item_id and Cart.user == current_user)).one_or_none()
-
-    if cart_item is None:
-        raise HTTPException(status_code=404, detail="Cart item not found")
-
-    session.delete(cart_item)
-    session.commit()
+    cart_store.remove_item(session, current_user.id, cart_item_id) # type: ignore
     return {"message": "Cart item deleted successfully"}
@@ -1,20 +1,78 @@
-from fastapi import APIRouter, HTTPException, UploadFile
+from typing import Annotated
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Request, UploadFile
+from fastapi.responses import StreamingResponse
+from sqlmodel import Session, select
+
+from core.config import settings
+from db.models import ProductImageVariant, UploadedFile, UploadedFileRead, UploadedFileStatusRead, User
+from schemas.file import FileStatus
+from services.blob_storage import BlobStorage, get_blob_storage
+from services.crud_user import get_current_user
+from services.file_upload import FileUploadService, iter_upload_file
+from services.virus_scan import VirusScanService, get_virus_scan_service
+from utils.deps import get_session
 
 files_router = APIRouter()
 
-@files_router.post("/upload/")
-async def create_upload_image_file(file: UploadFile):
-    print(type(file))
-    content_type = file.content_type
-    file_size = file.size
-    
-    if content_type not in ["image/jpeg", "image/png", "image/gif"]:
+def get_file_upload_service(storage: Annotated[BlobStorage, Depends(get_blob_storage)], scan_service: Annotated[VirusScanService, Depends(get_virus_scan_service)]) -> FileUploadService:
+    return FileUploadService(storage, scan_service)
+
+@files_router.post("/upload/", status_code=201, response_model=UploadedFileRead)
+async def create_upload_image_file(file: UploadFile, session: Annotated[Session, Depends(get_session)], current_user: Annotated[User, Depends(get_current_user)], upload_service: Annotated[FileUploadService, Depends(get_file_upload_service)]):
+    if file.content_type is None:
         raise HTTPException(status_code=415, detail="File type not supported. Only jpeg, png and gif are supported")
+
+    file_obj = await upload_service.upload(session, iter_upload_file(file), file.filename or "upload", file.content_type, uploader_id=current_user.id)
+    await upload_service.scan_virus(file_obj)
+    return file_obj
+
+# Raw request body upload, the body is streamed straight into blob storage without multipart parsing or spooling
+@files_router.put("/upload/{filename}/", status_code=201, response_model=UploadedFileRead)
+async def stream_upload_image_file(filename: str, request: Request, session: Annotated[Session, Depends(get_session)], current_user: Annotated[User, Depends(get_current_user)], upload_service: Annotated[FileUploadService, Depends(get_file_upload_service)], content_type: Annotated[str | None, Header()] = None, content_length: Annotated[int | None, Header()] = None):
+    if content_type is None:
+        raise HTTPException(status_code=415, detail="File type not supported. Only jpeg, png and gif are supported")
+
+    if content_length is not None and content_length > settings.UPLOAD_MAX_SIZE_BYTES:
+        raise HTTPException(status_code=413, detail=f"File size is greater than {settings.UPLOAD_MAX_SIZE_BYTES // (1024 * 1024)} MB")
+
+    file_obj = await upload_service.upload(session, request.stream(), filename, content_type, uploader_id=current_user.id)
+    await upload_service.scan_virus(file_obj)
+    return file_obj
+
+# Public, immutable URLs for processed product images. Keys are content hashes so responses can be cached forever
+@files_router.get("/blobs/{key}/")
+async def get_public_blob(key: str, session: Annotated[Session, Depends(get_session)], storage: Annotated[BlobStorage, Depends(get_blob_storage)]):
+    variant = session.exec(select(ProductImageVariant).where(ProductImageVariant.sha256 == key).limit(1)).first()
     
-    if file_size is None:
-        raise HTTPException(status_code=400, detail="File size is not specified")
-    
-    if file_size > 1 * 1024 * 1024:
-        raise HTTPException(status_code=413, detail="File size is greater than 1 MB")
+    if variant is None:
+        raise HTTPException(status_code=404, detail="File not found")
     
-    return {"filename": file.filename, "content_type": content_type, "file_size": file_size}
+    headers = {"Cache-Control": "public, max-age=31536000, immutable", "ETag": f'"{key}"'}
+    return StreamingResponse(storage.iter_chunks(key), media_type=variant.content_type, headers=headers)
+
+# only the uploader (and superusers) may see an upload
+def get_own_file(session: Session, file_id: int, current_user: User) -> UploadedFile:
+    file_obj = session.get(UploadedFile, file_id)
+
+    if file_obj is None:
+        raise HTTPException(status_code=404, detail="File not found")
+
+    if file_obj.uploader_id != current_user.id and not current_user.is_superuser:
+        raise HTTPException(status_code=403, detail="Unauthorized to access other user's file")
+
+    return file_obj
+
+@files_router.get("/{file_id}/status/", response_model=UploadedFileStatusRead)
+async def get_file_status(file_id: int, session: Annotated[Session, Depends(get_session)], current_user: Annotated[User, Depends(get_current_user)]):
+    return get_own_file(session, file_id, current_user)
+
+@files_router.get("/{file_id}/")
+async def download_file(file_id: int, session: Annotated[Session, Depends(get_session)], current_user: Annotated[User, Depends(get_current_user)], storage: Annotated[BlobStorage, Depends(get_blob_storage)]):
+    file_obj = get_own_file(session, file_id, current_user)
+
+    if file_obj.status != FileStatus.clean:
+        raise HTTPException(status_code=409, detail=f"File is not available, virus scan status is {file_obj.status.value}")
+
+    headers = {"Content-Length": str(file_obj.size), "ETag": f'"{file_obj.sha256}"'}
+    return StreamingResponse(storage.iter_chunks(file_obj.sha256), media_type=file_obj.content_type, headers=headers)
@@ -1,25 +1,29 @@
 from typing import Annotated, Sequence
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, Header, HTTPException, Response
+from fastapi.responses import StreamingResponse
 from sqlmodel import Session, select
 
 from db.models import Order, OrderItem, OrderItemReadWithProduct, OrderRead, User
-from services.crud_user import is_only_user
-from utils.deps import get_session
+from services.blob_storage import BlobStorage, get_blob_storage
+from services.crud_user import get_user_shard_read_session, get_user_shard_session, is_only_user
+from services.invoices import get_or_create_invoice
+from utils.fieldsets import Fieldset, sparse_fieldset
+from utils.response import FastSerializationRoute
 
-orders_router = APIRouter()
+orders_router = APIRouter(route_class=FastSerializationRoute)
 
 @orders_router.get("/{username}/", response_model=Sequence[OrderRead])
-async def get_user_orders(username: str, session: Annotated[Session, Depends(get_session)], current_user: Annotated[User, Depends(is_only_user)]):
+async def get_user_orders(username: str, session: Annotated[Session, Depends(get_user_shard_read_session)], current_user: Annotated[User, Depends(is_only_user)], fieldset: Annotated[Fieldset, Depends(sparse_fieldset(Order, OrderRead))]):
     if username != current_user.username:
         raise HTTPException(status_code=403, detail="Unauthorized to view other user's orders")
     
-    user_orders = session.exec(select(Order).where(Order.user == current_user)).all()
+    user_orders = session.exec(select(Order).where(Order.user == current_user).options(*fieldset.options())).all()
     
-    return user_orders
+    return fieldset.response(user_orders)
 
 @orders_router.get("/{username}/{order_id}/", response_model=Sequence[OrderItemReadWithProduct])
-async def get_user_order(username: str, order_id: int, session: Annotated[Session, Depends(get_session)], current_user: Annotated[User, Depends(is_only_user)]):
+async def get_user_order(username: str, order_id: int, session: Annotated[Session, Depends(get_user_shard_session)], current_user: Annotated[User, Depends(is_only_user)]):
     if username != current_user.username:
         raise HTTPException(status_code=403, detail="Unauthorized to view other user's orders")
     
@@ -35,3 +39,28 @@ async def get_user_order(username: str, order_id: int, session: Annotated[Sessio
 
     return user_order_items
 
+
+# Invoices never change once rendered, the content hash is a strong ETag and the client may keep its copy
+@orders_router.get("/{username}/{order_id}/invoice/")
+async def get_order_invoice(username: str, order_id: int, session: Annotated[Session, Depends(get_user_shard_session)], current_user: Annotated[User, Depends(is_only_user)], storage: Annotated[BlobStorage, Depends(get_blob_storage)], if_none_match: Annotated[str | None, Header()] = None):
+    if username != current_user.username:
+        raise HTTPException(status_code=403, detail="Unauthorized to view other user's invoices")
+    
+    user_order = session.exec(select(Order).where(Order.id == order_id, Order.user_id == current_user.id)).one_or_none()
+    
+    if user_order is None:
+        raise HTTPException(status_code=404, detail="Order not found")
+    
+    invoice = await get_or_create_invoice(session, user_order)
+    
+    etag = f'"{invoice.sha256}"'
+    headers = {"ETag": etag, "Cache-Control": "private, max-age=31536000, immutable"}
+    # compressed responses carry the weak form of the ETag, If-None-Match compares them weakly
+    if if_none_match is not None and etag in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+    
+    headers["Content-Length"] = str(invoice.size)
+    headers["Content-Disposition"] = f'inline; filename="invoice-{order_id}.html"'
+    # as a header, media_type would get a second charset appended to the stored one
+    headers["Content-Type"] = invoice.content_type
+    return StreamingResponse(storage.iter_chunks(invoice.sha256), headers=headers)
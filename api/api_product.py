@@ -1,18 +1,68 @@
+import asyncio
 import datetime
+import json
 
 from typing import Annotated, Sequence
 
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, UploadFile, WebSocket, WebSocketDisconnect
 from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
 from sqlalchemy.exc import IntegrityError
 from sqlmodel import Session, select
 
-from db.models import Cart, CartItem, CartItemReadAll, Category, Product, ProductReadWithVendor, User
-from schemas.product import ProductAddToCart, ProductCreate, ProductUpdate
-from services.crud_user import get_current_user, is_only_user, is_user_vendor
-from utils.deps import get_session
+from api.api_files import get_file_upload_service
+from auth.auth import read_public_key
+from core.config import settings
+from db.engine import get_engine
+from db.models import (
+    CartItemReadAll,
+    Category,
+    Product,
+    ProductImage,
+    ProductImageRead,
+    ProductReadWithVendor,
+    User,
+)
+from schemas.product import (
+    ProductAddToCart,
+    ProductCreate,
+    ProductFacets,
+    ProductListQuery,
+    ProductSearchPage,
+    ProductSuggestion,
+    ProductUpdate,
+    SearchMode,
+)
+from services import recommendations
+from services.cart_store import CartStore, get_cart_store
+from services.crud_user import get_current_user, get_user_shard_session, is_only_user, is_user_vendor
+from services.embeddings import semantic_ranking
+from services.file_upload import FileUploadService, iter_upload_file
+from services.product_events import (
+    ProductBroadcaster,
+    current_changes,
+    get_product_broadcaster,
+    notify_product_changes,
+    sse_event,
+)
+from services.product_images import load_product_images, on_product_image_scanned
+from services.product_search import (
+    facet_counts,
+    filter_ranking,
+    listing_filters,
+    order_by,
+    products_in_order,
+    reciprocal_rank_fusion,
+    search_filters,
+)
+from services.suggestions import MAX_SUGGESTIONS, get_suggestion_index
+from utils.deps import get_read_session, get_session
+from utils.fieldsets import Fieldset, sparse_fieldset
+from utils.response import FastSerializationRoute
 
-products_router = APIRouter()
+products_router = APIRouter(route_class=FastSerializationRoute)
+
+product_fieldset = sparse_fieldset(Product, ProductReadWithVendor)
 
 @products_router.post("/create/", status_code=201, response_model=ProductReadWithVendor)
 async def create_new_product(req: ProductCreate, session: Annotated[Session, Depends(get_session)], current_user: Annotated[User, Depends(is_user_vendor)]):
@@ -24,37 +74,142 @@ async def create_new_product(req: ProductCreate, session: Annotated[Session, Dep
         session.add(new_product)
         session.commit()
         session.refresh(new_product)
+        get_suggestion_index().put_product(new_product)
         return new_product
     
     except IntegrityError as e:
         session.rollback()
         raise HTTPException(status_code=409, detail="Product name duplicated") from e
     
-@products_router.get("/search/", dependencies=[Depends(get_current_user)], response_model=Sequence[ProductReadWithVendor])
-async def search_products(session: Annotated[Session, Depends(get_session)], product_name: str | None = None, category: str | None = None, offset: int  = 0, limit: int = Query(default=10, le=10)):
+# With facets=true the page also carries category, price bucket and stock counts of every matching product.
+# The semantic and hybrid modes rank by relevance to product_name, sort only applies to keyword search
+@products_router.get("/search/", dependencies=[Depends(get_current_user)], response_model=Sequence[ProductReadWithVendor] | ProductSearchPage)
+async def search_products(session: Annotated[Session, Depends(get_read_session)], listing: Annotated[ProductListQuery, Depends()], product_name: str | None = None, category: str | None = None, offset: int  = 0, limit: int = Query(default=10, le=10), facets: bool = False, mode: SearchMode = SearchMode.keyword):
     if product_name is None and category is None:
-        return []
-    elif product_name is not None and category is None:
-        stmt = select(Product).where(Product.name.ilike(f"%{product_name}%")).order_by(Product.name).offset(offset).limit(limit) # type: ignore
-    elif product_name is None and category is not None:
-        stmt = select(Product).where(Product.category.has(Category.name.ilike(f"%{category}%"))).order_by(Product.name).offset(offset).limit(limit) # type: ignore
+        return ProductSearchPage(products=[], facets=ProductFacets()) if facets else []
+    
+    if mode is SearchMode.keyword or product_name is None:
+        filters = search_filters(product_name, category, listing)
+        stmt = select(Product).where(*filters).order_by(*order_by(listing.sort)).offset(offset).limit(limit).options(load_product_images)
+        products = session.exec(stmt).all()
     else:
-        stmt = select(Product).where(Product.name.ilike(f"%{product_name}%")).where(Product.category.has(Category.name.ilike(f"%{category}%"))).order_by(Product.name).offset(offset).limit(limit) # type: ignore
-        
-    products = session.exec(stmt).all()
-    return products
+        # scoring every product vector is CPU work, it stays off the event loop
+        ranking = await asyncio.to_thread(semantic_ranking, product_name)
+        if mode is SearchMode.hybrid:
+            keyword_ranking = session.exec(select(Product.id).where(*search_filters(product_name, category, listing)).order_by(*order_by(listing.sort)).limit(settings.SEMANTIC_SEARCH_CANDIDATES)).all()
+            ranking = reciprocal_rank_fusion([list(keyword_ranking), ranking]) # type: ignore
+        ranking = filter_ranking(session, ranking, search_filters(None, category, listing))
+        filters = [Product.id.in_(ranking)] # type: ignore
+        products = products_in_order(session, ranking[offset:offset + limit])
+    
+    if not facets:
+        return products
+    return {"products": products, "facets": facet_counts(session, filters)}
 
 @products_router.get("/category/", dependencies=[Depends(get_current_user)], response_model=Sequence[ProductReadWithVendor])
-async def filter_product_by_category(session: Annotated[Session, Depends(get_session)], category: str | None = None):
+async def filter_product_by_category(session: Annotated[Session, Depends(get_read_session)], listing: Annotated[ProductListQuery, Depends()], fieldset: Annotated[Fieldset, Depends(product_fieldset)], category: str | None = None):
     if category is None:
         return []
     
-    if session.exec(select(Category).where(Category.name == category)).one_or_none() is None:
+    category_obj = session.exec(select(Category).where(Category.name == category)).one_or_none()
+    if category_obj is None:
         raise HTTPException(status_code=404, detail="Category not found")
-        
-    stmt = select(Product).where(Product.category.has(Category.name == category)).order_by(Product.name)
+    
+    # filtering on category_id directly lets the (category_id, ...) indexes serve the filter and the order
+    stmt = select(Product).where(Product.category_id == category_obj.id, *listing_filters(listing)).order_by(*order_by(listing.sort)).options(*fieldset.options())
     products = session.exec(stmt).all()
-    return products
+    return fieldset.response(products)
+
+# typeahead over product and category names, answered from this worker's in memory index without a query
+@products_router.get("/suggest/", dependencies=[Depends(get_current_user)], response_model=Sequence[ProductSuggestion])
+async def suggest_products(q: str, limit: int = Query(default=8, ge=1, le=MAX_SUGGESTIONS)):
+    return get_suggestion_index().suggest(q, limit)
+
+# The subscription is made once the response starts streaming, so a client gone before that never leaves one behind,
+# and is dropped however the stream ends, including a failed read of the current values
+async def stream_product_changes(broadcaster: ProductBroadcaster, session: Session, product_ids: list[int]):
+    # subscribed before reading the current values, a change committed in between is sent twice rather than lost
+    subscription = broadcaster.subscribe(product_ids)
+    try:
+        snapshot = current_changes(session, product_ids)
+        # the stream stays open far longer than the request, its connection goes back to the pool now
+        session.close()
+        for change in snapshot:
+            yield sse_event(change)
+        while True:
+            try:
+                changes = await asyncio.wait_for(subscription.changes(), settings.LIVE_UPDATES_KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                # a comment line keeps proxies from closing an idle stream
+                yield ": keepalive\n\n"
+                continue
+            for change in changes:
+                yield sse_event(change)
+    finally:
+        broadcaster.unsubscribe(subscription)
+
+# Server-Sent Events with the current stock and price of the products, then every change of them
+@products_router.get("/live/", dependencies=[Depends(get_current_user)])
+async def product_changes_stream(ids: Annotated[list[int], Query()], session: Annotated[Session, Depends(get_session)], broadcaster: Annotated[ProductBroadcaster, Depends(get_product_broadcaster)]):
+    if len(ids) > settings.LIVE_UPDATES_MAX_PRODUCTS:
+        raise HTTPException(status_code=400, detail=f"At most {settings.LIVE_UPDATES_MAX_PRODUCTS} products can be followed")
+    
+    return StreamingResponse(stream_product_changes(broadcaster, session, ids), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+def websocket_user(websocket: WebSocket, token: str | None) -> User | None:
+    # browsers cannot set headers on a WebSocket, the access token may come as a query parameter instead
+    token = token or websocket.headers.get("authorization", "").removeprefix("Bearer ")
+    with Session(get_engine()) as session:
+        try:
+            return get_current_user(read_public_key(), token, session)
+        except HTTPException:
+            return None
+
+# The same changes over a WebSocket, the client sends {"subscribe": [ids]} and {"unsubscribe": [ids]} at any time
+# and gets the current values of newly followed products, then lists of changes
+@products_router.websocket("/live/ws/")
+async def product_changes_websocket(websocket: WebSocket, broadcaster: Annotated[ProductBroadcaster, Depends(get_product_broadcaster)], token: str | None = None):
+    if websocket_user(websocket, token) is None:
+        await websocket.close(code=1008)
+        return
+    await websocket.accept()
+    subscription = broadcaster.subscribe()
+    
+    async def receive():
+        while True:
+            try:
+                message = json.loads(await websocket.receive_text())
+                subscribe = [int(id) for id in message.get("subscribe", [])]
+                unsubscribe = [int(id) for id in message.get("unsubscribe", [])]
+            except (AttributeError, TypeError, ValueError):
+                await websocket.send_json({"error": "Expected {\"subscribe\": [ids]} or {\"unsubscribe\": [ids]}"})
+                continue
+            broadcaster.remove(subscription, unsubscribe)
+            if len(subscription.product_ids | set(subscribe)) > settings.LIVE_UPDATES_MAX_PRODUCTS:
+                await websocket.send_json({"error": f"At most {settings.LIVE_UPDATES_MAX_PRODUCTS} products can be followed"})
+                continue
+            if subscribe:
+                broadcaster.add(subscription, subscribe)
+                with Session(get_engine()) as session:
+                    snapshot = current_changes(session, subscribe)
+                await websocket.send_json(jsonable_encoder(snapshot))
+    
+    async def send():
+        while True:
+            changes = await subscription.changes()
+            await websocket.send_json(jsonable_encoder(changes))
+    
+    tasks = [asyncio.create_task(receive()), asyncio.create_task(send())]
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            # a disconnect ends the stream, anything else is a bug worth logging
+            if not isinstance(task.exception(), WebSocketDisconnect):
+                task.result()
+    finally:
+        for task in tasks:
+            task.cancel()
+        broadcaster.unsubscribe(subscription)
 
 @products_router.put("/{product_id}/update/", status_code=200, response_model=ProductReadWithVendor)
 async def update_product(product_id: int, req: ProductUpdate, session: Annotated[Session, Depends(get_session)], current_user: Annotated[User, Depends(is_user_vendor)]):
@@ -83,8 +238,11 @@ async def update_product(product_id: int, req: ProductUpdate, session: Annotated
     
     try:
         session.add(product_obj)
+        if "available_quantity" in product_data or "original_price" in product_data:
+            notify_product_changes(session, [product_obj])
         session.commit()
         session.refresh(product_obj)
+        get_suggestion_index().put_product(product_obj)
         return product_obj
     except IntegrityError as e:
         session.rollback()
@@ -102,51 +260,56 @@ async def delete_product(product_id: int, session: Annotated[Session, Depends(ge
     
     session.delete(product_obj)
     session.commit()
+    get_suggestion_index().remove("product", product_id)
     return
 
-@products_router.get("/{product_id}/", dependencies=[Depends(get_current_user)], response_model=ProductReadWithVendor)
-async def get_product(product_id: int, session: Annotated[Session, Depends(get_session)]):
+@products_router.post("/{product_id}/images/", status_code=202, response_model=ProductImageRead)
+async def upload_product_image(product_id: int, file: UploadFile, session: Annotated[Session, Depends(get_session)], current_user: Annotated[User, Depends(is_user_vendor)], upload_service: Annotated[FileUploadService, Depends(get_file_upload_service)]):
     product_obj = session.get(Product, product_id)
     
     if product_obj is None:
         raise HTTPException(status_code=404, detail="Product not found")
     
-    return product_obj
-
-@products_router.get("/", dependencies=[Depends(get_current_user)], response_model=Sequence[ProductReadWithVendor])
-async def get_products(session: Annotated[Session, Depends(get_session)], offset: int = 0, limit: int = Query(default=100, le=100)):
-    products = session.exec(select(Product).offset(offset).limit(limit)).all()
-    return products
-
-@products_router.post("/{product_id}/add-to-cart/", status_code=201, response_model=CartItemReadAll)
-async def add_to_cart(product_id: int, req: ProductAddToCart, session: Annotated[Session, Depends(get_session)], current_user: Annotated[User, Depends(is_only_user)]):
-    product = session.get(Product, product_id)
+    if product_obj.vendor_id != current_user.id:
+        raise HTTPException(status_code=403, detail="Unauthorized to update product")
     
-    if product is None:
-        raise HTTPException(status_code=404, detail="Product not found")
+    if file.content_type is None:
+        raise HTTPException(status_code=415, detail="File type not supported. Only jpeg, png and gif are supported")
     
-    if product.available_quantity < req.quantity:
-        raise HTTPException(status_code=409, detail="Not enough stock")
+    file_obj = await upload_service.upload(session, iter_upload_file(file), file.filename or "upload", file.content_type, uploader_id=current_user.id)
     
-    user_cart = session.exec(select(Cart).where(Cart.user == current_user)).one_or_none()
+    image_obj = ProductImage(product_id=product_id, file_id=file_obj.id, created_at=datetime.datetime.now(datetime.UTC)) # type: ignore
+    session.add(image_obj)
+    session.commit()
+    session.refresh(image_obj)
     
-    if user_cart is None:
-        user_cart = Cart(user=current_user, created_at=datetime.datetime.now(datetime.UTC))
-        session.add(user_cart)
-        session.commit()
-        session.refresh(user_cart)
+    await upload_service.scan_virus(file_obj, on_complete=on_product_image_scanned(image_obj.id)) # type: ignore
+    return image_obj
+
+@products_router.get("/{product_id}/", dependencies=[Depends(get_current_user)], response_model=ProductReadWithVendor)
+async def get_product(product_id: int, session: Annotated[Session, Depends(get_read_session)], fieldset: Annotated[Fieldset, Depends(product_fieldset)]):
+    product_obj = session.get(Product, product_id, options=fieldset.options())
     
-    cart_item = session.exec(select(CartItem).where(CartItem.cart == user_cart and CartItem.product_id == product_id)).one_or_none()
+    if product_obj is None:
+        raise HTTPException(status_code=404, detail="Product not found")
     
-    if cart_item is None:
-        new_cart_item = CartItem(cart=user_cart, product_id=product_id, quantity=req.quantity, created_at=datetime.datetime.now(datetime.UTC))
-    else:
-        raise HTTPException(status_code=409, detail="Product already in cart")
+    return fieldset.response(product_obj)
+
+@products_router.get("/{product_id}/related/", dependencies=[Depends(get_current_user)], response_model=Sequence[ProductReadWithVendor])
+async def get_related_products(product_id: int, session: Annotated[Session, Depends(get_read_session)], limit: int = Query(default=10, le=settings.RELATED_PRODUCTS_TOP_K)):
+    related_products = recommendations.get_related_products(session, product_id, limit)
     
-    user_cart.updated_at = datetime.datetime.now(datetime.UTC)
+    # products without recommendations yet are fine, unknown products are not
+    if len(related_products) == 0 and session.get(Product, product_id) is None:
+        raise HTTPException(status_code=404, detail="Product not found")
     
-    session.add(user_cart)
-    session.add(new_cart_item)
-    session.commit()
-    session.refresh(new_cart_item)
-    return new_cart_item
+    return related_products
+
+@products_router.get("/", dependencies=[Depends(get_current_user)], response_model=Sequence[ProductReadWithVendor])
+async def get_products(session: Annotated[Session, Depends(get_read_session)], listing: Annotated[ProductListQuery, Depends()], fieldset: Annotated[Fieldset, Depends(product_fieldset)], offset: int = 0, limit: int = Query(default=100, le=100)):
+    products = session.exec(select(Product).where(*listing_filters(listing)).order_by(*order_by(listing.sort, default=None)).offset(offset).limit(limit).options(*fieldset.options())).all()
+    return fieldset.response(products)
+
+@products_router.post("/{product_id}/add-to-cart/", status_code=201, response_model=CartItemReadAll)
+async def add_to_cart(product_id: int, req: ProductAddToCart, session: Annotated[Session, Depends(get_user_shard_session)], current_user: Annotated[User, Depends(is_only_user)], cart_store: Annotated[CartStore, Depends(get_cart_store)]):
+    return cart_store.add_item(session, current_user.id, product_id, req.quantity) # type: ignore
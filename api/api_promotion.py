@@ -0,0 +1,75 @@
+import datetime
+
+from typing import Annotated, Sequence
+
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session, or_, select
+
+from db.models import Category, Product, Promotion, PromotionRead, User
+from schemas.promotion import PromotionCreate
+from services.crud_user import get_current_user
+from services.promotions import get_promotion_engine
+from utils.deps import get_session
+from utils.response import FastSerializationRoute
+
+promotions_router = APIRouter(route_class=FastSerializationRoute)
+
+# Superusers run promotions on anything, vendors only on their own products
+def check_promotion_scope(session: Session, req: PromotionCreate, current_user: User):
+    if req.product_id is not None:
+        product_obj = session.get(Product, req.product_id)
+        if product_obj is None:
+            raise HTTPException(status_code=404, detail="Product not found")
+        if not current_user.is_superuser and product_obj.vendor_id != current_user.id:
+            raise HTTPException(status_code=403, detail="Unauthorized to run promotions on other vendors' products")
+        return
+    if req.category_id is not None and session.get(Category, req.category_id) is None:
+        raise HTTPException(status_code=404, detail="Category not found")
+    if req.vendor_id is not None and session.get(User, req.vendor_id) is None:
+        raise HTTPException(status_code=404, detail="Vendor not found")
+    if current_user.is_superuser or (current_user.is_vendor and req.vendor_id == current_user.id):
+        return
+    raise HTTPException(status_code=403, detail="Unauthorized to create this promotion")
+
+@promotions_router.post("/create/", status_code=201, response_model=PromotionRead)
+async def create_promotion(req: PromotionCreate, session: Annotated[Session, Depends(get_session)], current_user: Annotated[User, Depends(get_current_user)]):
+    check_promotion_scope(session, req, current_user)
+    
+    promotion_obj = Promotion(**req.model_dump(), created_by=current_user.id, created_at=datetime.datetime.now(datetime.UTC)) # type: ignore
+    
+    try:
+        session.add(promotion_obj)
+        session.commit()
+        session.refresh(promotion_obj)
+    except IntegrityError as e:
+        session.rollback()
+        raise HTTPException(status_code=409, detail="Voucher code duplicated") from e
+    
+    get_promotion_engine().refresh(session)
+    return promotion_obj
+
+@promotions_router.get("/", response_model=Sequence[PromotionRead])
+async def get_promotions(session: Annotated[Session, Depends(get_session)], current_user: Annotated[User, Depends(get_current_user)], offset: int = 0, limit: int = 100):
+    statement = select(Promotion).order_by(Promotion.id).offset(offset).limit(limit) # type: ignore
+    if not current_user.is_superuser:
+        statement = statement.where(or_(Promotion.created_by == current_user.id, Promotion.vendor_id == current_user.id))
+    
+    return session.exec(statement).all()
+
+@promotions_router.delete("/{promotion_id}/delete/", status_code=204)
+async def delete_promotion(promotion_id: int, session: Annotated[Session, Depends(get_session)], current_user: Annotated[User, Depends(get_current_user)]):
+    promotion_obj = session.get(Promotion, promotion_id)
+    
+    if promotion_obj is None:
+        raise HTTPException(status_code=404, detail="Promotion not found")
+    
+    if not current_user.is_superuser and promotion_obj.created_by != current_user.id:
+        raise HTTPException(status_code=403, detail="Unauthorized to delete promotion")
+    
+    # orders keep the id of the promotion they got, the promotion is ended rather than deleted
+    promotion_obj.ends_at = datetime.datetime.now(datetime.UTC)
+    session.add(promotion_obj)
+    session.commit()
+    get_promotion_engine().refresh(session)
+    return
@@ -10,16 +10,18 @@ from jose import ExpiredSignatureError, JWTError, jwt
 from pydantic import ValidationError
 from sqlmodel import Session, select
 
-from auth.auth import create_access_token, create_refresh_token, read_private_key, verify_password
+from auth.auth import create_access_token, create_refresh_token, hash_token, read_private_key, verify_password
 from core.config import settings
 from db.models import EmailVerification, User, UserReadAll
 from schemas.token import EmailVerificationToken, RefreshToken, Token
 from schemas.user import UserCreate, UserState
-from services.crud_user import get_current_user, user
+from services.crud_user import get_current_user, get_user_shard_session, user
 from services.mail import EmailSchema, send_verification_email
 from utils.deps import get_session
+from utils.fieldsets import Fieldset, sparse_fieldset
+from utils.response import FastSerializationRoute
 
-users_router = APIRouter()
+users_router = APIRouter(route_class=FastSerializationRoute)
 
 @users_router.post("/create/", status_code=201, response_model=EmailVerificationToken)
 async def create_user(session: Annotated[Session, Depends(get_session)], req: UserCreate, background_tasks: BackgroundTasks):
@@ -32,7 +34,7 @@ async def create_user(session: Annotated[Session, Depends(get_session)], req: Us
 
 @users_router.get("/verify-email/")
 async def verify_email(token: str, session: Annotated[Session, Depends(get_session)]):
-    verification_obj = session.exec(select(EmailVerification).where(EmailVerification.token == token)).one_or_none()
+    verification_obj = session.exec(select(EmailVerification).where(EmailVerification.token_hash == hash_token(token))).one_or_none()
     
     if verification_obj is None:
         raise HTTPException(status_code=401, detail="Invalid email verification token")
@@ -84,10 +86,12 @@ async def logout_user(current_user: Annotated[User, Depends(get_current_user)],
     return {"message": "User logged out successfully"}
 
 @users_router.get("/{username}/", response_model=UserReadAll)
-async def get_user(username: str, session: Annotated[Session, Depends(get_session)], current_user: Annotated[User, Depends(get_current_user)]):
+async def get_user(username: str, session: Annotated[Session, Depends(get_user_shard_session)], current_user: Annotated[User, Depends(get_current_user)], fieldset: Annotated[Fieldset, Depends(sparse_fieldset(User, UserReadAll))]):
     if current_user.username != username:
         raise HTTPException(status_code=403, detail="Not allowed to access other user's data")
-    return user.get_username(session, current_user.username)
+    # ?include=cart skips loading every product and order of the user
+    user_obj = session.exec(select(User).where(User.id == current_user.id).options(*fieldset.options())).one()
+    return fieldset.response(user_obj)
 
 @users_router.post("/token/refresh/", response_model=Token)
 async def refresh_access_token(req: RefreshToken, session: Annotated[Session, Depends(get_session)]):
@@ -1,3 +1,4 @@
+import hashlib
 import os
 
 from functools import lru_cache
@@ -42,3 +43,6 @@ def create_refresh_token(user_data: UserState, secret_key: str) -> str:
     payload = user_data.model_dump().copy()
     encoded_token = jwt.encode(payload, secret_key, algorithm=settings.REFRESH_TOKEN_ALGORITHM)
     return encoded_token
+
+def hash_token(token: str) -> str:
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
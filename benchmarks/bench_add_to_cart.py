@@ -0,0 +1,101 @@
+"""Round trips and latency of adding a product to a cart, the previous read-then-write flow against the upsert.
+
+Needs the database from the settings (like e2e_flow, use a dedicated one). Every sample adds the product to the
+empty cart of a fresh customer, so both flows also pay for creating the cart:
+
+    python -m benchmarks.bench_add_to_cart --customers 500
+
+read_then_write: product lookup, cart lookup, cart insert, duplicate lookup, item insert and the refreshes
+upsert: DatabaseCartStore.add_item, one statement chaining the stock check, the cart upsert and the item insert
+"""
+import argparse
+import datetime
+import time
+
+from sqlalchemy import insert
+from sqlmodel import Session, create_engine, select
+
+from benchmarks.common import percentile_summary, save_results
+from db.engine import DB_URL
+from db.models import Cart, CartItem, Category, Product, User
+from db.profiler import QueryStats, current_query_stats
+from services.cart_store import DatabaseCartStore
+
+
+def seed(session: Session, customers: int, prefix: str) -> tuple[int, list[int]]:
+    now = datetime.datetime.now(datetime.UTC)
+    category_id = session.exec(select(Category.id)).first()
+    if category_id is None:
+        raise SystemExit("No categories found, start the app once so the lifespan hook creates them")
+
+    session.execute(insert(User), [{"username": f"{prefix}{i}", "email": f"{prefix}{i}@example.com", "password_hash": "x", "created_at": now} for i in range(customers + 1)])
+    user_ids = list(session.exec(select(User.id).where(User.username.startswith(prefix)).order_by(User.id)).all()) # type: ignore
+    product = Product(name=f"{prefix} product", description="Seeded by the benchmark", category_id=category_id, original_price=10, available_quantity=1_000_000, created_at=now, vendor_id=user_ids[0])
+    session.add(product)
+    session.commit()
+    return product.id, user_ids[1:] # type: ignore
+
+# add_item as it was before the upsert, kept here as the baseline
+def read_then_write(session: Session, user_id: int, product_id: int, quantity: int) -> CartItem:
+    product = session.get(Product, product_id)
+    if product is None or product.available_quantity < quantity:
+        raise SystemExit("The seeded product is missing or out of stock")
+
+    cart = session.exec(select(Cart).where(Cart.user_id == user_id)).one_or_none()
+    if cart is None:
+        cart = Cart(user_id=user_id, created_at=datetime.datetime.now(datetime.UTC))
+        session.add(cart)
+        session.commit()
+        session.refresh(cart)
+    if session.exec(select(CartItem).where(CartItem.cart_id == cart.id, CartItem.product_id == product_id)).one_or_none() is not None:
+        raise SystemExit("The cart already holds the product")
+
+    cart_item = CartItem(cart=cart, product_id=product_id, quantity=quantity, created_at=datetime.datetime.now(datetime.UTC))
+    cart.updated_at = datetime.datetime.now(datetime.UTC)
+    session.add(cart)
+    session.add(cart_item)
+    session.commit()
+    session.refresh(cart_item)
+    return cart_item
+
+def measure(engine, flow, product_id: int, user_ids: list[int]) -> dict:
+    samples_ms = []
+    statements = []
+    for user_id in user_ids:
+        stats = QueryStats()
+        token = current_query_stats.set(stats)
+        try:
+            with Session(engine) as session:
+                start = time.perf_counter()
+                flow(session, user_id, product_id, 1)
+                samples_ms.append((time.perf_counter() - start) * 1000)
+        finally:
+            current_query_stats.reset(token)
+        statements.append(stats.count)
+    return {"latency": percentile_summary(samples_ms), "statements_per_call": sum(statements) / len(statements)}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db-url", default=DB_URL)
+    parser.add_argument("--customers", type=int, default=500)
+    parser.add_argument("--output-dir", default="benchmarks/results")
+    args = parser.parse_args()
+
+    engine = create_engine(args.db_url)
+    prefix = f"benchcart{int(time.time())}_"
+    with Session(engine) as session:
+        product_id, user_ids = seed(session, args.customers * 2, prefix)
+
+    # each flow gets its own customers, every cart starts out missing
+    flows = {"read_then_write": read_then_write, "upsert": DatabaseCartStore().add_item}
+    results = {"flows": {}}
+    for index, (name, flow) in enumerate(flows.items()):
+        results["flows"][name] = measure(engine, flow, product_id, user_ids[index::2])
+        summary = results["flows"][name]
+        print(f"{name:16} {summary['statements_per_call']:5.1f} statements  p50 {summary['latency']['p50_ms']:7.3f} ms  p95 {summary['latency']['p95_ms']:7.3f} ms")
+
+    print(f"\nResults written to {save_results(results, args.output_dir, 'add_to_cart')}")
+    engine.dispose()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""Micro benchmarks of turning ORM rows into a JSON response body.
+
+Each case builds one page of detached ORM objects in memory, no database is needed:
+
+    pytest benchmarks/bench_serialization.py --benchmark-group-by=param:page_size
+
+default: what FastAPI does for a response_model (validate, dump to python, json.dumps in JSONResponse)
+orjson: the same validation and dump, encoded by ORJSONResponse
+fast: FastSerializationRoute, a prebuilt TypeAdapter validating and dumping straight to JSON bytes
+"""
+import datetime
+
+from decimal import Decimal
+from typing import Sequence
+
+import pytest
+
+from fastapi.responses import JSONResponse, ORJSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+
+from db.models import (
+    Cart,
+    CartItem,
+    CartItemReadAll,
+    Order,
+    OrderItem,
+    OrderRead,
+    Product,
+    ProductReadWithVendor,
+    User,
+    UserReadAll,
+)
+from utils.response import make_serializer
+
+NOW = datetime.datetime(2024, 1, 1, tzinfo=datetime.UTC)
+
+
+def make_user(user_id: int) -> User:
+    return User(id=user_id, username=f"user{user_id}", email=f"user{user_id}@example.com", password_hash="x" * 60, is_vendor=True, created_at=NOW)
+
+def make_product(product_id: int, vendor: User) -> Product:
+    return Product(id=product_id, name=f"product {product_id}", description="A product used by the serialization benchmark", category_id=1, original_price=Decimal("19.99"), available_quantity=100, created_at=NOW, vendor_id=vendor.id, vendor=vendor)
+
+def make_products(page_size: int) -> list[Product]:
+    vendor = make_user(1)
+    return [make_product(i, vendor) for i in range(page_size)]
+
+def make_orders(page_size: int) -> list[Order]:
+    user = make_user(1)
+    products = [make_product(i, user) for i in range(3)]
+    return [Order(id=i, user_id=user.id, total_price=Decimal("59.97"), created_at=NOW, user=user, order_items=[OrderItem(id=i * 3 + j, order_id=i, product_id=product.id, quantity=1, created_at=NOW, product=product) for j, product in enumerate(products)]) for i in range(page_size)]
+
+def make_cart_items(page_size: int) -> list[CartItem]:
+    user = make_user(1)
+    cart = Cart(id=1, user_id=user.id, created_at=NOW, user=user)
+    return [CartItem(id=i, cart_id=cart.id, product_id=product.id, quantity=1, created_at=NOW, cart=cart, product=product) for i, product in enumerate(make_products(page_size))]
+
+def make_user_all(page_size: int) -> User:
+    user = make_user(1)
+    user.products = [make_product(i, user) for i in range(page_size)]
+    return user
+
+CASES = {
+    "products": (Sequence[ProductReadWithVendor], make_products),
+    "orders": (Sequence[OrderRead], make_orders),
+    "cart_items": (Sequence[CartItemReadAll], make_cart_items),
+    "user": (UserReadAll, make_user_all),
+}
+
+@pytest.fixture(params=list(CASES))
+def case(request):
+    return request.param
+
+@pytest.mark.parametrize("page_size", [1, 20, 100])
+@pytest.mark.parametrize("path", ["default", "orjson", "fast"])
+def test_serialize(benchmark, case: str, page_size: int, path: str):
+    response_model, factory = CASES[case]
+    content = factory(page_size)
+
+    if path == "fast":
+        serialize = make_serializer(response_model)
+        body = benchmark(serialize, content)
+    else:
+        field = create_response_field(name=f"Response_{case}", type_=response_model)
+        response_class = JSONResponse if path == "default" else ORJSONResponse
+
+        def run():
+            # serialize_response is a coroutine but never awaits for a response_model, drive it by hand
+            coroutine = serialize_response(field=field, response_content=content, is_coroutine=True)
+            try:
+                coroutine.send(None)
+            except StopIteration as stop:
+                return response_class(stop.value).body
+        body = benchmark(run)
+
+    assert body.startswith(b"[" if case != "user" else b"{")
@@ -0,0 +1,49 @@
+import json
+import os
+import platform
+import statistics
+import subprocess
+import time
+
+from typing import Any
+
+
+def percentile_summary(samples_ms: list[float]) -> dict[str, float]:
+    if not samples_ms:
+        return {"count": 0}
+    
+    ordered = sorted(samples_ms)
+    if len(ordered) > 1:
+        cuts = statistics.quantiles(ordered, n=100, method="inclusive")
+        p50, p95, p99 = cuts[49], cuts[94], cuts[98]
+    else:
+        p50 = p95 = p99 = ordered[0]
+    
+    return {
+        "count": len(ordered),
+        "mean_ms": round(statistics.fmean(ordered), 3),
+        "p50_ms": round(p50, 3),
+        "p95_ms": round(p95, 3),
+        "p99_ms": round(p99, 3),
+        "max_ms": round(ordered[-1], 3),
+    }
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def save_results(results: dict[str, Any], output_dir: str, name: str) -> str:
+    os.makedirs(output_dir, exist_ok=True)
+    results.setdefault("meta", {}).update({
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+    })
+    path = os.path.join(output_dir, f"{name}-{results['meta']['commit'] or 'nocommit'}-{int(time.time())}.json")
+    with open(path, "w") as file:
+        json.dump(results, file, indent=2)
+    return path
@@ -0,0 +1,45 @@
+"""Compare two benchmark result files and flag latency regressions.
+
+    python -m benchmarks.compare benchmarks/results/e2e_flow-abc123-1.json benchmarks/results/e2e_flow-def456-2.json
+
+Exits with status 1 when any step's p95 got slower than --threshold percent.
+"""
+import argparse
+import json
+import sys
+
+
+def load(path: str) -> dict:
+    with open(path) as file:
+        return json.load(file)
+
+def compare(baseline: dict, candidate: dict, metric: str, threshold: float) -> list[str]:
+    regressions = []
+    print(f"{'step':<24} {'baseline':>12} {'candidate':>12} {'change':>9}")
+    for step, base in baseline["steps"].items():
+        new = candidate["steps"].get(step)
+        if new is None or metric not in base or metric not in new:
+            continue
+        change = (new[metric] - base[metric]) / base[metric] * 100 if base[metric] else 0.0
+        flag = ""
+        if change > threshold:
+            regressions.append(step)
+            flag = "  REGRESSION"
+        print(f"{step:<24} {base[metric]:>10.3f}ms {new[metric]:>10.3f}ms {change:>+8.1f}%{flag}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--metric", default="p95_ms", choices=["mean_ms", "p50_ms", "p95_ms", "p99_ms"])
+    parser.add_argument("--threshold", type=float, default=10.0, help="allowed slowdown in percent")
+    args = parser.parse_args()
+
+    baseline, candidate = load(args.baseline), load(args.candidate)
+    print(f"baseline {baseline['meta'].get('commit')} vs candidate {candidate['meta'].get('commit')} ({args.metric})")
+    regressions = compare(baseline, candidate, args.metric, args.threshold)
+    sys.exit(1 if regressions else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+"""End to end load test of the main use case from the README.
+
+Vendors and customers are seeded straight into the database under a prefix of their own, so runs can follow each other
+on the same database. The vendors then create the catalog through the API, and every virtual user logs in as its own
+customer and repeats: search products -> add a product to the cart -> checkout -> view orders.
+
+    python serve.py --workers 4 --port 8000 &
+    python -m benchmarks.e2e_flow --base-url http://127.0.0.1:8000 --concurrency 20 --iterations 10
+
+Results are written as JSON to benchmarks/results, compare two runs with benchmarks/compare.py.
+"""
+import argparse
+import asyncio
+import datetime
+import os
+import random
+import subprocess
+import sys
+import time
+
+from collections import defaultdict
+
+import httpx
+
+from sqlalchemy import insert
+from sqlmodel import Session, create_engine, select
+
+from auth.auth import get_password_hash
+from benchmarks.common import percentile_summary, save_results
+from db.engine import DB_URL
+from db.models import Category, User
+from schemas.product import ProductCategory
+
+ADJECTIVES = ["red", "blue", "smart", "classic", "wireless", "organic", "vintage", "compact", "deluxe", "portable"]
+NOUNS = ["laptop", "notebook", "headphones", "kettle", "novel", "jacket", "sneakers", "lamp", "guitar", "blender"]
+PASSWORD = "Bench_1234!"
+
+
+def seed(db_url: str, vendors: int, customers: int, prefix: str) -> tuple[list[str], list[str]]:
+    engine = create_engine(db_url)
+    now = datetime.datetime.now(datetime.UTC)
+    # bcrypt is deliberately slow, every seeded user shares one hash
+    password_hash = get_password_hash(PASSWORD)
+    vendor_names = [f"{prefix}vendor{i}" for i in range(vendors)]
+    customer_names = [f"{prefix}customer{i}" for i in range(customers)]
+
+    with Session(engine) as session:
+        if session.exec(select(Category.id)).first() is None:
+            raise SystemExit("No categories found, start the app once so the lifespan hook creates them")
+
+        session.execute(insert(User), [{"username": name, "email": f"{name}@example.com", "password_hash": password_hash, "is_vendor": True, "created_at": now} for name in vendor_names])
+        session.execute(insert(User), [{"username": name, "email": f"{name}@example.com", "password_hash": password_hash, "created_at": now} for name in customer_names])
+        session.commit()
+
+    engine.dispose()
+    return vendor_names, customer_names
+
+class Recorder:
+    def __init__(self):
+        self.samples: dict[str, list[float]] = defaultdict(list)
+        self.errors: dict[str, int] = defaultdict(int)
+
+    async def call(self, step: str, request) -> httpx.Response | None:
+        start = time.perf_counter()
+        try:
+            response = await request
+        except httpx.HTTPError:
+            self.errors[step] += 1
+            return None
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        if response.is_success:
+            self.samples[step].append(elapsed_ms)
+        else:
+            self.errors[step] += 1
+        return response
+
+async def login(client: httpx.AsyncClient, username: str, recorder: Recorder) -> dict[str, str] | None:
+    response = await recorder.call("login", client.post("/users/login/", data={"username": username, "password": PASSWORD}))
+    if response is None or not response.is_success:
+        return None
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+async def vendor(client: httpx.AsyncClient, username: str, names: list[str], rng: random.Random, recorder: Recorder):
+    headers = await login(client, username, recorder)
+    if headers is None:
+        return
+
+    for name in names:
+        await recorder.call("create_product", client.post("/products/create/", json={
+            "name": name,
+            "description": "Seeded by the benchmark",
+            "category_name": rng.choice(list(ProductCategory)).value,
+            "original_price": round(rng.uniform(1, 500), 2),
+            "available_quantity": 1_000_000,
+        }, headers=headers))
+
+async def create_catalog(base_url: str, vendors: list[str], products: int, prefix: str, seed_value: int) -> tuple[Recorder, float]:
+    recorder = Recorder()
+    rng = random.Random(seed_value)
+    # product names are unique, the run's prefix keeps them apart from the catalog of earlier runs
+    names = [f"{rng.choice(ADJECTIVES)} {rng.choice(NOUNS)} {prefix}{i}" for i in range(products)]
+    limits = httpx.Limits(max_connections=len(vendors), max_keepalive_connections=len(vendors))
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(vendor(client, username, names[i::len(vendors)], random.Random(seed_value + i), recorder) for i, username in enumerate(vendors)))
+        elapsed = time.perf_counter() - start
+    return recorder, elapsed
+
+async def virtual_user(client: httpx.AsyncClient, username: str, iterations: int, rng: random.Random, recorder: Recorder):
+    headers = await login(client, username, recorder)
+    if headers is None:
+        return
+
+    for _ in range(iterations):
+        term = rng.choice(NOUNS)
+        response = await recorder.call("search", client.get("/products/search/", params={"product_name": term}, headers=headers))
+        if response is None or not response.is_success or not response.json():
+            continue
+
+        product = rng.choice(response.json())
+        response = await recorder.call("add_to_cart", client.post(f"/products/{product['id']}/add-to-cart/", json={"quantity": rng.randint(1, 3)}, headers=headers))
+        if response is None or not response.is_success:
+            continue
+
+        await recorder.call("checkout", client.get(f"/carts/{username}/checkout/", headers=headers))
+        await recorder.call("view_orders", client.get(f"/orders/{username}/", headers=headers))
+
+async def run(base_url: str, customers: list[str], iterations: int, seed_value: int) -> tuple[Recorder, float]:
+    recorder = Recorder()
+    limits = httpx.Limits(max_connections=len(customers), max_keepalive_connections=len(customers))
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(virtual_user(client, username, iterations, random.Random(seed_value + i), recorder) for i, username in enumerate(customers)))
+        elapsed = time.perf_counter() - start
+    return recorder, elapsed
+
+def step_summary(recorder: Recorder, step: str, elapsed: float) -> dict:
+    return {**percentile_summary(recorder.samples[step]), "errors": recorder.errors[step], "throughput_rps": round(len(recorder.samples[step]) / elapsed, 2)}
+
+def wait_for_server(base_url: str, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f"{base_url}/openapi.json", timeout=2).is_success:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    raise SystemExit(f"Server at {base_url} did not become ready")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--db-url", default=DB_URL, help="database the server under test uses, for seeding")
+    parser.add_argument("--vendors", type=int, default=10)
+    parser.add_argument("--products", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=20, help="virtual users, each logs in as its own customer")
+    parser.add_argument("--iterations", type=int, default=10, help="shopping flows per virtual user")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--spawn-server", action="store_true", help="start the production launcher (serve.py) for the duration of the run")
+    parser.add_argument("--workers", type=int, default=1, help="serve.py workers when --spawn-server is used")
+    parser.add_argument("--output-dir", default=os.path.join(os.path.dirname(__file__), "results"))
+    args = parser.parse_args()
+
+    server = None
+    if args.spawn_server:
+        port = args.base_url.rsplit(":", 1)[-1].strip("/")
+        # the launcher numbers its workers (leader election, pool warm up), plain uvicorn --workers would not
+        serve = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "serve.py")
+        server = subprocess.Popen([sys.executable, serve, "--host", "127.0.0.1", "--port", port, "--workers", str(args.workers), "--log-level", "warning"])
+
+    try:
+        # the lifespan hook creates the schema and categories, seed only once it ran
+        wait_for_server(args.base_url)
+        prefix = f"bench{int(time.time())}_"
+        vendors, customers = seed(args.db_url, args.vendors, args.concurrency, prefix)
+        catalog, catalog_elapsed = asyncio.run(create_catalog(args.base_url, vendors, args.products, prefix, args.seed))
+        recorder, elapsed = asyncio.run(run(args.base_url, customers, args.iterations, args.seed))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    # the catalog is created before the shopping flows start, its throughput is over its own duration
+    steps = {"create_product": step_summary(catalog, "create_product", catalog_elapsed)}
+    steps |= {step: step_summary(recorder, step, elapsed) for step in ("login", "search", "add_to_cart", "checkout", "view_orders")}
+    results = {
+        "benchmark": "e2e_flow",
+        "params": {key: value for key, value in vars(args).items() if key not in ("db_url", "output_dir")},
+        "elapsed_seconds": round(elapsed, 3),
+        "completed_flows": len(recorder.samples["view_orders"]),
+        "flows_per_second": round(len(recorder.samples["view_orders"]) / elapsed, 2),
+        "steps": steps,
+    }
+
+    for step, summary in steps.items():
+        print(f"{step:<14} n={summary['count']:<6} err={summary['errors']:<4} p50={summary.get('p50_ms', '-')}ms p95={summary.get('p95_ms', '-')}ms p99={summary.get('p99_ms', '-')}ms {summary['throughput_rps']} req/s")
+    print(f"{results['completed_flows']} flows in {results['elapsed_seconds']}s ({results['flows_per_second']} flows/s)")
+    print(f"Saved {save_results(results, args.output_dir, 'e2e_flow')}")
+
+if __name__ == "__main__":
+    main()
@@ -10,7 +10,9 @@ class Settings(BaseSettings):
     DB_PASSWORD: str
     DB_NAME: str
     TEST_DB_NAME: str
-    INVOICE_LANG: str = "en"
+    INVOICE_LANG: str = "en" # en | de | fr | es
+    INVOICE_CURRENCY: str = "USD"
+    INVOICE_SELLER_NAME: str = "Online Shopping Platform"
     
     DOCS_URL: str = "/docs"
     TOKEN_URL: str = "/users/login"
@@ -24,10 +26,89 @@ class Settings(BaseSettings):
     PRIVATE_KEY_PATH: str = "private_key.pem"
     TOKEN_EXCLUDE: list[str] = ["/users/login/", "/users/token/refresh/", "/users/create/", DOCS_URL, "/openapi.json", "/redoc", TOKEN_URL]
     
+    DB_ECHO: bool = False
+    SLOW_QUERY_THRESHOLD_MS: int = 200
+    SLOW_QUERY_MAX_STATEMENT_LENGTH: int = 2000
+    DB_QUERY_DEBUG_HEADER: bool = False
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT_SECONDS: int = 30
+    DB_POOL_RECYCLE_SECONDS: int = 60 * 30
+    DB_POOL_WARMUP_STAGGER_SECONDS: float = 0.5
+    DB_CREATE_ALL: bool = True
+    DB_REPLICA_URLS: list[str] = []
+    DB_REPLICA_MAX_LAG_SECONDS: float = 5
+    DB_REPLICA_LAG_CHECK_INTERVAL_SECONDS: float = 5
+    READ_YOUR_WRITES_SECONDS: int = 10
+    SHARD_DB_URLS: dict[str, str] = {} # shard name -> url, carts and orders stay on the primary when empty
+    SHARD_VIRTUAL_NODES: int = 64
+    
+    WEB_HOST: str = "0.0.0.0"
+    WEB_PORT: int = 8000
+    WEB_WORKERS: int = 0 # 0 runs one worker per CPU
+    WEB_BACKLOG: int = 2048
+    WEB_GRACEFUL_SHUTDOWN_SECONDS: int = 30
+    COMPRESSION_ENCODINGS: list[str] = ["zstd", "br", "gzip"] # preferred first, br and zstd need brotli and zstandard installed
+    COMPRESSION_MINIMUM_SIZE: int = 1024 # smaller bodies are sent as they are
+    COMPRESSION_MAXIMUM_SIZE: int = 8 * 1024 * 1024 # streamed bodies with a Content-Length up to this are buffered and compressed
+    COMPRESSION_CACHE_MAX_BYTES: int = 32 * 1024 * 1024
+    COMPRESSION_THREAD_MINIMUM_SIZE: int = 64 * 1024 # larger bodies are compressed in a worker thread, off the event loop
+    
     EMAIL_NAME: str
     EMAIL_PASSWORD: str
     EMAIL_SERVER: str
     EMAIL_VERIFICATION_TOKEN_EXPIRATION_SECONDS: int = 60 * 60 * 24 * 7
+    EMAIL_VERIFICATION_SWEEP_INTERVAL_SECONDS: int = 60 * 10
+    EMAIL_VERIFICATION_SWEEP_BATCH_SIZE: int = 500
+    
+    BLOB_STORAGE_BACKEND: str = "local"
+    BLOB_STORAGE_PATH: str = "blobs"
+    S3_BUCKET_NAME: str = "online-shopping-platform"
+    S3_ENDPOINT_URL: str | None = None
+    S3_KEY_PREFIX: str = ""
+    UPLOAD_CHUNK_SIZE: int = 64 * 1024
+    UPLOAD_MAX_SIZE_BYTES: int = 1 * 1024 * 1024
+    UPLOAD_ALLOWED_CONTENT_TYPES: list[str] = ["image/jpeg", "image/png", "image/gif"]
+    BLOB_PUBLIC_URL: str = "/files/blobs"
+    
+    VIRUS_SCANNER: str = "fake"
+    CLAMAV_HOST: str = "localhost"
+    CLAMAV_PORT: int = 3310
+    VIRUS_SCAN_CONCURRENCY: int = 4
+    VIRUS_SCAN_TIMEOUT_SECONDS: int = 30
+    VIRUS_SCAN_RETRY_INTERVAL_SECONDS: int = 60 * 5 # files whose scan failed are scanned again this often
+    
+    CART_STORE_BACKEND: str = "database" # database | memory, memory needs serve.py --workers 1
+    CART_STORE_FLUSH_INTERVAL_SECONDS: float = 2
+    CART_STORE_MAX_CARTS: int = 100_000
+    CART_STORE_ID_BLOCK_SIZE: int = 50
+    CART_STORE_IDLE_SECONDS: int = 60 * 30 # clean carts untouched this long are dropped from memory
+    CART_STORE_EXPIRE_INTERVAL_SECONDS: int = 60
+    CART_IDLE_TTL_SECONDS: int = 60 * 60 * 24 * 30
+    CART_SWEEP_INTERVAL_SECONDS: int = 60 * 60
+    CART_SWEEP_BATCH_SIZE: int = 500
+    CART_SWEEP_VACUUM_THRESHOLD: int = 10_000 # reclaimed rows after which the cart tables are vacuumed
+    
+    PRODUCT_PRICE_BUCKETS: list[int] = [0, 10, 25, 50, 100, 250, 500, 1000] # lower bounds of the search price facets
+    RELATED_PRODUCTS_TOP_K: int = 20
+    RELATED_PRODUCTS_REBUILD_INTERVAL_SECONDS: int = 60 * 60 * 6
+    SUGGEST_CACHE_SIZE: int = 4096
+    SUGGEST_REBUILD_INTERVAL_SECONDS: int = 60 * 5
+    EMBEDDING_PATH: str = "embeddings"
+    EMBEDDING_DIM: int = 256 # hashed n-gram vectors, spaCy vectors keep the size of the model
+    EMBEDDING_SPACY_MODEL: str | None = None # e.g. en_core_web_md, needs requirements-nlp.txt and the model installed
+    EMBEDDING_REBUILD_INTERVAL_SECONDS: int = 60 * 60
+    SEMANTIC_SEARCH_CANDIDATES: int = 200
+    SEMANTIC_SEARCH_MIN_SCORE: float = 0.2
+    PROMOTION_REFRESH_INTERVAL_SECONDS: int = 60
+    LIVE_UPDATES_CHANNEL: str = "product_changes"
+    LIVE_UPDATES_MAX_PRODUCTS: int = 100 # product ids one stream can subscribe to
+    LIVE_UPDATES_KEEPALIVE_SECONDS: int = 15
+    LIVE_UPDATES_RECONNECT_SECONDS: float = 5
+    
+    PROCESS_POOL_WORKERS: int = 2
+    PRODUCT_IMAGE_WIDTHS: list[int] = [160, 320, 640, 1024]
+    PRODUCT_IMAGE_QUALITY: int = 80
 
 @lru_cache(maxsize=1)
 def get_settings():
@@ -2,7 +2,13 @@ from datetime import datetime
 from decimal import Decimal
 from typing import List, Optional
 
-from sqlmodel import Column, DateTime, Field, Relationship, SQLModel
+from pydantic import computed_field
+from sqlalchemy import ForeignKey, Index, UniqueConstraint, func
+from sqlmodel import Column, DateTime, Field, Numeric, Relationship, SQLModel
+
+from core.config import settings
+from schemas.file import FileStatus, ImageStatus
+from schemas.promotion import PromotionKind
 
 
 class UserBase(SQLModel):
@@ -38,6 +44,44 @@ class UserReadWithOrder(UserRead):
     orders: List["OrderRead"] = []
     
 
+class ProductImageBase(SQLModel):
+    product_id: int = Field(foreign_key="product.id", index=True)
+    file_id: int = Field(foreign_key="uploadedfile.id")
+    status: ImageStatus = Field(default=ImageStatus.pending)
+    created_at: datetime = Field(sa_column=Column(DateTime(timezone=True)))
+    updated_at: Optional[datetime] = Field(default=None, sa_column=Column(DateTime(timezone=True), default=None))
+
+class ProductImage(ProductImageBase, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True, index=True)
+    
+    product: Optional["Product"] = Relationship(back_populates="images")
+    variants: List["ProductImageVariant"] = Relationship(back_populates="image", sa_relationship_kwargs={"cascade": "all, delete-orphan"})
+
+class ProductImageVariantBase(SQLModel):
+    image_id: int = Field(foreign_key="productimage.id", index=True)
+    width: int
+    height: int
+    content_type: str
+    sha256: str = Field(index=True)
+
+class ProductImageVariant(ProductImageVariantBase, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True, index=True)
+    
+    image: Optional["ProductImage"] = Relationship(back_populates="variants")
+
+class ProductImageVariantRead(ProductImageVariantBase):
+    id: int
+    
+    @computed_field # type: ignore[misc]
+    @property
+    def url(self) -> str:
+        return f"{settings.BLOB_PUBLIC_URL}/{self.sha256}/"
+
+class ProductImageRead(ProductImageBase):
+    id: int
+    
+    variants: List[ProductImageVariantRead] = []
+    
 class ProductBase(SQLModel):
     name: str = Field(unique=True)
     description: str
@@ -50,16 +94,36 @@ class ProductBase(SQLModel):
     vendor_id: int = Field(foreign_key="user.id")
 
 class Product(ProductBase, table=True):
+    # one index per sort of the list endpoints, with and without a category in front, ending on the id tie breaker
+    __table_args__ = (
+        Index("ix_product_category_id_name", "category_id", "name"),
+        Index("ix_product_category_id_original_price_id", "category_id", "original_price", "id"),
+        Index("ix_product_category_id_created_at_id", "category_id", "created_at", "id"),
+        Index("ix_product_original_price_id", "original_price", "id"),
+        Index("ix_product_created_at_id", "created_at", "id"),
+    )
+    
     id: Optional[int] = Field(default=None, primary_key=True, index=True)
     
     vendor: User = Relationship(back_populates="products")
     cart_items: List["CartItem"] = Relationship(back_populates="product")
     order_items: List["OrderItem"] = Relationship(back_populates="product")
     category: "Category" = Relationship(back_populates="products")
+    images: List["ProductImage"] = Relationship(back_populates="product", sa_relationship_kwargs={"cascade": "all, delete-orphan"})
 
 class ProductRead(ProductBase):
     id: int
     
+    images: List["ProductImageRead"] = []
+    
+    # the price after the best running promotion, looked up in the rules each worker keeps in memory
+    @computed_field # type: ignore[misc]
+    @property
+    def effective_price(self) -> Decimal:
+        from services.promotions import get_promotion_engine
+        
+        return get_promotion_engine().rules.price(self.id, self.category_id, self.vendor_id, self.original_price)
+    
 class ProductReadWithVendor(ProductRead):
     vendor: UserRead
     
@@ -82,7 +146,8 @@ class CategoryRead(CategoryBase):
     products: List["ProductRead"] = []
     
 class CartBase(SQLModel):
-    user_id: Optional[int] = Field(default=None, foreign_key="user.id")
+    # one cart per user, add_to_cart upserts on it
+    user_id: Optional[int] = Field(default=None, foreign_key="user.id", index=True, unique=True)
     created_at: datetime = Field(sa_column=Column(DateTime(timezone=True)))
     updated_at: Optional[datetime] = Field(default=None, sa_column=Column(DateTime(timezone=True), default=None))
     
@@ -92,6 +157,9 @@ class Cart(CartBase, table=True):
     user: Optional["User"] = Relationship(back_populates="cart")
     cart_items: List["CartItem"] = Relationship(back_populates="cart")
 
+# the abandoned cart sweep looks carts up by their last activity
+Index("ix_cart_last_activity_at", func.coalesce(Cart.__table__.c.updated_at, Cart.__table__.c.created_at)) # type: ignore
+
 class CartRead(CartBase):
     id: int
     
@@ -102,13 +170,16 @@ class CartReadWithCartItems(CartRead):
     cart_items: List["CartItemRead"] = []
     
 class CartItemBase(SQLModel):
-    cart_id: Optional[int] = Field(default=None, foreign_key="cart.id")
+    cart_id: Optional[int] = Field(default=None, foreign_key="cart.id", index=True)
     product_id: Optional[int] = Field(default=None, foreign_key="product.id")
     quantity: int = Field(default=0, ge=0)
     created_at: datetime = Field(sa_column=Column(DateTime(timezone=True)))
     updated_at: Optional[datetime] = Field(default=None, sa_column=Column(DateTime(timezone=True), default=None))
     
 class CartItem(CartItemBase, table=True):
+    # a product is in a cart at most once, add_to_cart relies on it to detect duplicates
+    __table_args__ = (UniqueConstraint("cart_id", "product_id"),)
+    
     id: Optional[int] = Field(default=None, primary_key=True, index=True)
     
     cart: Optional["Cart"] = Relationship(back_populates="cart_items")
@@ -149,6 +220,9 @@ class OrderItemBase(SQLModel):
     order_id: Optional[int] = Field(default=None, foreign_key="order.id")
     product_id: Optional[int] = Field(default=None, foreign_key="product.id")
     quantity: int = Field(default=0, ge=0)
+    # price paid per unit after promotions and the promotion that set it, empty on orders placed before promotions
+    unit_price: Optional[Decimal] = Field(default=None, sa_column=Column(Numeric(scale=2), default=None))
+    promotion_id: Optional[int] = Field(default=None, foreign_key="promotion.id")
     created_at: datetime = Field(sa_column=Column(DateTime(timezone=True)))
     updated_at: Optional[datetime] = Field(default=None, sa_column=Column(DateTime(timezone=True), default=None))
     
@@ -167,6 +241,47 @@ class OrderItemReadWithOrder(OrderItemRead):
 class OrderItemReadWithProduct(OrderItemRead):
     product: Optional[ProductRead] = None
 
+class PromotionBase(SQLModel):
+    name: str
+    kind: PromotionKind
+    value: Decimal = Field(decimal_places=2, gt=0)
+    # at most one scope is set, none applies the promotion to every product
+    product_id: Optional[int] = Field(default=None, foreign_key="product.id", index=True)
+    category_id: Optional[int] = Field(default=None, foreign_key="category.id")
+    vendor_id: Optional[int] = Field(default=None, foreign_key="user.id")
+    starts_at: Optional[datetime] = Field(default=None, sa_column=Column(DateTime(timezone=True), default=None))
+    ends_at: Optional[datetime] = Field(default=None, sa_column=Column(DateTime(timezone=True), default=None, index=True))
+    voucher_code: Optional[str] = Field(default=None, unique=True) # only applies at checkouts that enter the code
+    max_uses: Optional[int] = Field(default=None, ge=1)
+    uses: int = Field(default=0, ge=0)
+    created_by: int = Field(foreign_key="user.id")
+    created_at: datetime = Field(sa_column=Column(DateTime(timezone=True)))
+
+class Promotion(PromotionBase, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True, index=True)
+
+class PromotionRead(PromotionBase):
+    id: int
+
+class InvoiceBase(SQLModel):
+    order_id: int = Field(sa_column=Column(ForeignKey("order.id", ondelete="CASCADE"), unique=True, nullable=False))
+    language: str
+    sha256: str # blob storage key of the rendered document, also its ETag
+    content_type: str
+    size: int
+    created_at: datetime = Field(sa_column=Column(DateTime(timezone=True)))
+
+# Rendered once per order in the language configured at the time, an issued invoice never changes
+class Invoice(InvoiceBase, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True, index=True)
+
+# How often two products were bought in the same order, both directions are stored. Rebuilt from orderitem and cut
+# down to the top RELATED_PRODUCTS_TOP_K per product, checkouts in between add their pairs on top
+class ProductCooccurrence(SQLModel, table=True):
+    product_id: int = Field(sa_column=Column(ForeignKey("product.id", ondelete="CASCADE"), primary_key=True))
+    related_product_id: int = Field(sa_column=Column(ForeignKey("product.id", ondelete="CASCADE"), primary_key=True))
+    count: int = Field(default=0)
+
 class UserReadAll(UserRead):
     products: List[ProductRead] = []
     cart: Optional[CartReadWithCartItems] = None
@@ -178,8 +293,31 @@ class CartReadAll(CartRead):
 
 class EmailVerificationBase(SQLModel):
     email: str = Field(unique=True)
-    token: str = Field(unique=True)
-    expires_at: datetime = Field(sa_column=Column(DateTime(timezone=True)))
+    token_hash: str = Field(unique=True, index=True) # sha256 of the token sent by email, the raw token is never stored
+    expires_at: datetime = Field(sa_column=Column(DateTime(timezone=True), index=True))
     
 class EmailVerification(EmailVerificationBase, table=True):
     id: Optional[int] = Field(default=None, primary_key=True, index=True)
+
+class UploadedFileBase(SQLModel):
+    filename: str
+    content_type: str
+    size: int
+    sha256: str = Field(index=True)
+    uploader_id: Optional[int] = Field(default=None, foreign_key="user.id")
+    status: FileStatus = Field(default=FileStatus.pending, index=True)
+    scan_result: Optional[str] = Field(default=None)
+    scanned_at: Optional[datetime] = Field(default=None, sa_column=Column(DateTime(timezone=True), default=None))
+    created_at: datetime = Field(sa_column=Column(DateTime(timezone=True)))
+
+class UploadedFile(UploadedFileBase, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True, index=True)
+
+class UploadedFileRead(UploadedFileBase):
+    id: int
+
+class UploadedFileStatusRead(SQLModel):
+    id: int
+    status: FileStatus
+    scan_result: Optional[str] = None
+    scanned_at: Optional[datetime] = None
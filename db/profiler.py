@@ -0,0 +1,65 @@
+import json
+import logging
+import time
+
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from core.config import settings
+from services.metrics import db_queries_total
+
+slow_query_logger = logging.getLogger("db.slow_query")
+
+
+@dataclass
+class QueryStats:
+    count: int = 0
+    total_ns: int = 0
+    slowest_ns: int = 0
+    slowest_statement: str | None = None
+    # the ASGI scope of the request, the matched route is only known once routing happened
+    scope: dict[str, Any] = field(default_factory=dict)
+
+    @property
+    def route(self) -> str | None:
+        route = self.scope.get("route")
+        return getattr(route, "path", None)
+
+# Set by the metrics middleware for the duration of a request, queries run outside a request are only counted globally
+current_query_stats: ContextVar[QueryStats | None] = ContextVar("current_query_stats", default=None)
+
+# Listening on the Engine class instruments every engine, including the ones created by the tests
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start_ns", []).append(time.perf_counter_ns())
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed_ns = time.perf_counter_ns() - conn.info["query_start_ns"].pop()
+    db_queries_total.inc()
+    
+    stats = current_query_stats.get()
+    if stats is not None:
+        stats.count += 1
+        stats.total_ns += elapsed_ns
+        if elapsed_ns > stats.slowest_ns:
+            stats.slowest_ns = elapsed_ns
+            stats.slowest_statement = statement
+    
+    if elapsed_ns >= settings.SLOW_QUERY_THRESHOLD_MS * 1_000_000:
+        log_slow_query(statement, elapsed_ns, stats)
+
+def log_slow_query(statement: str, elapsed_ns: int, stats: QueryStats | None):
+    # parameters are left out on purpose, they may contain credentials or personal data
+    payload = {
+        "event": "slow_query",
+        "duration_ms": round(elapsed_ns / 1e6, 3),
+        "method": stats.scope.get("method") if stats is not None else None,
+        "route": stats.route if stats is not None else None,
+        "statement": " ".join(statement.split())[:settings.SLOW_QUERY_MAX_STATEMENT_LENGTH],
+    }
+    slow_query_logger.warning(json.dumps(payload))
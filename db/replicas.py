@@ -0,0 +1,77 @@
+# https://www.postgresql.org/docs/current/functions-admin.html#FUNCTIONS-RECOVERY-INFO-TABLE
+import itertools
+import logging
+import threading
+import time
+
+from functools import lru_cache
+from typing import Callable
+
+from sqlalchemy import Engine, text
+
+from core.config import settings
+from db.engine import engine_options, get_db
+
+logger = logging.getLogger(__name__)
+
+# Seconds since the last replayed transaction, 0 when the replica has replayed everything it received
+# (an idle primary produces no new transactions, so the replay timestamp alone would keep growing).
+# A database that is not in recovery is a primary or a plain copy and never lags
+REPLICA_LAG_QUERY = text("""
+SELECT CASE
+    WHEN NOT pg_is_in_recovery() THEN 0
+    WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+END
+""")
+
+
+def measure_replica_lag(engine: Engine) -> float:
+    with engine.connect() as connection:
+        return float(connection.execute(REPLICA_LAG_QUERY).scalar_one())
+
+# Picks the replica for read only endpoints. Lag is measured at most once per check interval (per worker),
+# replicas that lag more than the tolerance or fail the check are skipped until the next check, and when no
+# replica is usable reads go to the primary
+class ReplicaRouter:
+    def __init__(self, engines: list[Engine], max_lag_seconds: float, check_interval_seconds: float, probe: Callable[[Engine], float] = measure_replica_lag, clock: Callable[[], float] = time.monotonic):
+        self.engines = engines
+        self.max_lag_seconds = max_lag_seconds
+        self.check_interval_seconds = check_interval_seconds
+        self.probe = probe
+        self.clock = clock
+        self.healthy: list[Engine] = []
+        self.checked_at: float | None = None
+        self._round_robin = itertools.count()
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        healthy = []
+        for engine in self.engines:
+            try:
+                lag = self.probe(engine)
+            except Exception as e:
+                logger.warning("Replica %s is unavailable: %s", engine.url.render_as_string(hide_password=True), e)
+                continue
+            if lag <= self.max_lag_seconds:
+                healthy.append(engine)
+            else:
+                logger.warning("Replica %s lags %.1fs behind the primary", engine.url.render_as_string(hide_password=True), lag)
+        self.healthy = healthy
+        self.checked_at = self.clock()
+
+    def choose(self) -> Engine | None:
+        if not self.engines:
+            return None
+        with self._lock:
+            if self.checked_at is None or self.clock() - self.checked_at >= self.check_interval_seconds:
+                self.refresh()
+        healthy = self.healthy
+        if not healthy:
+            return None
+        return healthy[next(self._round_robin) % len(healthy)]
+
+@lru_cache(maxsize=1)
+def get_replica_router() -> ReplicaRouter:
+    engines = [get_db(url, engine_options()) for url in settings.DB_REPLICA_URLS]
+    return ReplicaRouter(engines, settings.DB_REPLICA_MAX_LAG_SECONDS, settings.DB_REPLICA_LAG_CHECK_INTERVAL_SECONDS)
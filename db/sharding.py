@@ -0,0 +1,102 @@
+# https://en.wikipedia.org/wiki/Consistent_hashing
+import bisect
+import hashlib
+
+from functools import lru_cache
+
+from sqlalchemy import Engine, MetaData, Table
+from sqlmodel import Session
+
+from core.config import settings
+from db.engine import engine_options, get_db, get_engine
+from db.models import Cart, CartItem, Invoice, Order, OrderItem
+
+# Everything a user's cart and orders are made of lives on the shard of that user. The catalog and the users
+# stay on the primary, a sharded row only keeps the id of the user or product it belongs to
+SHARDED_MODELS = [Cart, CartItem, Order, OrderItem, Invoice]
+SHARDED_TABLES = [model.__table__ for model in SHARDED_MODELS] # type: ignore
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+# Every shard owns many points on the ring, so keys spread evenly and adding a shard only moves the keys of
+# the ring segments it takes over (about 1/N of them) instead of rehashing every user
+class HashRing:
+    def __init__(self, nodes: list[str], vnodes: int = 64):
+        self.vnodes = vnodes
+        self._points: list[int] = []
+        self._nodes: list[str] = []
+        for node in nodes:
+            self.add_node(node)
+
+    def add_node(self, node: str):
+        for i in range(self.vnodes):
+            point = _hash(f"{node}#{i}")
+            index = bisect.bisect(self._points, point)
+            self._points.insert(index, point)
+            self._nodes.insert(index, node)
+
+    def remove_node(self, node: str):
+        kept = [(point, owner) for point, owner in zip(self._points, self._nodes) if owner != node]
+        self._points = [point for point, _ in kept]
+        self._nodes = [owner for _, owner in kept]
+
+    def get_node(self, key: str | int) -> str:
+        if not self._points:
+            raise LookupError("The hash ring has no nodes")
+        index = bisect.bisect(self._points, _hash(str(key))) % len(self._points)
+        return self._nodes[index]
+
+@lru_cache(maxsize=1)
+def get_shard_engines() -> dict[str, Engine]:
+    return {name: get_db(url, engine_options()) for name, url in settings.SHARD_DB_URLS.items()}
+
+@lru_cache(maxsize=1)
+def get_hash_ring() -> HashRing:
+    return HashRing(sorted(settings.SHARD_DB_URLS), settings.SHARD_VIRTUAL_NODES)
+
+def is_sharded() -> bool:
+    return bool(settings.SHARD_DB_URLS)
+
+# every database holding cart and order tables, for jobs that scan all of them
+def get_cart_engines() -> list[Engine]:
+    if not is_sharded():
+        return [get_engine()]
+    return list(get_shard_engines().values())
+
+def get_shard_engine(user_id: int) -> Engine:
+    if not is_sharded():
+        return get_engine()
+    return get_shard_engines()[get_hash_ring().get_node(user_id)]
+
+# The session routes every statement by the model it touches: cart and order tables to the user's shard, everything
+# else to the primary. A query joining a sharded and a global table cannot work and has to be split in two
+def shard_session(user_id: int) -> Session:
+    shard = get_shard_engine(user_id)
+    return Session(bind=get_engine(), binds={model: shard for model in SHARDED_MODELS})
+
+# The shard schema holds the sharded tables only, foreign keys to the global tables on the primary are left out
+def shard_metadata() -> MetaData:
+    metadata = MetaData()
+    sharded = {table.name for table in SHARDED_TABLES}
+    for table in SHARDED_TABLES:
+        copy: Table = table.to_metadata(metadata)
+        for constraint in list(copy.foreign_key_constraints):
+            # the referred table is not part of this metadata, its name is read from the unresolved target
+            if constraint.elements[0].target_fullname.split(".")[0] not in sharded:
+                copy.constraints.discard(constraint)
+                for foreign_key in constraint.elements:
+                    foreign_key.parent.foreign_keys.discard(foreign_key)
+                    copy.foreign_keys.discard(foreign_key)
+    return metadata
+
+def create_shard_schemas():
+    metadata = shard_metadata()
+    for engine in get_shard_engines().values():
+        metadata.create_all(engine)
+
+def drop_shard_schemas():
+    metadata = shard_metadata()
+    for engine in get_shard_engines().values():
+        metadata.drop_all(engine)
@@ -2,34 +2,89 @@
 
 # Case study on StackOverflow: https://www.linkedin.com/pulse/case-study-how-stackoverflows-monolith-beats-navjot-bansal
 
-import time
+import asyncio
 
 from contextlib import asynccontextmanager
 
-import uvicorn
-
-from fastapi import APIRouter, FastAPI, Request, Response
+from fastapi import APIRouter, FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, PlainTextResponse
+from sqlalchemy import Engine
 from sqlmodel import Session, SQLModel
 
 from api.api_cart import carts_router
 from api.api_files import files_router
 from api.api_order import orders_router
 from api.api_product import products_router
+from api.api_promotion import promotions_router
 from api.api_user import users_router
-from db.engine import DB_URL, get_db
+from auth.auth import read_private_key, read_public_key
+from core.config import settings
+from db.engine import get_engine, schema_lock, warm_up_pool
+from db.sharding import create_shard_schemas
+from services.cart_store import InMemoryCartStore, get_cart_store
+from services.embeddings import build_product_embeddings, get_embedding_store
+from services.maintenance import register_maintenance_jobs
+from services.metrics import caches, registry
+from services.product_events import get_product_broadcaster
+from services.promotions import get_promotion_engine
+from services.recommendations import register_recommendation_jobs
+from services.scheduler import scheduler
+from services.suggestions import get_suggestion_index
+from services.virus_scan import get_virus_scan_service
+from services.workers import get_worker_index, is_leader_worker, shutdown_process_pool
+from utils.middleware import CompressionMiddleware, MetricsMiddleware, ReadYourWritesMiddleware
 from utils.utils import set_default_product_categories
 
 
+# run by every worker, not just the leader: the first to take the lock creates the tables and the others wait, so their
+# suggestion index and promotion rules are never loaded from a database without tables
+def create_schema(engine: Engine):
+    with schema_lock(engine):
+        SQLModel.metadata.create_all(engine)
+        create_shard_schemas()
+        with Session(engine) as session:
+            set_default_product_categories(session)
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    engine = get_db(DB_URL, {"echo": True})
-    SQLModel.metadata.drop_all(engine) # ! remove this line when deploying to production
-    SQLModel.metadata.create_all(engine)
-    set_default_product_categories(Session(engine)) # ! remove this line when deploying to production
+    engine = get_engine()
+    leader = is_leader_worker()
+    # only creates what is missing, resetting the schema is done with scripts/reset_db.py
+    if settings.DB_CREATE_ALL:
+        await asyncio.to_thread(create_schema, engine)
+    # workers connect one after another instead of all hitting the database at the same moment
+    await asyncio.sleep(get_worker_index() * settings.DB_POOL_WARMUP_STAGGER_SECONDS)
+    await asyncio.to_thread(warm_up_pool, engine, settings.DB_POOL_SIZE)
+    register_maintenance_jobs(scheduler, engine, get_cart_store())
+    register_recommendation_jobs(scheduler)
+    # every worker answers suggestions from its own index, built before the first request
+    await asyncio.to_thread(get_suggestion_index().rebuild)
+    scheduler.add_job("rebuild_suggestion_index", get_suggestion_index().rebuild, settings.SUGGEST_REBUILD_INTERVAL_SECONDS)
+    # every worker prices products from its own copy of the promotion rules
+    await asyncio.to_thread(get_promotion_engine().refresh)
+    scheduler.add_job("refresh_promotions", get_promotion_engine().refresh, settings.PROMOTION_REFRESH_INTERVAL_SECONDS)
+    # a fresh deployment has no vectors yet, semantic search is empty until the first build is published
+    scheduler.add_job("build_product_embeddings", build_product_embeddings, settings.EMBEDDING_REBUILD_INTERVAL_SECONDS, leader_only=True, run_now=not get_embedding_store().is_built())
+    # only carts held in memory have changes waiting to be written
+    if isinstance(get_cart_store(), InMemoryCartStore):
+        scheduler.add_job("flush_cart_store", get_cart_store().flush, settings.CART_STORE_FLUSH_INTERVAL_SECONDS)
+    scheduler.add_job("rescan_failed_uploads", get_virus_scan_service().requeue_failed, settings.VIRUS_SCAN_RETRY_INTERVAL_SECONDS, leader_only=True)
+    scheduler.start(leader=leader)
+    get_virus_scan_service().start()
+    # uploads left pending by the previous run are queued again once, by the leader
+    if leader:
+        await asyncio.to_thread(get_virus_scan_service().requeue)
+    get_product_broadcaster().start()
     yield
+    await get_product_broadcaster().stop()
+    await get_virus_scan_service().stop()
+    await scheduler.stop()
+    await asyncio.to_thread(get_cart_store().flush)
+    shutdown_process_pool()
 
-app = FastAPI(lifespan=lifespan)
+# plain dict responses (errors, login tokens) are encoded with orjson as well
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -39,24 +94,31 @@ app.add_middleware(
     allow_headers=["*"]
 )
 
-@app.middleware("http")
-async def add_process_time_header(request: Request, call_next):
-    start_time = time.time()
-    response: Response = await call_next(request)
-    process_time = time.time() - start_time
-    response.headers["X-Process-Time"] = str(process_time)
-    return response
+app.add_middleware(CompressionMiddleware)
+app.add_middleware(ReadYourWritesMiddleware)
+app.add_middleware(MetricsMiddleware)
+
+caches.register_lru_cache("public_key", read_public_key)
+caches.register_lru_cache("private_key", read_private_key)
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
 
 api_router = APIRouter()
 api_router.include_router(users_router, prefix="/users", tags=["Users"])
 api_router.include_router(products_router, prefix="/products", tags=["Products"])
 api_router.include_router(carts_router, prefix="/carts", tags=["Carts"])
 api_router.include_router(orders_router, prefix="/orders", tags=["Orders"])
+api_router.include_router(promotions_router, prefix="/promotions", tags=["Promotions"])
 api_router.include_router(files_router, prefix="/files", tags=["Files"])
 
 app.include_router(api_router)
 
+# development server with auto reload, run serve.py in production
 if __name__ == "__main__":
+    import uvicorn
+
     uvicorn.run("main:app", log_level="info", reload=True)
 
 
@@ -0,0 +1,13 @@
+from enum import Enum
+
+
+class ImageStatus(str, Enum):
+    pending = "pending"
+    ready = "ready"
+    failed = "failed"
+
+class FileStatus(str, Enum):
+    pending = "pending"
+    clean = "clean"
+    infected = "infected"
+    error = "error"
@@ -1,9 +1,11 @@
 from decimal import Decimal
 from enum import Enum
-from typing import Annotated
+from typing import Annotated, Literal
 
 from pydantic import BaseModel, Field, PositiveInt
 
+from db.models import ProductReadWithVendor
+
 
 class ProductCategory(str, Enum):
     electronics = "Electronics"
@@ -23,6 +25,25 @@ class ProductCategory(str, Enum):
     tools_and_hardware = "Tools and Hardware"
     music_and_instruments = "Music and Instruments"
 
+class ProductSort(str, Enum):
+    name = "name"
+    price_asc = "price_asc"
+    price_desc = "price_desc"
+    newest = "newest"
+
+# keyword: name ILIKE, semantic: closest product vectors, hybrid: both rankings fused
+class SearchMode(str, Enum):
+    keyword = "keyword"
+    semantic = "semantic"
+    hybrid = "hybrid"
+
+# query parameters shared by the product list endpoints, sort falls back to the endpoint's own order
+class ProductListQuery(BaseModel):
+    min_price: Annotated[Decimal, Field(ge=0)] | None = None
+    max_price: Annotated[Decimal, Field(ge=0)] | None = None
+    in_stock: bool | None = None
+    sort: ProductSort | None = None
+
 class ProductBase(BaseModel):
     name: str
     description: str
@@ -43,3 +64,34 @@ class ProductUpdate(ProductCreate):
 
 class ProductAddToCart(BaseModel):
     quantity: PositiveInt = Field(..., ge=0)
+
+class CategoryFacet(BaseModel):
+    name: str
+    count: int
+
+# prices from min_price up to, not including, max_price, the last bucket has no upper bound
+class PriceBucketFacet(BaseModel):
+    min_price: Decimal
+    max_price: Decimal | None = None
+    count: int
+
+class ProductFacets(BaseModel):
+    categories: list[CategoryFacet] = []
+    price_buckets: list[PriceBucketFacet] = []
+    in_stock: int = 0
+    out_of_stock: int = 0
+
+class ProductSearchPage(BaseModel):
+    products: list[ProductReadWithVendor]
+    facets: ProductFacets
+
+class ProductSuggestion(BaseModel):
+    kind: Literal["product", "category"]
+    id: int
+    text: str
+
+# pushed to the subscribers of a product whenever its stock or price changes, always the current values
+class ProductChange(BaseModel):
+    product_id: int
+    available_quantity: int
+    original_price: Decimal
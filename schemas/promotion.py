@@ -0,0 +1,35 @@
+from decimal import Decimal
+from enum import Enum
+from typing import Annotated
+
+from pydantic import AwareDatetime, BaseModel, Field, PositiveInt, model_validator
+
+
+class PromotionKind(str, Enum):
+    percentage = "percentage" # value is the percent taken off
+    fixed = "fixed" # value is the amount taken off the unit price
+
+# Applies to one product, one category or one vendor's products, or to everything when no scope is given
+class PromotionCreate(BaseModel):
+    name: str
+    kind: PromotionKind
+    value: Annotated[Decimal, Field(..., gt=0, decimal_places=2)]
+    product_id: int | None = None
+    category_id: int | None = None
+    vendor_id: int | None = None
+    starts_at: AwareDatetime | None = None
+    ends_at: AwareDatetime | None = None
+    voucher_code: str | None = None
+    max_uses: PositiveInt | None = None
+
+    @model_validator(mode="after")
+    def check_rule(self) -> "PromotionCreate":
+        if self.kind == PromotionKind.percentage and self.value > 100:
+            raise ValueError("A percentage discount cannot exceed 100")
+        if sum(scope is not None for scope in (self.product_id, self.category_id, self.vendor_id)) > 1:
+            raise ValueError("A promotion applies to one product, category or vendor at most")
+        if self.starts_at is not None and self.ends_at is not None and self.ends_at <= self.starts_at:
+            raise ValueError("ends_at must be after starts_at")
+        if self.max_uses is not None and self.voucher_code is None:
+            raise ValueError("Only vouchers have a maximum number of uses")
+        return self
@@ -0,0 +1,20 @@
+"""Vectorizes the name and description of every product into the memory mapped matrix used by semantic search.
+
+Uses the spaCy model from EMBEDDING_SPACY_MODEL when it is installed, hashed n-gram vectors otherwise. The app
+rebuilds the vectors every EMBEDDING_REBUILD_INTERVAL_SECONDS, run this after a bulk import or a model change:
+
+    python -m scripts.build_embeddings
+"""
+import time
+
+from services.embeddings import build_product_embeddings, get_embedder, get_embedding_store
+
+
+def main():
+    embedder = get_embedder()
+    start = time.perf_counter()
+    count = build_product_embeddings()
+    print(f"Embedded {count} products with {embedder.name} into {get_embedding_store().path} in {time.perf_counter() - start:.1f}s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""Startup time profile of the app, built from the interpreter's -X importtime report.
+
+Imports a module in a fresh interpreter and prints the slowest imports, by cumulative time (the module and
+everything it imported first) and by self time:
+
+    python -m scripts.profile_imports
+    python -m scripts.profile_imports --module api.api_user --top 20
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+from dataclasses import dataclass
+
+
+@dataclass
+class ImportTiming:
+    module: str
+    depth: int
+    self_us: int
+    cumulative_us: int
+
+def parse_importtime(report: str) -> list[ImportTiming]:
+    # import time: self [us] | cumulative | imported package
+    timings = []
+    for line in report.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        self_us, cumulative_us, name = line.removeprefix("import time:").split("|")
+        depth = (len(name) - len(name.lstrip(" "))) // 2
+        timings.append(ImportTiming(module=name.strip(), depth=depth, self_us=int(self_us), cumulative_us=int(cumulative_us)))
+    return timings
+
+def profile(module: str) -> tuple[list[ImportTiming], float]:
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], capture_output=True, text=True, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    elapsed = time.perf_counter() - start
+    if result.returncode != 0:
+        raise SystemExit(result.stderr)
+    return parse_importtime(result.stderr), elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="main")
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    timings, elapsed = profile(args.module)
+    target = next((timing for timing in timings if timing.module == args.module), None)
+    total_ms = target.cumulative_us / 1000 if target else sum(timing.self_us for timing in timings) / 1000
+
+    print(f"import {args.module}: {total_ms:.1f} ms of imports, {elapsed * 1000:.1f} ms including interpreter startup\n")
+
+    # direct dependencies of the profiled module show which of its imports are worth deferring
+    children = [timing for timing in timings if target and timing.depth == target.depth + 1]
+    print(f"Imported by {args.module} (cumulative ms)")
+    for timing in sorted(children, key=lambda timing: timing.cumulative_us, reverse=True)[:args.top]:
+        print(f"  {timing.cumulative_us / 1000:8.1f}  {timing.module}")
+
+    print("\nSlowest modules (self ms)")
+    for timing in sorted(timings, key=lambda timing: timing.self_us, reverse=True)[:args.top]:
+        print(f"  {timing.self_us / 1000:8.1f}  {timing.module}")
+
+if __name__ == "__main__":
+    main()
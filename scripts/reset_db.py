@@ -0,0 +1,26 @@
+"""Drops and recreates every table (on the primary and every shard), then inserts the default product categories.
+
+Destroys all data, only meant for development and benchmark databases:
+
+    python -m scripts.reset_db
+"""
+from sqlmodel import Session, SQLModel
+
+from db.engine import get_engine
+from db.sharding import create_shard_schemas, drop_shard_schemas
+from utils.utils import set_default_product_categories
+
+
+def main():
+    engine = get_engine()
+    SQLModel.metadata.drop_all(engine)
+    SQLModel.metadata.create_all(engine)
+    drop_shard_schemas()
+    create_shard_schemas()
+    with Session(engine) as session:
+        set_default_product_categories(session)
+    engine.dispose()
+    print(f"Reset {engine.url.render_as_string(hide_password=True)}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""Production entry point: a pre-forking launcher for uvicorn workers.
+
+The app is imported once in the master process, then the master binds the listening socket and forks the workers,
+so every worker shares the imported modules copy on write and accepts connections from the same socket.
+
+    python serve.py --workers 4 --port 8000
+
+uvloop and httptools are used when they are installed. On SIGTERM or SIGINT every worker stops accepting
+connections, finishes the requests in flight and runs the lifespan shutdown, workers still busy after the grace
+period are killed.
+"""
+import argparse
+import logging
+import os
+import signal
+import socket
+import time
+
+import uvicorn
+
+from core.config import settings
+
+logger = logging.getLogger("serve")
+
+
+def bind_socket(host: str, port: int, backlog: int) -> socket.socket:
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+def run_worker(index: int, sock: socket.socket, app, args: argparse.Namespace) -> int:
+    # read by the lifespan hook: worker 0 is the leader, the others stagger their pool warm up by their index
+    os.environ["WORKER_INDEX"] = str(index)
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, signal.SIG_DFL)
+
+    config = uvicorn.Config(
+        app,
+        loop="auto", # uvloop when installed
+        http="auto", # httptools when installed
+        lifespan="on",
+        log_level=args.log_level,
+        proxy_headers=True,
+        timeout_graceful_shutdown=args.graceful_timeout,
+    )
+    # uvicorn installs its own SIGTERM/SIGINT handlers that drain the server before the lifespan shutdown
+    server = uvicorn.Server(config)
+    server.run(sockets=[sock])
+    return 0 if server.started else 1
+
+class Master:
+    def __init__(self, app, sock: socket.socket, args: argparse.Namespace):
+        self.app = app
+        self.sock = sock
+        self.args = args
+        self.workers: dict[int, int] = {} # pid -> worker index
+        self.stopping = False
+        self.deadline: float | None = None
+
+    def spawn(self, index: int):
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                code = run_worker(index, self.sock, self.app, self.args)
+            finally:
+                os._exit(code)
+        self.workers[pid] = index
+        logger.info("Started worker %s (pid %s)", index, pid)
+
+    def stop(self, signum, frame):
+        if self.stopping:
+            return
+        logger.info("Received %s, draining %s workers", signal.Signals(signum).name, len(self.workers))
+        self.stopping = True
+        # a little longer than the workers' own grace period so they can finish the lifespan shutdown
+        self.deadline = time.monotonic() + self.args.graceful_timeout + 5
+        for pid in self.workers:
+            os.kill(pid, signal.SIGTERM)
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        os.environ["WORKER_COUNT"] = str(self.args.workers)
+        for index in range(self.args.workers):
+            self.spawn(index)
+
+        while self.workers:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if pid == 0:
+                if self.deadline is not None and time.monotonic() > self.deadline:
+                    for pid in self.workers:
+                        logger.warning("Worker %s did not stop in time, killing it", self.workers[pid])
+                        os.kill(pid, signal.SIGKILL)
+                    self.deadline = None
+                time.sleep(0.2)
+                continue
+
+            index = self.workers.pop(pid, None)
+            if index is None or self.stopping:
+                continue
+            logger.warning("Worker %s (pid %s) exited with status %s, restarting it", index, pid, os.waitstatus_to_exitcode(status))
+            time.sleep(1)
+            self.spawn(index)
+
+        self.sock.close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default=settings.WEB_HOST)
+    parser.add_argument("--port", type=int, default=settings.WEB_PORT)
+    parser.add_argument("--workers", type=int, default=settings.WEB_WORKERS or os.cpu_count() or 1)
+    parser.add_argument("--backlog", type=int, default=settings.WEB_BACKLOG)
+    parser.add_argument("--graceful-timeout", type=int, default=settings.WEB_GRACEFUL_SHUTDOWN_SECONDS)
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+    logging.basicConfig(level=args.log_level.upper(), format="%(asctime)s %(name)s %(levelname)s %(message)s")
+
+    # preload: the app and its dependencies are imported once, before the fork. Database engines, the process
+    # pool and background tasks are all created lazily in the lifespan hook, so no connection crosses the fork
+    from main import app
+
+    sock = bind_socket(args.host, args.port, args.backlog)
+    logger.info("Listening on %s:%s with %s workers", args.host, args.port, args.workers)
+    Master(app, sock, args).run()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+import asyncio
+import hashlib
+import os
+import tempfile
+
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import AsyncIterable, Iterator
+
+from core.config import settings
+
+
+class BlobTooLargeError(Exception):
+    pass
+
+@dataclass
+class StoredBlob:
+    key: str
+    size: int
+
+# Blobs are content addressed: the key is the sha256 of the content, so the same file uploaded twice is stored once
+class BlobStorage(ABC):
+    def __init__(self, tmp_dir: str | None = None, chunk_size: int = settings.UPLOAD_CHUNK_SIZE):
+        self.tmp_dir = tmp_dir
+        self.chunk_size = chunk_size
+
+    async def save(self, chunks: AsyncIterable[bytes], max_size: int | None = None) -> StoredBlob:
+        tmp_path, key, size = await self._spool(chunks, max_size)
+        try:
+            await asyncio.to_thread(self._commit, tmp_path, key)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return StoredBlob(key=key, size=size)
+
+    def save_bytes(self, data: bytes) -> StoredBlob:
+        key = hashlib.sha256(data).hexdigest()
+        fd, tmp_path = tempfile.mkstemp(dir=self.tmp_dir, prefix="upload-")
+        try:
+            with os.fdopen(fd, "wb") as tmp_file:
+                tmp_file.write(data)
+            self._commit(tmp_path, key)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return StoredBlob(key=key, size=len(data))
+
+    # the body is hashed and size checked chunk by chunk while it is written to a temporary file,
+    # it is never held in memory as a whole
+    async def _spool(self, chunks: AsyncIterable[bytes], max_size: int | None) -> tuple[str, str, int]:
+        digest = hashlib.sha256()
+        size = 0
+        # file writes run in the thread pool, a slow disk must not stall the event loop
+        fd, tmp_path = await asyncio.to_thread(tempfile.mkstemp, dir=self.tmp_dir, prefix="upload-")
+        try:
+            with os.fdopen(fd, "wb") as tmp_file:
+                async for chunk in chunks:
+                    size += len(chunk)
+                    if max_size is not None and size > max_size:
+                        raise BlobTooLargeError(f"Blob is larger than {max_size} bytes")
+                    digest.update(chunk)
+                    await asyncio.to_thread(tmp_file.write, chunk)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        return tmp_path, digest.hexdigest(), size
+
+    @abstractmethod
+    def _commit(self, tmp_path: str, key: str):
+        ...
+
+    @abstractmethod
+    def exists(self, key: str) -> bool:
+        ...
+
+    @abstractmethod
+    def iter_chunks(self, key: str) -> Iterator[bytes]:
+        ...
+
+    def read(self, key: str) -> bytes:
+        return b"".join(self.iter_chunks(key))
+
+    @abstractmethod
+    def delete(self, key: str):
+        ...
+
+class LocalBlobStorage(BlobStorage):
+    def __init__(self, root: str, chunk_size: int = settings.UPLOAD_CHUNK_SIZE):
+        self.root = os.path.abspath(root)
+        tmp_dir = os.path.join(self.root, "tmp")
+        os.makedirs(tmp_dir, exist_ok=True)
+        # the temporary directory lives under the same root so the final move is an atomic rename
+        super().__init__(tmp_dir=tmp_dir, chunk_size=chunk_size)
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key[2:4], key)
+
+    def _commit(self, tmp_path: str, key: str):
+        path = self.path(key)
+        if os.path.exists(path):
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(tmp_path, path)
+
+    def exists(self, key: str) -> bool:
+        return os.path.exists(self.path(key))
+
+    def iter_chunks(self, key: str) -> Iterator[bytes]:
+        with open(self.path(key), "rb") as file:
+            while chunk := file.read(self.chunk_size):
+                yield chunk
+
+    def delete(self, key: str):
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+# Works with any S3 compatible server (AWS, MinIO, LocalStack) through S3_ENDPOINT_URL
+class S3BlobStorage(BlobStorage):
+    def __init__(self, bucket: str, endpoint_url: str | None = None, prefix: str = "", chunk_size: int = settings.UPLOAD_CHUNK_SIZE, client=None):
+        super().__init__(chunk_size=chunk_size)
+        self.bucket = bucket
+        self.prefix = prefix
+        if client is None:
+            import boto3
+
+            client = boto3.client("s3", endpoint_url=endpoint_url)
+        self.client = client
+
+    def object_key(self, key: str) -> str:
+        return f"{self.prefix}{key}"
+
+    def _commit(self, tmp_path: str, key: str):
+        if self.exists(key):
+            return
+        # upload_file switches to a multipart upload for large files and streams them from disk
+        self.client.upload_file(tmp_path, self.bucket, self.object_key(key))
+
+    def exists(self, key: str) -> bool:
+        from botocore.exceptions import ClientError
+
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self.object_key(key))
+            return True
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("404", "NoSuchKey"):
+                return False
+            raise
+
+    def iter_chunks(self, key: str) -> Iterator[bytes]:
+        response = self.client.get_object(Bucket=self.bucket, Key=self.object_key(key))
+        yield from response["Body"].iter_chunks(chunk_size=self.chunk_size)
+
+    def delete(self, key: str):
+        self.client.delete_object(Bucket=self.bucket, Key=self.object_key(key))
+
+@lru_cache(maxsize=1)
+def get_blob_storage() -> BlobStorage:
+    if settings.BLOB_STORAGE_BACKEND == "s3":
+        return S3BlobStorage(settings.S3_BUCKET_NAME, endpoint_url=settings.S3_ENDPOINT_URL, prefix=settings.S3_KEY_PREFIX)
+    return LocalBlobStorage(settings.BLOB_STORAGE_PATH)
@@ -0,0 +1,375 @@
+import datetime
+import logging
+import threading
+import time
+
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Iterable
+
+from fastapi import HTTPException
+from sqlalchemy import delete, func, literal
+from sqlalchemy.dialects.postgresql import insert
+from sqlmodel import Session, select
+
+from core.config import settings
+from db.models import Cart, CartItem, CartItemReadAll, Product, ProductRead
+from db.sharding import shard_session
+from services.workers import is_single_worker
+
+logger = logging.getLogger(__name__)
+
+
+# Plain objects with the attributes of Cart/CartItem, the response models read them with from_attributes
+@dataclass(eq=False)
+class CartState:
+    id: int
+    user_id: int
+    created_at: datetime.datetime
+    updated_at: datetime.datetime | None = None
+    items: dict[int, "CartItemState"] = field(default_factory=dict)
+    # bumped on every change, a flush only marks the cart clean if nothing changed while it was written
+    version: int = 0
+    accessed_at: float = field(default_factory=time.monotonic)
+
+@dataclass(eq=False)
+class CartItemState:
+    id: int
+    cart: CartState
+    product_id: int
+    quantity: int
+    created_at: datetime.datetime
+    # snapshot taken when the product was added, checkout re-reads the product and checks the stock again
+    product: ProductRead
+    updated_at: datetime.datetime | None = None
+
+    @property
+    def cart_id(self) -> int:
+        return self.cart.id
+
+def _now() -> datetime.datetime:
+    return datetime.datetime.now(datetime.UTC)
+
+def _check_stock(available_quantity: int, quantity: int):
+    if available_quantity < quantity:
+        raise HTTPException(status_code=409, detail="Not enough stock")
+
+# The routers only talk to a CartStore. The session passed in is the request's session for the user's shard
+class CartStore(ABC):
+    @abstractmethod
+    def get_items(self, session: Session, user_id: int) -> Iterable:
+        ...
+
+    @abstractmethod
+    def add_item(self, session: Session, user_id: int, product_id: int, quantity: int):
+        ...
+
+    @abstractmethod
+    def update_item(self, session: Session, user_id: int, item_id: int, quantity: int | None):
+        ...
+
+    @abstractmethod
+    def remove_item(self, session: Session, user_id: int, item_id: int):
+        ...
+
+    # persists whatever is pending for the user so checkout reads the cart from the database
+    def flush_user(self, user_id: int):
+        pass
+
+    def flush(self) -> int:
+        return 0
+
+    def discard(self, user_id: int):
+        pass
+
+    def expire(self, idle_seconds: float) -> int:
+        return 0
+
+# Every call reads and writes the cart tables directly
+class DatabaseCartStore(CartStore):
+    def get_cart(self, session: Session, user_id: int) -> Cart | None:
+        return session.exec(select(Cart).where(Cart.user_id == user_id)).one_or_none()
+
+    def get_or_create_cart(self, session: Session, user_id: int) -> Cart:
+        cart = self.get_cart(session, user_id)
+        if cart is None:
+            cart = Cart(user_id=user_id, created_at=_now())
+            session.add(cart)
+            session.commit()
+            session.refresh(cart)
+        return cart
+
+    def get_items(self, session: Session, user_id: int) -> list[CartItem]:
+        cart = self.get_or_create_cart(session, user_id)
+        return list(session.exec(select(CartItem).where(CartItem.cart_id == cart.id)).all())
+
+    # One statement, one round trip: the stock check, the cart upsert and the item insert are chained CTEs and the
+    # inserted item comes back through RETURNING, joined with its cart and product. Nothing is inserted when the
+    # product is missing, short on stock or already in the cart, only then a second query looks up which one it was
+    def add_item(self, session: Session, user_id: int, product_id: int, quantity: int) -> CartItemReadAll:
+        now = _now()
+        # with sharding the product lives on another database than the cart and is checked in its own query
+        same_database = session.get_bind(mapper=Product) is session.get_bind(mapper=Cart)
+        product = None if same_database else self.check_product(session, product_id, quantity)
+
+        cart_source = select(literal(user_id), literal(now), literal(now))
+        if same_database:
+            in_stock = select(Product.id).where(Product.id == product_id, Product.available_quantity >= quantity).cte("in_stock")
+            cart_source = cart_source.select_from(in_stock)
+        cart_insert = insert(Cart).from_select(["user_id", "created_at", "updated_at"], cart_source)
+        upserted_cart = cart_insert.on_conflict_do_update(index_elements=[Cart.user_id], set_={"updated_at": cart_insert.excluded.updated_at}).returning(*Cart.__table__.c).cte("upserted_cart") # type: ignore
+
+        item_source = select(upserted_cart.c.id, literal(product_id), literal(quantity), literal(now))
+        item_insert = insert(CartItem).from_select(["cart_id", "product_id", "quantity", "created_at"], item_source)
+        inserted_item = item_insert.on_conflict_do_nothing(index_elements=[CartItem.cart_id, CartItem.product_id]).returning(*CartItem.__table__.c).cte("inserted_item") # type: ignore
+
+        statement = select(inserted_item, upserted_cart).join(upserted_cart, upserted_cart.c.id == inserted_item.c.cart_id)
+        if same_database:
+            statement = statement.add_columns(Product).join(Product, Product.id == inserted_item.c.product_id) # type: ignore
+        row = session.exec(statement).one_or_none() # type: ignore
+
+        if row is None:
+            session.rollback()
+            if same_database:
+                self.check_product(session, product_id, quantity)
+            raise HTTPException(status_code=409, detail="Product already in cart")
+
+        # read before the commit expires the product, which would reload it in another query
+        values = row._mapping
+        cart_item = CartItemReadAll.model_validate({
+            **{column.name: values[column] for column in inserted_item.c},
+            "cart": {column.name: values[column] for column in upserted_cart.c},
+            "product": ProductRead.model_validate(values[Product] if same_database else product, from_attributes=True),
+        })
+        session.commit()
+        return cart_item
+
+    def check_product(self, session: Session, product_id: int, quantity: int) -> Product:
+        product = session.get(Product, product_id)
+        if product is None:
+            raise HTTPException(status_code=404, detail="Product not found")
+        _check_stock(product.available_quantity, quantity)
+        return product
+
+    def find_item(self, session: Session, user_id: int, item_id: int) -> CartItem:
+        cart_item = session.exec(select(CartItem).join(Cart).where(CartItem.id == item_id, Cart.user_id == user_id)).one_or_none()
+        if cart_item is None:
+            raise HTTPException(status_code=404, detail="Cart item not found")
+        return cart_item
+
+    def update_item(self, session: Session, user_id: int, item_id: int, quantity: int | None) -> CartItem:
+        cart_item = self.find_item(session, user_id, item_id)
+        product = session.get(Product, cart_item.product_id)
+        if product is None:
+            raise HTTPException(status_code=404, detail="Product not found")
+
+        if quantity is not None:
+            _check_stock(product.available_quantity, quantity)
+            cart_item.quantity = quantity
+        cart_item.updated_at = _now()
+        cart_item.cart.updated_at = _now() # type: ignore
+
+        session.add(cart_item)
+        session.commit()
+        session.refresh(cart_item)
+        return cart_item
+
+    def remove_item(self, session: Session, user_id: int, item_id: int):
+        session.delete(self.find_item(session, user_id, item_id))
+        session.commit()
+
+    def load(self, session: Session, user_id: int) -> CartState | None:
+        cart = self.get_cart(session, user_id)
+        if cart is None:
+            return None
+        state = CartState(id=cart.id, user_id=user_id, created_at=cart.created_at, updated_at=cart.updated_at) # type: ignore
+        rows = session.exec(select(CartItem, Product).join(Product, CartItem.product_id == Product.id).where(CartItem.cart_id == cart.id)).all() # type: ignore
+        for item, product in rows:
+            state.items[item.id] = CartItemState(id=item.id, cart=state, product_id=item.product_id, quantity=item.quantity, created_at=item.created_at, updated_at=item.updated_at, product=ProductRead.model_validate(product, from_attributes=True))
+        return state
+
+    # carts and cart items are upserted by id, items that are no longer in the cart are deleted
+    def persist(self, state: CartState):
+        with shard_session(state.user_id) as session:
+            cart_row = {"id": state.id, "user_id": state.user_id, "created_at": state.created_at, "updated_at": state.updated_at}
+            session.execute(insert(Cart).values(cart_row).on_conflict_do_update(index_elements=[Cart.id], set_={"updated_at": state.updated_at}))
+            session.execute(delete(CartItem).where(CartItem.cart_id == state.id, CartItem.id.not_in(list(state.items)))) # type: ignore
+            if state.items:
+                rows = [{"id": item.id, "cart_id": state.id, "product_id": item.product_id, "quantity": item.quantity, "created_at": item.created_at, "updated_at": item.updated_at} for item in state.items.values()]
+                statement = insert(CartItem).values(rows)
+                session.execute(statement.on_conflict_do_update(index_elements=[CartItem.id], set_={"quantity": statement.excluded.quantity, "updated_at": statement.excluded.updated_at}))
+            session.commit()
+
+# Hands out primary keys reserved from the table's sequence, a block at a time, so new carts and items get their
+# final id without waiting for the insert. Sequences are per database, so blocks are kept per shard
+class IdAllocator:
+    def __init__(self, block_size: int = settings.CART_STORE_ID_BLOCK_SIZE):
+        self.block_size = block_size
+        self._blocks: dict[tuple[str, str], list[int]] = {}
+        self._lock = threading.Lock()
+
+    def next_id(self, session: Session, model: type) -> int:
+        table = model.__table__ # type: ignore
+        key = (str(session.get_bind(mapper=model).engine.url), table.name) # type: ignore
+        with self._lock:
+            block = self._blocks.get(key)
+            if block:
+                return block.pop()
+        sequence = func.nextval(f"{table.name}_id_seq")
+        ids = session.execute(select(sequence).select_from(func.generate_series(1, self.block_size)), bind_arguments={"mapper": model}).scalars().all()
+        first, *rest = sorted(ids, reverse=True)
+        with self._lock:
+            self._blocks.setdefault(key, []).extend(rest)
+        return first
+
+# Active carts live in this process: reads and edits touch only memory, and changed carts are written to the cart
+# tables in the background (write-behind) every CART_STORE_FLUSH_INTERVAL_SECONDS and before checkout.
+# Only correct when every request of a user reaches the same process, see get_cart_store
+class InMemoryCartStore(CartStore):
+    # a user's cart is written by one thread at a time, users share one of this many locks
+    FLUSH_LOCKS = 64
+
+    def __init__(self, backing: DatabaseCartStore, ids: IdAllocator | None = None, max_carts: int = settings.CART_STORE_MAX_CARTS):
+        self.backing = backing
+        self.ids = ids or IdAllocator()
+        self.max_carts = max_carts
+        self.carts: OrderedDict[int, CartState] = OrderedDict()
+        self.dirty: dict[int, int] = {} # user id -> version that still has to be written
+        self._lock = threading.RLock()
+        self._flush_locks = [threading.Lock() for _ in range(self.FLUSH_LOCKS)]
+
+    def _flush_lock(self, user_id: int) -> threading.Lock:
+        return self._flush_locks[user_id % self.FLUSH_LOCKS]
+
+    def _mark_dirty(self, state: CartState):
+        state.version += 1
+        state.updated_at = _now()
+        self.dirty[state.user_id] = state.version
+
+    def _evict(self):
+        # least recently used clean carts go first, dirty carts stay until they are flushed
+        for user_id in list(self.carts):
+            if len(self.carts) <= self.max_carts:
+                return
+            if user_id not in self.dirty:
+                del self.carts[user_id]
+
+    def get_state(self, session: Session, user_id: int, create: bool = True) -> CartState | None:
+        with self._lock:
+            state = self.carts.get(user_id)
+            if state is not None:
+                self.carts.move_to_end(user_id)
+                state.accessed_at = time.monotonic()
+                return state
+
+        loaded = self.backing.load(session, user_id)
+        if loaded is None and not create:
+            return None
+        # a new cart only exists in memory until the next flush writes it
+        state = loaded or CartState(id=self.ids.next_id(session, Cart), user_id=user_id, created_at=_now())
+
+        with self._lock:
+            # another request may have loaded the cart meanwhile, the first one wins
+            if user_id in self.carts:
+                return self.carts[user_id]
+            self.carts[user_id] = state
+            if loaded is None:
+                self.dirty[user_id] = state.version
+            self._evict()
+            return state
+
+    def get_items(self, session: Session, user_id: int) -> list[CartItemState]:
+        state = self.get_state(session, user_id)
+        return list(state.items.values()) # type: ignore
+
+    def add_item(self, session: Session, user_id: int, product_id: int, quantity: int) -> CartItemState:
+        product = self.backing.check_product(session, product_id, quantity)
+        snapshot = ProductRead.model_validate(product, from_attributes=True)
+
+        state: CartState = self.get_state(session, user_id) # type: ignore
+        item_id = self.ids.next_id(session, CartItem)
+        with self._lock:
+            if any(item.product_id == product_id for item in state.items.values()):
+                raise HTTPException(status_code=409, detail="Product already in cart")
+            item = CartItemState(id=item_id, cart=state, product_id=product_id, quantity=quantity, created_at=_now(), product=snapshot)
+            state.items[item_id] = item
+            self._mark_dirty(state)
+        return item
+
+    def find_item(self, session: Session, user_id: int, item_id: int) -> tuple[CartState, CartItemState]:
+        state = self.get_state(session, user_id, create=False)
+        item = state.items.get(item_id) if state is not None else None
+        if state is None or item is None:
+            raise HTTPException(status_code=404, detail="Cart item not found")
+        return state, item
+
+    def update_item(self, session: Session, user_id: int, item_id: int, quantity: int | None) -> CartItemState:
+        state, item = self.find_item(session, user_id, item_id)
+        with self._lock:
+            if quantity is not None:
+                _check_stock(item.product.available_quantity, quantity)
+                item.quantity = quantity
+            item.updated_at = _now()
+            self._mark_dirty(state)
+        return item
+
+    def remove_item(self, session: Session, user_id: int, item_id: int):
+        state, item = self.find_item(session, user_id, item_id)
+        with self._lock:
+            state.items.pop(item.id, None)
+            self._mark_dirty(state)
+
+    # The scheduled flush and checkout both flush a user's cart. The flush lock makes the second one wait for the first
+    # write and then find nothing left to write, and keeps discard from running while a stale copy is still being
+    # written, which would bring back the cart checkout just deleted
+    def flush_user(self, user_id: int) -> bool:
+        with self._flush_lock(user_id):
+            with self._lock:
+                if user_id not in self.dirty:
+                    return False
+                state = self.carts[user_id]
+                version = state.version
+                # the copy keeps the write consistent while requests keep editing the cart
+                snapshot = CartState(id=state.id, user_id=state.user_id, created_at=state.created_at, updated_at=state.updated_at, items=dict(state.items), version=version)
+
+            self.backing.persist(snapshot)
+
+            with self._lock:
+                if self.dirty.get(user_id) == version:
+                    del self.dirty[user_id]
+            return True
+
+    def flush(self) -> int:
+        flushed = 0
+        for user_id in list(self.dirty):
+            try:
+                flushed += self.flush_user(user_id)
+            except Exception:
+                logger.exception("Writing the cart of user %s failed, retrying on the next flush", user_id)
+        return flushed
+
+    def discard(self, user_id: int):
+        with self._flush_lock(user_id), self._lock:
+            self.carts.pop(user_id, None)
+            self.dirty.pop(user_id, None)
+
+    # carts with unflushed changes are kept, the next flush makes them eligible
+    def expire(self, idle_seconds: float) -> int:
+        cutoff = time.monotonic() - idle_seconds
+        with self._lock:
+            expired = [user_id for user_id, state in self.carts.items() if state.accessed_at < cutoff and user_id not in self.dirty]
+            for user_id in expired:
+                del self.carts[user_id]
+        return len(expired)
+
+# In memory carts are opt-in. Workers do not share memory and a user's requests could see two different carts, so the
+# app refuses to start with them unless serve.py confirms it runs a single worker
+@lru_cache(maxsize=1)
+def get_cart_store() -> CartStore:
+    if settings.CART_STORE_BACKEND == "memory":
+        if not is_single_worker():
+            raise RuntimeError("CART_STORE_BACKEND=memory needs a single worker process, start the app with serve.py --workers 1")
+        return InMemoryCartStore(DatabaseCartStore())
+    return DatabaseCartStore()
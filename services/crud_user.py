@@ -10,12 +10,13 @@ from pydantic import ValidationError
 from sqlalchemy.exc import IntegrityError
 from sqlmodel import Session, select
 
-from auth.auth import get_password_hash, oauth2_scheme, read_public_key
+from auth.auth import get_password_hash, hash_token, oauth2_scheme, read_public_key
 from core.config import settings
 from db.models import EmailVerification, User
+from db.sharding import is_sharded, shard_session
 from schemas.token import EmailVerificationToken
 from schemas.user import UserCreate, UserState
-from utils.deps import get_session
+from utils.deps import get_read_session, get_session
 
 
 class CRUDUser:
@@ -57,11 +58,11 @@ class CRUDUser:
         token = secrets.token_urlsafe(32)
         
         if expiration_seconds is None:
-            expiration_time = datetime.datetime.now() + datetime.timedelta(seconds=settings.EMAIL_VERIFICATION_TOKEN_EXPIRATION_SECONDS)
+            expiration_time = datetime.datetime.now(datetime.UTC) + datetime.timedelta(seconds=settings.EMAIL_VERIFICATION_TOKEN_EXPIRATION_SECONDS)
         else:
-            expiration_time = datetime.datetime.now() + datetime.timedelta(seconds=expiration_seconds)
+            expiration_time = datetime.datetime.now(datetime.UTC) + datetime.timedelta(seconds=expiration_seconds)
         
-        db_obj = EmailVerification(email=email, token=token, expires_at=expiration_time)
+        db_obj = EmailVerification(email=email, token_hash=hash_token(token), expires_at=expiration_time)
         
         db.add(db_obj)
         db.commit()
@@ -107,3 +108,19 @@ def is_user_superuser(current_user: Annotated[User, Depends(get_current_user)])
         raise HTTPException(status_code=403, detail="User is not a superuser")
     
     return current_user
+
+# Session for the current user's carts and orders, routed to the user's shard. Without shards it is the primary
+# session itself, so overriding get_session (as the tests do) covers both
+def get_user_shard_session(current_user: Annotated[User, Depends(get_current_user)], session: Annotated[Session, Depends(get_session)]):
+    if not is_sharded():
+        yield session
+        return
+    with shard_session(current_user.id) as user_session: # type: ignore
+        yield user_session
+
+def get_user_shard_read_session(current_user: Annotated[User, Depends(get_current_user)], session: Annotated[Session, Depends(get_read_session)]):
+    if not is_sharded():
+        yield session
+        return
+    with shard_session(current_user.id) as user_session: # type: ignore
+        yield user_session
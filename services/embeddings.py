@@ -0,0 +1,249 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+from functools import lru_cache
+from typing import TYPE_CHECKING, Protocol, Sequence
+
+from sqlmodel import Session, select
+
+from core.config import settings
+from db.engine import get_engine
+from db.models import Product
+from services.suggestions import normalize
+
+# numpy and spaCy are imported on first use, not at startup
+if TYPE_CHECKING:
+    import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class Embedder(Protocol):
+    # identifies the vector space, vectors of different embedders are never compared
+    name: str
+    dim: int
+
+    def embed(self, texts: Sequence[str]) -> "np.ndarray": ...
+
+def l2_normalize(matrix: "np.ndarray") -> "np.ndarray":
+    import numpy as np
+
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms == 0, 1, norms)
+
+# Word and character trigram features hashed into a fixed number of dimensions, with a hash-derived sign so
+# collisions cancel out instead of adding up. Needs no model, catches spelling variants ("kettle", "kettles") but
+# not synonyms
+class HashingEmbedder:
+    def __init__(self, dim: int = settings.EMBEDDING_DIM):
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    def features(self, text: str) -> list[str]:
+        words = normalize(text).split()
+        features = [f"w:{word}" for word in words]
+        for word in words:
+            padded = f"<{word}>"
+            features.extend(padded[i:i + 3] for i in range(len(padded) - 2))
+        return features
+
+    def embed(self, texts: Sequence[str]) -> "np.ndarray":
+        import numpy as np
+
+        rows, columns, signs = [], [], []
+        for row, text in enumerate(texts):
+            for feature in self.features(text):
+                value = int.from_bytes(hashlib.blake2b(feature.encode(), digest_size=8).digest(), "little")
+                rows.append(row)
+                columns.append(value % self.dim)
+                signs.append(1.0 if value >> 63 else -1.0)
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        np.add.at(matrix, (np.array(rows, dtype=np.intp), np.array(columns, dtype=np.intp)), np.array(signs, dtype=np.float32))
+        return l2_normalize(matrix)
+
+# Averaged word vectors of a spaCy model that ships vectors (en_core_web_md, en_core_web_lg), close for synonyms
+class SpacyEmbedder:
+    def __init__(self, model: str):
+        import spacy
+
+        self.nlp = spacy.load(model)
+        # doc.vector only needs the tokenizer and the static vectors
+        self.nlp.select_pipes(disable=self.nlp.pipe_names)
+        if self.nlp.vocab.vectors.shape[0] == 0:
+            raise ValueError(f"spaCy model {model} has no word vectors")
+        self.dim = self.nlp.vocab.vectors.shape[1]
+        self.name = f"spacy-{model}"
+
+    def embed(self, texts: Sequence[str]) -> "np.ndarray":
+        import numpy as np
+
+        vectors = [doc.vector for doc in self.nlp.pipe(texts, batch_size=256)]
+        return l2_normalize(np.array(vectors, dtype=np.float32).reshape(len(texts), self.dim))
+
+@lru_cache(maxsize=1)
+def get_embedder() -> Embedder:
+    if settings.EMBEDDING_SPACY_MODEL:
+        try:
+            return SpacyEmbedder(settings.EMBEDDING_SPACY_MODEL)
+        except (ImportError, OSError, ValueError) as e:
+            logger.warning("spaCy model %s is not usable, using hashed n-gram vectors: %s", settings.EMBEDDING_SPACY_MODEL, e)
+    return HashingEmbedder()
+
+def product_text(name: str, description: str) -> str:
+    return f"{name}. {description}"
+
+# The vectors are one contiguous float32 matrix in a .npy file, memory mapped so every worker shares the page cache
+# instead of holding its own copy. meta.json names the current files and is replaced last, a rebuild never shows
+# half written vectors, and workers pick up a new build the next time they search
+class EmbeddingStore:
+    def __init__(self, path: str = settings.EMBEDDING_PATH):
+        self.path = path
+        # (meta, ids, vectors) of the loaded build, replaced as a whole so a search never mixes two builds
+        self.snapshot: "tuple[dict, np.ndarray, np.ndarray] | None" = None
+        self._lock = threading.Lock()
+
+    @property
+    def meta_path(self) -> str:
+        return os.path.join(self.path, "meta.json")
+
+    @property
+    def meta(self) -> dict | None:
+        snapshot = self.snapshot
+        return snapshot[0] if snapshot is not None else None
+
+    def is_built(self) -> bool:
+        return os.path.exists(self.meta_path)
+
+    def read_meta(self) -> dict | None:
+        try:
+            with open(self.meta_path) as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return None
+
+    # meta.json is a few bytes, reading it on every search is cheaper than missing a build published within the
+    # resolution of the file's mtime
+    def _refresh(self) -> "tuple[dict, np.ndarray, np.ndarray] | None":
+        import numpy as np
+
+        meta = self.read_meta()
+        snapshot = self.snapshot
+        if meta is None or (snapshot is not None and snapshot[0]["version"] == meta["version"]):
+            return snapshot
+        with self._lock:
+            if self.snapshot is not None and self.snapshot[0]["version"] == meta["version"]:
+                return self.snapshot
+            try:
+                ids = np.load(os.path.join(self.path, meta["ids"]))
+                # an empty file cannot be mapped
+                vectors = np.load(os.path.join(self.path, meta["vectors"]), mmap_mode="r") if meta["count"] else np.zeros((0, meta["dim"]), dtype=np.float32)
+            except FileNotFoundError:
+                # a newer build was published meanwhile and removed these files, it is loaded on the next search
+                return self.snapshot
+            self.snapshot = (meta, ids, vectors)
+            return self.snapshot
+
+    # top k (product id, cosine similarity), the vectors are normalized so the dot product is the cosine
+    def search(self, query_vector: "np.ndarray", k: int, embedder_name: str) -> list[tuple[int, float]]:
+        import numpy as np
+
+        snapshot = self._refresh()
+        if snapshot is None:
+            return []
+        meta, ids, vectors = snapshot
+        if len(ids) == 0:
+            return []
+        if meta["embedder"] != embedder_name:
+            logger.warning("Product vectors were built by %s, queries use %s, rebuild them", meta["embedder"], embedder_name)
+            return []
+
+        # rows past the published ids belong to products deleted during the build
+        scores = vectors[:len(ids)] @ query_vector
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return list(zip(ids[top].tolist(), scores[top].tolist()))
+
+    def write(self, ids: "np.ndarray", vectors: "np.ndarray", embedder_name: str):
+        import numpy as np
+
+        os.makedirs(self.path, exist_ok=True)
+        version = new_version()
+        np.save(os.path.join(self.path, f"ids-{version}.npy"), ids)
+        np.save(os.path.join(self.path, f"vectors-{version}.npy"), vectors)
+        self.publish(build_meta(version, embedder_name, int(vectors.shape[1]), int(len(ids))))
+
+    # Workers that loaded the previous build may not have seen this meta.json yet, so its files stay until the next
+    # publish. Files newer than the previous build may belong to a build still running elsewhere and stay as well
+    def publish(self, meta: dict):
+        previous = self.read_meta()
+        temporary = f"{self.meta_path}.tmp"
+        with open(temporary, "w") as file:
+            json.dump(meta, file)
+        os.replace(temporary, self.meta_path)
+        if previous is None:
+            return
+        for name in os.listdir(self.path):
+            version = file_version(name)
+            if version is not None and version < previous["version"]:
+                os.remove(os.path.join(self.path, name))
+
+# nanoseconds, two builds never share their files
+def new_version() -> int:
+    return time.time_ns()
+
+def build_meta(version: int, embedder_name: str, dim: int, count: int) -> dict:
+    return {"version": version, "embedder": embedder_name, "dim": dim, "count": count, "ids": f"ids-{version}.npy", "vectors": f"vectors-{version}.npy"}
+
+# the version in ids-<version>.npy and vectors-<version>.npy, None for any other file
+def file_version(name: str) -> int | None:
+    stem, _, version = name.removesuffix(".npy").rpartition("-")
+    if not name.endswith(".npy") or stem not in ("ids", "vectors") or not version.isdigit():
+        return None
+    return int(version)
+
+# Vectorizes every product in batches, straight into the memory mapped file of the next build
+def build_product_embeddings(store: "EmbeddingStore | None" = None, embedder: Embedder | None = None, batch_size: int = 1000) -> int:
+    import numpy as np
+
+    store = store or get_embedding_store()
+    embedder = embedder or get_embedder()
+    with Session(get_engine()) as session:
+        product_ids = session.exec(select(Product.id).order_by(Product.id)).all() # type: ignore
+        if not product_ids:
+            store.write(np.zeros(0, dtype=np.int64), np.zeros((0, embedder.dim), dtype=np.float32), embedder.name)
+            return 0
+
+        os.makedirs(store.path, exist_ok=True)
+        version = new_version()
+        vectors = np.lib.format.open_memmap(os.path.join(store.path, f"vectors-{version}.npy"), mode="w+", dtype=np.float32, shape=(len(product_ids), embedder.dim))
+        ids = np.zeros(len(product_ids), dtype=np.int64)
+        filled = 0
+        for start in range(0, len(product_ids), batch_size):
+            batch = product_ids[start:start + batch_size]
+            rows = session.exec(select(Product.id, Product.name, Product.description).where(Product.id.in_(batch)).order_by(Product.id)).all() # type: ignore
+            if not rows:
+                continue
+            vectors[filled:filled + len(rows)] = embedder.embed([product_text(name, description) for _, name, description in rows])
+            ids[filled:filled + len(rows)] = [id for id, _, _ in rows]
+            filled += len(rows)
+        vectors.flush()
+        del vectors
+
+    # products deleted while the build ran leave zero rows at the end, only the ids of the filled ones are published
+    np.save(os.path.join(store.path, f"ids-{version}.npy"), ids[:filled])
+    store.publish(build_meta(version, embedder.name, embedder.dim, filled))
+    return filled
+
+@lru_cache(maxsize=1)
+def get_embedding_store() -> EmbeddingStore:
+    return EmbeddingStore()
+
+def semantic_ranking(query: str, k: int = settings.SEMANTIC_SEARCH_CANDIDATES) -> list[int]:
+    embedder = get_embedder()
+    matches = get_embedding_store().search(embedder.embed([query])[0], k, embedder.name)
+    return [product_id for product_id, score in matches if score >= settings.SEMANTIC_SEARCH_MIN_SCORE]
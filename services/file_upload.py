@@ -1,11 +1,43 @@
 # https://riskledger.com/resources/approach-virus-scanning-files
-import io
+import datetime
 
+from typing import AsyncIterable, AsyncIterator
 
-# Upload the File onto Blob Storage and Scan it for viruses if virus is found, change the file status to "Virus Found" and delete the file from Blob Storage
+from fastapi import HTTPException, UploadFile
+from sqlmodel import Session
+
+from core.config import settings
+from db.models import UploadedFile
+from services.blob_storage import BlobStorage, BlobTooLargeError
+from services.virus_scan import ScanCallback, VirusScanService
+
+
+async def iter_upload_file(file: UploadFile, chunk_size: int = settings.UPLOAD_CHUNK_SIZE) -> AsyncIterator[bytes]:
+    while chunk := await file.read(chunk_size):
+        yield chunk
+
+# Upload the File onto Blob Storage and Scan it for viruses if virus is found, change the file status to "infected" and delete the file from Blob Storage
 class FileUploadService:
-    def __init__(self, file: io.BytesIO):
-        self.file = file
-        
-    async def scan_virus(self):
-        return
+    def __init__(self, storage: BlobStorage, scan_service: VirusScanService, max_size: int = settings.UPLOAD_MAX_SIZE_BYTES):
+        self.storage = storage
+        self.scan_service = scan_service
+        self.max_size = max_size
+
+    async def upload(self, db: Session, chunks: AsyncIterable[bytes], filename: str, content_type: str, uploader_id: int | None = None) -> UploadedFile:
+        if content_type not in settings.UPLOAD_ALLOWED_CONTENT_TYPES:
+            raise HTTPException(status_code=415, detail="File type not supported. Only jpeg, png and gif are supported")
+
+        try:
+            blob = await self.storage.save(chunks, max_size=self.max_size)
+        except BlobTooLargeError as e:
+            raise HTTPException(status_code=413, detail=f"File size is greater than {self.max_size // (1024 * 1024)} MB") from e
+
+        file_obj = UploadedFile(filename=filename, content_type=content_type, size=blob.size, sha256=blob.key, uploader_id=uploader_id, created_at=datetime.datetime.now(datetime.UTC))
+        db.add(file_obj)
+        db.commit()
+        db.refresh(file_obj)
+        return file_obj
+
+    # the scan runs in the background, on_complete is awaited with the final status once the file leaves quarantine
+    async def scan_virus(self, file_obj: UploadedFile, on_complete: ScanCallback | None = None):
+        self.scan_service.enqueue(file_obj.id, on_complete) # type: ignore
@@ -0,0 +1,27 @@
+import io
+
+
+# Runs inside the process pool, so it only depends on Pillow and plain arguments
+def render_variants(data: bytes, widths: list[int], quality: int = 80) -> list[tuple[int, int, bytes]]:
+    from PIL import Image, ImageOps
+
+    with Image.open(io.BytesIO(data)) as source:
+        source.draft("RGB", (max(widths), max(widths))) # lets the JPEG decoder skip pixels we would throw away
+        image = ImageOps.exif_transpose(source)
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+
+        variants = []
+        for width in sorted(set(widths)):
+            # never upscale, the original width becomes the largest variant instead
+            width = min(width, image.width)
+            if variants and variants[-1][0] == width:
+                break
+            height = max(1, round(image.height * width / image.width))
+            resized = image if width == image.width else image.resize((width, height), Image.Resampling.LANCZOS)
+
+            output = io.BytesIO()
+            resized.save(output, format="WEBP", quality=quality, method=4)
+            variants.append((width, height, output.getvalue()))
+
+        return variants
@@ -0,0 +1,54 @@
+import datetime
+import os
+
+from decimal import Decimal
+from functools import lru_cache
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "templates")
+
+# Labels and number/date formats of every invoice language, INVOICE_LANG picks one
+LOCALES: dict[str, dict] = {
+    "en": {
+        "labels": {"invoice": "Invoice", "date": "Date", "billed_to": "Billed to", "product": "Product", "quantity": "Quantity", "unit_price": "Unit price", "amount": "Amount", "total": "Total", "thanks": "Thank you for your order."},
+        "formats": {"decimal": ".", "thousands": ",", "date": "%d %B %Y", "months": ["January", "February", "March", "April", "May", "June", "July", "August", "September", "October", "November", "December"]},
+    },
+    "de": {
+        "labels": {"invoice": "Rechnung", "date": "Datum", "billed_to": "Rechnungsempfänger", "product": "Artikel", "quantity": "Menge", "unit_price": "Einzelpreis", "amount": "Betrag", "total": "Gesamtbetrag", "thanks": "Vielen Dank für Ihre Bestellung."},
+        "formats": {"decimal": ",", "thousands": ".", "date": "%d. %B %Y", "months": ["Januar", "Februar", "März", "April", "Mai", "Juni", "Juli", "August", "September", "Oktober", "November", "Dezember"]},
+    },
+    "fr": {
+        "labels": {"invoice": "Facture", "date": "Date", "billed_to": "Facturé à", "product": "Produit", "quantity": "Quantité", "unit_price": "Prix unitaire", "amount": "Montant", "total": "Total", "thanks": "Merci pour votre commande."},
+        "formats": {"decimal": ",", "thousands": " ", "date": "%d %B %Y", "months": ["janvier", "février", "mars", "avril", "mai", "juin", "juillet", "août", "septembre", "octobre", "novembre", "décembre"]},
+    },
+    "es": {
+        "labels": {"invoice": "Factura", "date": "Fecha", "billed_to": "Facturado a", "product": "Producto", "quantity": "Cantidad", "unit_price": "Precio unitario", "amount": "Importe", "total": "Total", "thanks": "Gracias por su pedido."},
+        "formats": {"decimal": ",", "thousands": ".", "date": "%d de %B de %Y", "months": ["enero", "febrero", "marzo", "abril", "mayo", "junio", "julio", "agosto", "septiembre", "octubre", "noviembre", "diciembre"]},
+    },
+}
+
+
+def format_money(value: str | Decimal, formats: dict, currency: str) -> str:
+    whole, fraction = f"{Decimal(value):,.2f}".split(".")
+    return f"{whole.replace(',', formats['thousands'])}{formats['decimal']}{fraction} {currency}"
+
+def format_date(value: str | datetime.datetime, formats: dict) -> str:
+    if isinstance(value, str):
+        value = datetime.datetime.fromisoformat(value)
+    # month names come from the locale, strftime would use the one of the process
+    return value.strftime(formats["date"].replace("%B", formats["months"][value.month - 1]))
+
+# one environment per pool process, templates are compiled once and reused for every invoice
+@lru_cache(maxsize=1)
+def get_template_environment(template_dir: str = TEMPLATE_DIR):
+    from jinja2 import Environment, FileSystemLoader, select_autoescape
+
+    environment = Environment(loader=FileSystemLoader(template_dir), autoescape=select_autoescape(["html"]))
+    environment.filters["money"] = format_money
+    environment.filters["date"] = format_date
+    return environment
+
+# Runs inside the process pool, so it only depends on Jinja2 and plain arguments
+def render_invoice(context: dict, language: str) -> bytes:
+    locale = LOCALES[language]
+    template = get_template_environment().get_template("invoice.html")
+    return template.render(language=language, labels=locale["labels"], formats=locale["formats"], **context).encode()
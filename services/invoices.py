@@ -0,0 +1,75 @@
+import asyncio
+import datetime
+import logging
+
+from decimal import Decimal
+
+from sqlalchemy.dialects.postgresql import insert
+from sqlmodel import Session, select
+
+from core.config import settings
+from db.models import Invoice, Order, OrderItem, Product, User
+from db.sharding import shard_session
+from services.blob_storage import get_blob_storage
+from services.invoice_rendering import LOCALES, render_invoice
+from services.workers import run_in_process
+
+logger = logging.getLogger(__name__)
+
+INVOICE_CONTENT_TYPE = "text/html; charset=utf-8"
+
+
+def invoice_language() -> str:
+    if settings.INVOICE_LANG in LOCALES:
+        return settings.INVOICE_LANG
+    logger.warning("No invoice translation for INVOICE_LANG=%s, using en", settings.INVOICE_LANG)
+    return "en"
+
+# Everything the template shows, as plain values the process pool can pickle
+def invoice_context(order: Order, customer: User, items: list[tuple[OrderItem, Product]]) -> dict:
+    lines = []
+    for item, product in items:
+        # orders placed before promotions existed have no unit price, they paid the product price
+        unit_price = Decimal(item.unit_price if item.unit_price is not None else product.original_price)
+        lines.append({"name": product.name, "quantity": item.quantity, "unit_price": str(unit_price), "amount": str(unit_price * item.quantity)})
+    return {
+        "order": {"id": order.id, "created_at": order.created_at.isoformat(), "total_price": str(order.total_price)},
+        "customer": {"username": customer.username, "email": customer.email},
+        "items": lines,
+        "seller": settings.INVOICE_SELLER_NAME,
+        "currency": settings.INVOICE_CURRENCY,
+    }
+
+# Renders the invoice of an order in the process pool and stores it in blob storage under its content hash. Runs
+# after checkout, and on the first download of an order that has none. Two of them racing for the same order store
+# the same blob, the unique order_id keeps the first row
+async def create_invoice(session: Session, order: Order) -> Invoice:
+    customer = session.get(User, order.user_id)
+    order_items = session.exec(select(OrderItem).where(OrderItem.order_id == order.id)).all()
+    # products are on the primary and order items on the user's shard, they cannot be joined
+    products = {product.id: product for product in session.exec(select(Product).where(Product.id.in_([item.product_id for item in order_items]))).all()} # type: ignore
+    items = [(item, products[item.product_id]) for item in order_items if item.product_id in products]
+
+    language = invoice_language()
+    content = await run_in_process(render_invoice, invoice_context(order, customer, items), language) # type: ignore
+    blob = await asyncio.to_thread(get_blob_storage().save_bytes, content)
+
+    session.execute(insert(Invoice).values(order_id=order.id, language=language, sha256=blob.key, content_type=INVOICE_CONTENT_TYPE, size=blob.size, created_at=datetime.datetime.now(datetime.UTC)).on_conflict_do_nothing(index_elements=[Invoice.order_id]))
+    session.commit()
+    return session.exec(select(Invoice).where(Invoice.order_id == order.id)).one()
+
+async def get_or_create_invoice(session: Session, order: Order) -> Invoice:
+    invoice = session.exec(select(Invoice).where(Invoice.order_id == order.id)).one_or_none()
+    if invoice is not None:
+        return invoice
+    return await create_invoice(session, order)
+
+# Background task of checkout, a failure only costs the rendering on the first download
+async def generate_invoice(order_id: int, user_id: int):
+    try:
+        with shard_session(user_id) as session:
+            order = session.get(Order, order_id)
+            if order is not None:
+                await get_or_create_invoice(session, order)
+    except Exception:
+        logger.exception("Failed to generate the invoice of order %s", order_id)
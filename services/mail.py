@@ -1,29 +1,44 @@
-from typing import List
+from functools import lru_cache
+from typing import TYPE_CHECKING, List
 
-from fastapi_mail import ConnectionConfig, FastMail, MessageSchema, MessageType
 from pydantic import BaseModel, EmailStr
 
 from core.config import settings
 
+if TYPE_CHECKING:
+    from fastapi_mail import FastMail
+
 
 class EmailSchema(BaseModel):
     email: List[EmailStr]
 
-conf = ConnectionConfig(
-    MAIL_USERNAME=settings.EMAIL_NAME,
-    MAIL_PASSWORD=settings.EMAIL_PASSWORD,
-    MAIL_FROM=settings.EMAIL_NAME,
-    MAIL_PORT=587,
-    MAIL_SERVER=settings.EMAIL_SERVER,
-    MAIL_STARTTLS=True,
-    MAIL_SSL_TLS=False,
-    USE_CREDENTIALS=True,
-    VALIDATE_CERTS=True,
-)
+# fastapi_mail pulls in jinja2, httpx and aiosmtplib, it is only imported once the first mail is sent
+@lru_cache(maxsize=1)
+def get_fast_mail() -> "FastMail":
+    from fastapi_mail import ConnectionConfig, FastMail
+
+    conf = ConnectionConfig(
+        MAIL_USERNAME=settings.EMAIL_NAME,
+        MAIL_PASSWORD=settings.EMAIL_PASSWORD,
+        MAIL_FROM=settings.EMAIL_NAME,
+        MAIL_PORT=587,
+        MAIL_SERVER=settings.EMAIL_SERVER,
+        MAIL_STARTTLS=True,
+        MAIL_SSL_TLS=False,
+        USE_CREDENTIALS=True,
+        VALIDATE_CERTS=True,
+    )
+    return FastMail(conf)
 
-fm = FastMail(conf)
+# keeps `from services.mail import fm` working without building the client at import time
+def __getattr__(name: str):
+    if name == "fm":
+        return get_fast_mail()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 async def send_verification_email(email: EmailSchema, token: str):
+    from fastapi_mail import MessageSchema, MessageType
+
     email_body = """<a href=>http://localhost:8000/users/verify-email/?token={}</a>""".format(token)
     
     message = MessageSchema(
@@ -32,4 +47,4 @@ async def send_verification_email(email: EmailSchema, token: str):
         body=email_body,
         subtype=MessageType.html,
     )
-    await fm.send_message(message)
+    await get_fast_mail().send_message(message)
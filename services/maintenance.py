@@ -0,0 +1,84 @@
+import datetime
+import logging
+
+from sqlalchemy import Engine, delete, func, text
+from sqlmodel import Session, select
+
+from core.config import settings
+from db.models import Cart, CartItem, EmailVerification
+from db.sharding import get_cart_engines
+from services.cart_store import CartStore
+from services.metrics import cart_store_expired_total, cart_sweep_reclaimed_rows_total
+from services.scheduler import Scheduler
+
+logger = logging.getLogger(__name__)
+
+
+# Rows are deleted in small batches, each in its own transaction, so the sweep never holds long row locks
+# and rows locked by a concurrent verify_email are skipped instead of waited on
+def sweep_expired_email_verifications(db: Session, batch_size: int, now: datetime.datetime | None = None) -> int:
+    if now is None:
+        now = datetime.datetime.now(datetime.UTC)
+
+    deleted = 0
+    while True:
+        expired_ids = select(EmailVerification.id).where(EmailVerification.expires_at < now).limit(batch_size).with_for_update(skip_locked=True)
+        result = db.exec(delete(EmailVerification).where(EmailVerification.id.in_(expired_ids.scalar_subquery()))) # type: ignore
+        db.commit()
+
+        deleted += result.rowcount
+        if result.rowcount < batch_size:
+            return deleted
+
+# Carts idle for longer than the TTL are deleted with their items, batch by batch like the verification sweep.
+# Carts do not reserve stock (it is only taken at checkout), so deleting them has nothing to release
+def sweep_abandoned_carts(db: Session, ttl_seconds: int, batch_size: int, now: datetime.datetime | None = None) -> tuple[int, int]:
+    if now is None:
+        now = datetime.datetime.now(datetime.UTC)
+    cutoff = now - datetime.timedelta(seconds=ttl_seconds)
+    last_activity = func.coalesce(Cart.updated_at, Cart.created_at)
+
+    carts = items = 0
+    while True:
+        idle_ids = db.exec(select(Cart.id).where(last_activity < cutoff).limit(batch_size).with_for_update(skip_locked=True)).all()
+        if idle_ids:
+            items += db.exec(delete(CartItem).where(CartItem.cart_id.in_(idle_ids))).rowcount # type: ignore
+            carts += db.exec(delete(Cart).where(Cart.id.in_(idle_ids))).rowcount # type: ignore
+        db.commit()
+
+        if len(idle_ids) < batch_size:
+            return carts, items
+
+# After a large sweep the freed pages are made reusable right away instead of waiting for autovacuum
+def vacuum_cart_tables(engine: Engine):
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        connection.execute(text("VACUUM (ANALYZE) cartitem, cart"))
+
+def sweep_carts_on_every_shard() -> int:
+    reclaimed = 0
+    for engine in get_cart_engines():
+        with Session(engine) as session:
+            carts, items = sweep_abandoned_carts(session, settings.CART_IDLE_TTL_SECONDS, settings.CART_SWEEP_BATCH_SIZE)
+        cart_sweep_reclaimed_rows_total.inc("cart", amount=carts)
+        cart_sweep_reclaimed_rows_total.inc("cartitem", amount=items)
+        if carts + items >= settings.CART_SWEEP_VACUUM_THRESHOLD:
+            logger.info("Sweep reclaimed %s cart rows, vacuuming the cart tables", carts + items)
+            vacuum_cart_tables(engine)
+        reclaimed += carts + items
+    return reclaimed
+
+def register_maintenance_jobs(scheduler: Scheduler, engine: Engine, cart_store: CartStore):
+    def sweep_email_verifications():
+        with Session(engine) as session:
+            return sweep_expired_email_verifications(session, settings.EMAIL_VERIFICATION_SWEEP_BATCH_SIZE)
+
+    scheduler.add_job("sweep_expired_email_verifications", sweep_email_verifications, settings.EMAIL_VERIFICATION_SWEEP_INTERVAL_SECONDS, leader_only=True)
+    scheduler.add_job("sweep_abandoned_carts", sweep_carts_on_every_shard, settings.CART_SWEEP_INTERVAL_SECONDS, leader_only=True)
+
+    def expire_cart_store():
+        expired = cart_store.expire(settings.CART_STORE_IDLE_SECONDS)
+        cart_store_expired_total.inc(amount=expired)
+        return expired
+
+    # the in memory store belongs to each worker, so this one runs everywhere
+    scheduler.add_job("expire_cart_store", expire_cart_store, settings.CART_STORE_EXPIRE_INTERVAL_SECONDS)
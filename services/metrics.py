@@ -0,0 +1,185 @@
+# https://prometheus.io/docs/instrumenting/exposition_formats/
+import bisect
+import threading
+
+from typing import Callable, Iterable
+
+DEFAULT_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DEFAULT_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+# Metrics live in plain dicts owned by this worker process. They are updated from the event loop and from worker
+# threads (sync dependencies, scheduler jobs), so every update takes the metric's lock, an uncontended lock is far
+# cheaper than the request it measures. Every worker exposes its own values, aggregation is left to the scraper.
+class Metric:
+    type: str = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (), function: Callable[[], dict[tuple, float]] | None = None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values: dict[tuple, float] = {}
+        # function metrics are computed when scraped instead of being updated on every change
+        self.function = function
+        self._lock = threading.Lock()
+
+    def _format_labels(self, labelvalues: tuple, extra: dict[str, str] | None = None) -> str:
+        pairs = list(zip(self.labelnames, labelvalues))
+        if extra:
+            pairs.extend(extra.items())
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{key}="{_escape(str(value))}"' for key, value in pairs) + "}"
+
+    def samples(self) -> Iterable[str]:
+        if self.function is not None:
+            values = self.function()
+        else:
+            with self._lock:
+                values = dict(self.values)
+        for labelvalues, value in values.items():
+            yield f"{self.name}{self._format_labels(labelvalues)} {value}"
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, *labelvalues: str, amount: float = 1):
+        with self._lock:
+            self.values[labelvalues] = self.values.get(labelvalues, 0) + amount
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, *labelvalues: str, value: float):
+        with self._lock:
+            self.values[labelvalues] = value
+
+    def inc(self, *labelvalues: str, amount: float = 1):
+        with self._lock:
+            self.values[labelvalues] = self.values.get(labelvalues, 0) + amount
+
+    def dec(self, *labelvalues: str, amount: float = 1):
+        self.inc(*labelvalues, amount=-amount)
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (), buckets: Iterable[float] = DEFAULT_LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # per label set: [count per bucket..., count above the last bucket], [sum]
+        self.observations: dict[tuple, tuple[list[int], list[float]]] = {}
+
+    def observe(self, *labelvalues: str, value: float):
+        with self._lock:
+            entry = self.observations.get(labelvalues)
+            if entry is None:
+                entry = self.observations[labelvalues] = ([0] * (len(self.buckets) + 1), [0.0])
+            entry[0][bisect.bisect_left(self.buckets, value)] += 1
+            entry[1][0] += value
+
+    def samples(self) -> Iterable[str]:
+        with self._lock:
+            observations = [(labelvalues, list(counts), total[0]) for labelvalues, (counts, total) in self.observations.items()]
+        for labelvalues, counts, total in observations:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                yield f"{self.name}_bucket{self._format_labels(labelvalues, {'le': str(bound)})} {cumulative}"
+            cumulative += counts[-1]
+            yield f"{self.name}_bucket{self._format_labels(labelvalues, {'le': '+Inf'})} {cumulative}"
+            yield f"{self.name}_sum{self._format_labels(labelvalues)} {total}"
+            yield f"{self.name}_count{self._format_labels(labelvalues)} {cumulative}"
+
+class CacheMetrics:
+    def __init__(self):
+        self.hits: dict[str, int] = {}
+        self.misses: dict[str, int] = {}
+        self.lru_caches: dict[str, Callable] = {}
+        self._lock = threading.Lock()
+
+    def record(self, cache: str, hit: bool):
+        counter = self.hits if hit else self.misses
+        with self._lock:
+            counter[cache] = counter.get(cache, 0) + 1
+
+    # functools.lru_cache already counts its hits and misses, they are read when scraped
+    def register_lru_cache(self, cache: str, func: Callable):
+        self.lru_caches[cache] = func
+
+    def snapshot(self) -> dict[str, tuple[int, int]]:
+        result = {}
+        with self._lock:
+            for cache in self.hits.keys() | self.misses.keys():
+                result[cache] = (self.hits.get(cache, 0), self.misses.get(cache, 0))
+        for cache, func in self.lru_caches.items():
+            info = func.cache_info() # type: ignore
+            result[cache] = (info.hits, info.misses)
+        return result
+
+    def hits_by_cache(self) -> dict[tuple, float]:
+        return {(cache,): hits for cache, (hits, _) in self.snapshot().items()}
+
+    def misses_by_cache(self) -> dict[tuple, float]:
+        return {(cache,): misses for cache, (_, misses) in self.snapshot().items()}
+
+    def hit_ratio_by_cache(self) -> dict[tuple, float]:
+        return {(cache,): hits / (hits + misses) if hits + misses else 0 for cache, (hits, misses) in self.snapshot().items()}
+
+class Registry:
+    def __init__(self):
+        self.metrics: dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Iterable[str] = (), function: Callable[[], dict[tuple, float]] | None = None) -> Counter:
+        return self.register(Counter(name, documentation, labelnames, function)) # type: ignore
+
+    def gauge(self, name: str, documentation: str, labelnames: Iterable[str] = (), function: Callable[[], dict[tuple, float]] | None = None) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames, function)) # type: ignore
+
+    def histogram(self, name: str, documentation: str, labelnames: Iterable[str] = (), buckets: Iterable[float] = DEFAULT_LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets)) # type: ignore
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self.metrics.values()) + "\n"
+
+registry = Registry()
+
+http_requests_total = registry.counter("http_requests_total", "HTTP requests by route template and status code", ["method", "route", "status"])
+http_request_duration_seconds = registry.histogram("http_request_duration_seconds", "HTTP request latency by route template", ["method", "route"])
+http_requests_in_progress = registry.gauge("http_requests_in_progress", "HTTP requests currently being served")
+db_queries_total = registry.counter("db_queries_total", "SQL statements executed")
+db_queries_per_request = registry.histogram("db_queries_per_request", "SQL statements executed per HTTP request", ["route"], buckets=DEFAULT_COUNT_BUCKETS)
+cart_sweep_reclaimed_rows_total = registry.counter("cart_sweep_reclaimed_rows_total", "Rows deleted by the abandoned cart sweep", ["table"])
+cart_store_expired_total = registry.counter("cart_store_expired_total", "Idle carts dropped from the in memory cart store")
+db_time_per_request_seconds = registry.histogram("db_time_per_request_seconds", "Time spent in SQL statements per HTTP request", ["route"])
+live_update_subscribers = registry.gauge("live_update_subscribers", "Open product update streams (SSE and WebSocket) of this worker")
+live_updates_sent_total = registry.counter("live_updates_sent_total", "Product changes queued for delivery to subscribers")
+
+def _db_pool_stats() -> dict[tuple, float]:
+    from db.engine import get_engine
+
+    pool = get_engine().pool
+    stats = {}
+    for name in ("size", "checkedout", "overflow", "checkedin"):
+        if hasattr(pool, name):
+            stats[(name,)] = getattr(pool, name)()
+    return stats
+
+registry.gauge("db_pool_connections", "Connection pool state of the primary engine", ["state"], function=_db_pool_stats)
+
+caches = CacheMetrics()
+registry.counter("cache_hits_total", "Cache hits", ["cache"], function=caches.hits_by_cache)
+registry.counter("cache_misses_total", "Cache misses", ["cache"], function=caches.misses_by_cache)
+registry.gauge("cache_hit_ratio", "Cache hits over all lookups", ["cache"], function=caches.hit_ratio_by_cache)
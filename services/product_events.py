@@ -0,0 +1,162 @@
+# https://www.postgresql.org/docs/current/sql-notify.html
+import asyncio
+import json
+import logging
+import selectors
+import threading
+
+from decimal import Decimal
+from functools import lru_cache
+from typing import Iterable
+
+from sqlalchemy import text
+from sqlmodel import Session, select
+
+from core.config import settings
+from db.engine import get_engine
+from db.models import Product
+from schemas.product import ProductChange
+from services.metrics import live_update_subscribers, live_updates_sent_total
+
+logger = logging.getLogger(__name__)
+
+# NOTIFY payloads must stay below 8000 bytes, a checkout of many products is sent in several notifications
+NOTIFY_BATCH_SIZE = 100
+
+
+def encode_changes(changes: list[ProductChange]) -> list[str]:
+    rows = [[change.product_id, change.available_quantity, str(change.original_price)] for change in changes]
+    return [json.dumps(rows[start:start + NOTIFY_BATCH_SIZE], separators=(",", ":")) for start in range(0, len(rows), NOTIFY_BATCH_SIZE)]
+
+def decode_changes(payload: str) -> list[ProductChange]:
+    return [ProductChange(product_id=id, available_quantity=quantity, original_price=Decimal(price)) for id, quantity, price in json.loads(payload)]
+
+# Queues the stock and price of the products on the session's transaction. Postgres delivers the notifications to
+# every listening worker when the transaction commits and drops them when it rolls back, so subscribers never see
+# a change that did not happen
+def notify_product_changes(session: Session, products: Iterable[Product]):
+    changes = [ProductChange(product_id=product.id, available_quantity=product.available_quantity, original_price=product.original_price) for product in products] # type: ignore
+    for payload in encode_changes(changes):
+        session.execute(text("SELECT pg_notify(:channel, :payload)"), {"channel": settings.LIVE_UPDATES_CHANNEL, "payload": payload})
+
+# the current stock and price of the products, sent first so a client never waits for a change to learn the values
+def current_changes(session: Session, product_ids: Iterable[int]) -> list[ProductChange]:
+    rows = session.exec(select(Product.id, Product.available_quantity, Product.original_price).where(Product.id.in_(list(product_ids)))).all() # type: ignore
+    return [ProductChange(product_id=id, available_quantity=quantity, original_price=price) for id, quantity, price in rows]
+
+def sse_event(change: ProductChange) -> str:
+    return f"event: product\ndata: {change.model_dump_json()}\n\n"
+
+# The product ids one SSE or WebSocket stream is subscribed to and the changes it has not sent yet. Only the latest
+# change per product is kept, a slow client skips intermediate values instead of queueing them up
+class Subscription:
+    def __init__(self, product_ids: Iterable[int] = ()):
+        self.product_ids: set[int] = set(product_ids)
+        self.pending: dict[int, ProductChange] = {}
+        self.ready = asyncio.Event()
+
+    def push(self, change: ProductChange):
+        self.pending[change.product_id] = change
+        self.ready.set()
+
+    async def changes(self) -> list[ProductChange]:
+        await self.ready.wait()
+        self.ready.clear()
+        changes, self.pending = list(self.pending.values()), {}
+        return changes
+
+# One per worker: a thread LISTENs on a dedicated connection and hands every notification to the event loop, which
+# fans it out to the subscriptions of the changed products. Subscriptions are only touched on the event loop
+class ProductBroadcaster:
+    def __init__(self, channel: str = settings.LIVE_UPDATES_CHANNEL):
+        self.channel = channel
+        self.subscribers: dict[int, set[Subscription]] = {}
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._thread: threading.Thread | None = None
+        self._stopping = threading.Event()
+        # set while the LISTEN connection is up, changes committed before that are not pushed
+        self.listening = threading.Event()
+
+    def subscribe(self, product_ids: Iterable[int] = ()) -> Subscription:
+        subscription = Subscription()
+        self.add(subscription, product_ids)
+        live_update_subscribers.inc()
+        return subscription
+
+    def add(self, subscription: Subscription, product_ids: Iterable[int]):
+        for product_id in product_ids:
+            subscription.product_ids.add(product_id)
+            self.subscribers.setdefault(product_id, set()).add(subscription)
+
+    def remove(self, subscription: Subscription, product_ids: Iterable[int]):
+        for product_id in product_ids:
+            subscription.product_ids.discard(product_id)
+            subscribers = self.subscribers.get(product_id)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self.subscribers[product_id]
+
+    def unsubscribe(self, subscription: Subscription):
+        self.remove(subscription, list(subscription.product_ids))
+        live_update_subscribers.dec()
+
+    def publish(self, changes: list[ProductChange]):
+        for change in changes:
+            for subscription in self.subscribers.get(change.product_id, ()):
+                subscription.push(change)
+                live_updates_sent_total.inc()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._listen, name="product-broadcaster", daemon=True)
+        self._thread.start()
+
+    async def stop(self):
+        if self._thread is None:
+            return
+        self._stopping.set()
+        await asyncio.to_thread(self._thread.join)
+        self._thread = None
+
+    def _listen(self):
+        while not self._stopping.is_set():
+            try:
+                self._listen_once()
+            except Exception:
+                # changes committed until the connection is back are not pushed, clients see them on their next read
+                logger.exception("Listening for product changes failed, reconnecting in %ss", settings.LIVE_UPDATES_RECONNECT_SECONDS)
+                self._stopping.wait(settings.LIVE_UPDATES_RECONNECT_SECONDS)
+
+    def _listen_once(self):
+        # LISTEN holds its connection for as long as the worker runs, it is taken out of the pool for good
+        connection = get_engine().raw_connection()
+        connection.detach()
+        try:
+            dbapi_connection = connection.dbapi_connection
+            dbapi_connection.autocommit = True # type: ignore
+            with dbapi_connection.cursor() as cursor: # type: ignore
+                cursor.execute(f'LISTEN "{self.channel}"')
+            self.listening.set()
+            with selectors.DefaultSelector() as selector:
+                selector.register(dbapi_connection, selectors.EVENT_READ)
+                while not self._stopping.is_set():
+                    # wakes up every second to notice a shutdown
+                    if not selector.select(timeout=1):
+                        continue
+                    dbapi_connection.poll() # type: ignore
+                    changes = []
+                    while dbapi_connection.notifies: # type: ignore
+                        changes.extend(decode_changes(dbapi_connection.notifies.pop(0).payload)) # type: ignore
+                    if changes and self._loop is not None:
+                        self._loop.call_soon_threadsafe(self.publish, changes)
+        finally:
+            self.listening.clear()
+            connection.close()
+
+@lru_cache(maxsize=1)
+def get_product_broadcaster() -> ProductBroadcaster:
+    return ProductBroadcaster()
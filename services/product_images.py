@@ -0,0 +1,66 @@
+import asyncio
+import datetime
+import logging
+
+from sqlalchemy.orm import selectinload
+from sqlmodel import Session
+
+from core.config import settings
+from db.engine import get_engine
+from db.models import Product, ProductImage, ProductImageVariant, UploadedFile
+from schemas.file import FileStatus, ImageStatus
+from services.blob_storage import get_blob_storage
+from services.image_processing import render_variants
+from services.workers import run_in_process
+
+logger = logging.getLogger(__name__)
+
+# Images and their variants stay unloaded unless asked for, endpoints that serialize products without a fieldset
+# load them with this, two SELECT ... IN for the whole page instead of two lazy loads per product
+load_product_images = selectinload(Product.images).selectinload(ProductImage.variants) # type: ignore
+
+
+# Runs once the uploaded original passed the virus scan, decoding and resizing happen in the process pool
+async def process_product_image(image_id: int):
+    storage = get_blob_storage()
+    
+    with Session(get_engine()) as session:
+        image = session.get(ProductImage, image_id)
+        if image is None:
+            return
+        file_obj = session.get(UploadedFile, image.file_id)
+        if file_obj is None:
+            return
+        
+        try:
+            data = await asyncio.to_thread(storage.read, file_obj.sha256)
+            variants = await run_in_process(render_variants, data, settings.PRODUCT_IMAGE_WIDTHS, settings.PRODUCT_IMAGE_QUALITY)
+            for width, height, content in variants:
+                blob = await asyncio.to_thread(storage.save_bytes, content)
+                session.add(ProductImageVariant(image_id=image_id, width=width, height=height, content_type="image/webp", sha256=blob.key))
+            image.status = ImageStatus.ready
+        except Exception:
+            logger.exception("Failed to process product image %s", image_id)
+            session.rollback()
+            image.status = ImageStatus.failed
+        
+        image.updated_at = datetime.datetime.now(datetime.UTC)
+        session.add(image)
+        session.commit()
+
+def on_product_image_scanned(image_id: int):
+    async def callback(status: FileStatus):
+        if status == FileStatus.clean:
+            await process_product_image(image_id)
+            return
+        
+        with Session(get_engine()) as session:
+            image = session.get(ProductImage, image_id)
+            if image is None:
+                return
+            image.status = ImageStatus.failed
+            image.updated_at = datetime.datetime.now(datetime.UTC)
+            session.add(image)
+            session.commit()
+    
+    return callback
@@ -0,0 +1,99 @@
+from decimal import Decimal
+from typing import Any
+
+from sqlalchemy import case, func, tuple_
+from sqlmodel import Session, select
+
+from core.config import settings
+from db.models import Category, Product
+from schemas.product import CategoryFacet, PriceBucketFacet, ProductFacets, ProductListQuery, ProductSort
+from services.product_images import load_product_images
+
+
+# where clauses shared by the product list and its facets, so both always describe the same products
+def search_filters(product_name: str | None = None, category: str | None = None, listing: ProductListQuery | None = None) -> list[Any]:
+    filters = []
+    if product_name is not None:
+        filters.append(Product.name.ilike(f"%{product_name}%")) # type: ignore
+    if category is not None:
+        filters.append(Product.category.has(Category.name.ilike(f"%{category}%"))) # type: ignore
+    if listing is not None:
+        filters.extend(listing_filters(listing))
+    return filters
+
+def listing_filters(listing: ProductListQuery) -> list[Any]:
+    filters = []
+    if listing.min_price is not None:
+        filters.append(Product.original_price >= listing.min_price)
+    if listing.max_price is not None:
+        filters.append(Product.original_price <= listing.max_price)
+    if listing.in_stock is not None:
+        filters.append(Product.available_quantity > 0 if listing.in_stock else Product.available_quantity == 0)
+    return filters
+
+# Every order ends on the primary key so pages never overlap, and matches one of the composite indexes on product
+# (with or without category_id in front), the rows are read in index order instead of being sorted
+def order_by(sort: ProductSort | None, default: ProductSort | None = ProductSort.name) -> tuple[Any, ...]:
+    match sort or default:
+        case ProductSort.name:
+            return (Product.name,)
+        case ProductSort.price_asc:
+            return (Product.original_price, Product.id)
+        case ProductSort.price_desc:
+            return (Product.original_price.desc(), Product.id.desc()) # type: ignore
+        case ProductSort.newest:
+            return (Product.created_at.desc(), Product.id.desc()) # type: ignore
+        case _:
+            return (Product.id,)
+
+# index of the bucket a price falls in, bucket i starts at bounds[i]
+def price_bucket(bounds: list[int]):
+    return case(*[(Product.original_price < upper, index) for index, upper in enumerate(bounds[1:])], else_=len(bounds) - 1)
+
+# All three facets come from one scan of the matching products: GROUPING SETS groups the same rows by category,
+# by price bucket and by stock, and grouping() tells which of the three a result row belongs to
+def facet_counts(session: Session, filters: list[Any], bounds: list[int] = settings.PRODUCT_PRICE_BUCKETS) -> ProductFacets:
+    matching = select(Category.name.label("category"), price_bucket(bounds).label("price_bucket"), (Product.available_quantity > 0).label("in_stock")).select_from(Product).join(Category, Product.category_id == Category.id).where(*filters).subquery() # type: ignore
+    statement = select(
+        matching.c.category,
+        matching.c.price_bucket,
+        matching.c.in_stock,
+        func.count(),
+        func.grouping(matching.c.category),
+        func.grouping(matching.c.price_bucket),
+    ).group_by(func.grouping_sets(tuple_(matching.c.category), tuple_(matching.c.price_bucket), tuple_(matching.c.in_stock)))
+
+    facets = ProductFacets()
+    for category, bucket, in_stock, count, category_grouped, bucket_grouped in session.exec(statement).all(): # type: ignore
+        if category_grouped == 0:
+            facets.categories.append(CategoryFacet(name=category, count=count))
+        elif bucket_grouped == 0:
+            facets.price_buckets.append(PriceBucketFacet(min_price=Decimal(bounds[bucket]), max_price=Decimal(bounds[bucket + 1]) if bucket + 1 < len(bounds) else None, count=count))
+        elif in_stock:
+            facets.in_stock = count
+        else:
+            facets.out_of_stock = count
+
+    facets.categories.sort(key=lambda facet: (-facet.count, facet.name))
+    facets.price_buckets.sort(key=lambda facet: facet.min_price)
+    return facets
+
+# Reciprocal rank fusion: a product scores 1 / (k + rank) in every ranking it appears in, so products ranked high
+# by both keyword and semantic search come first without comparing their unrelated scores
+def reciprocal_rank_fusion(rankings: list[list[int]], k: int = 60) -> list[int]:
+    scores: dict[int, float] = {}
+    for ranking in rankings:
+        for rank, product_id in enumerate(ranking):
+            scores[product_id] = scores.get(product_id, 0) + 1 / (k + rank + 1)
+    return sorted(scores, key=lambda product_id: -scores[product_id])
+
+# the ranked products that pass the filters, in ranking order
+def filter_ranking(session: Session, ranking: list[int], filters: list[Any]) -> list[int]:
+    if not ranking:
+        return []
+    allowed = set(session.exec(select(Product.id).where(Product.id.in_(ranking), *filters)).all()) # type: ignore
+    return [product_id for product_id in ranking if product_id in allowed]
+
+def products_in_order(session: Session, product_ids: list[int]) -> list[Product]:
+    products = {product.id: product for product in session.exec(select(Product).where(Product.id.in_(product_ids)).options(load_product_images)).all()} # type: ignore
+    return [products[product_id] for product_id in product_ids if product_id in products]
@@ -0,0 +1,156 @@
+import datetime
+
+from dataclasses import dataclass
+from decimal import ROUND_HALF_UP, Decimal
+from functools import lru_cache
+from typing import Iterable
+
+from fastapi import HTTPException
+from sqlalchemy import or_, update
+from sqlmodel import Session, select
+
+from db.engine import get_engine
+from db.models import Promotion
+from schemas.promotion import PromotionKind
+
+CENT = Decimal("0.01")
+
+
+@dataclass(frozen=True)
+class Rule:
+    id: int
+    kind: PromotionKind
+    value: Decimal
+    starts_at: datetime.datetime | None
+    ends_at: datetime.datetime | None
+    voucher_code: str | None = None
+
+    def is_running(self, now: datetime.datetime) -> bool:
+        return (self.starts_at is None or self.starts_at <= now) and (self.ends_at is None or now < self.ends_at)
+
+    def apply(self, price: Decimal) -> Decimal:
+        if self.kind == PromotionKind.percentage:
+            discounted = price * (100 - self.value) / 100
+        else:
+            discounted = price - self.value
+        return max(discounted, Decimal(0)).quantize(CENT, rounding=ROUND_HALF_UP)
+
+@dataclass
+class CartLine:
+    product_id: int
+    category_id: int
+    vendor_id: int
+    original_price: Decimal
+    quantity: int
+
+@dataclass
+class PricedLine:
+    product_id: int
+    quantity: int
+    unit_price: Decimal
+    promotion_id: int | None = None
+
+    @property
+    def amount(self) -> Decimal:
+        return self.unit_price * self.quantity
+
+# Promotions do not stack, every unit gets the single best running rule of its product, category, vendor or of the
+# whole catalog, and of the voucher entered at checkout
+def best_price(original_price: Decimal, rules: list[Rule], now: datetime.datetime) -> tuple[Decimal, int | None]:
+    best, promotion_id = Decimal(original_price).quantize(CENT, rounding=ROUND_HALF_UP), None
+    for rule in rules:
+        if rule.is_running(now) and (price := rule.apply(original_price)) < best:
+            best, promotion_id = price, rule.id
+    return best, promotion_id
+
+# The promotions that have not ended, compiled into one dict per scope so pricing a product is four lookups and
+# never a query. Listings price every row with it, checkout prices the whole cart in one pass
+class PromotionRules:
+    def __init__(self, promotions: Iterable[Promotion] = ()):
+        self.by_product: dict[int, list[Rule]] = {}
+        self.by_category: dict[int, list[Rule]] = {}
+        self.by_vendor: dict[int, list[Rule]] = {}
+        self.everywhere: list[Rule] = []
+        self.vouchers: dict[str, tuple[Rule, Promotion]] = {}
+        for promotion in promotions:
+            rule = Rule(id=promotion.id, kind=promotion.kind, value=Decimal(promotion.value), starts_at=promotion.starts_at, ends_at=promotion.ends_at, voucher_code=promotion.voucher_code) # type: ignore
+            if promotion.voucher_code is not None:
+                self.vouchers[promotion.voucher_code] = (rule, promotion)
+            elif promotion.product_id is not None:
+                self.by_product.setdefault(promotion.product_id, []).append(rule)
+            elif promotion.category_id is not None:
+                self.by_category.setdefault(promotion.category_id, []).append(rule)
+            elif promotion.vendor_id is not None:
+                self.by_vendor.setdefault(promotion.vendor_id, []).append(rule)
+            else:
+                self.everywhere.append(rule)
+
+    def rules_for(self, product_id: int, category_id: int, vendor_id: int) -> list[Rule]:
+        return self.by_product.get(product_id, []) + self.by_category.get(category_id, []) + self.by_vendor.get(vendor_id, []) + self.everywhere
+
+    def voucher_applies(self, promotion: Promotion, line: CartLine) -> bool:
+        if promotion.product_id is not None:
+            return promotion.product_id == line.product_id
+        if promotion.category_id is not None:
+            return promotion.category_id == line.category_id
+        if promotion.vendor_id is not None:
+            return promotion.vendor_id == line.vendor_id
+        return True
+
+    def price(self, product_id: int, category_id: int, vendor_id: int, original_price: Decimal, now: datetime.datetime | None = None) -> Decimal:
+        return best_price(original_price, self.rules_for(product_id, category_id, vendor_id), now or datetime.datetime.now(datetime.UTC))[0]
+
+    def price_cart(self, lines: list[CartLine], voucher_code: str | None = None, now: datetime.datetime | None = None) -> list[PricedLine]:
+        now = now or datetime.datetime.now(datetime.UTC)
+        voucher = None
+        if voucher_code is not None:
+            voucher = self.vouchers.get(voucher_code)
+            if voucher is None or not voucher[0].is_running(now):
+                raise HTTPException(status_code=400, detail="Invalid voucher")
+
+        priced = []
+        for line in lines:
+            rules = self.rules_for(line.product_id, line.category_id, line.vendor_id)
+            if voucher is not None and self.voucher_applies(voucher[1], line):
+                rules = [*rules, voucher[0]]
+            unit_price, promotion_id = best_price(line.original_price, rules, now)
+            priced.append(PricedLine(product_id=line.product_id, quantity=line.quantity, unit_price=unit_price, promotion_id=promotion_id))
+
+        if voucher is not None and not any(line.promotion_id == voucher[0].id for line in priced):
+            raise HTTPException(status_code=400, detail="Voucher does not apply to this cart")
+        return priced
+
+# One set of rules per worker, replaced as a whole on refresh. Changes made through this worker refresh it right
+# away, the periodic refresh picks up the ones made through the others
+class PromotionEngine:
+    def __init__(self):
+        self.rules = PromotionRules()
+
+    # the promotion endpoints pass their request session, startup and the periodic refresh open their own
+    def refresh(self, session: Session | None = None) -> int:
+        if session is None:
+            with Session(get_engine()) as session:
+                return self.refresh(session)
+        now = datetime.datetime.now(datetime.UTC)
+        promotions = session.exec(select(Promotion).where(or_(Promotion.ends_at == None, Promotion.ends_at > now), or_(Promotion.max_uses == None, Promotion.uses < Promotion.max_uses))).all() # type: ignore # noqa: E711
+        # the rules outlive the session, a later commit must not expire the values they hold
+        for promotion in promotions:
+            session.expunge(promotion)
+        # readers keep the rules they started with, the new ones are swapped in with one assignment
+        self.rules = PromotionRules(promotions)
+        return len(promotions)
+
+# Counts a use of the voucher in the checkout transaction, the conditional update lets exactly max_uses
+# checkouts through however many run at once
+def claim_voucher(session: Session, promotion_id: int):
+    claimed = session.execute(update(Promotion).where(Promotion.id == promotion_id, or_(Promotion.max_uses == None, Promotion.uses < Promotion.max_uses)).values(uses=Promotion.uses + 1)) # type: ignore # noqa: E711
+    if claimed.rowcount == 0: # type: ignore
+        raise HTTPException(status_code=409, detail="Voucher has been used up")
+
+# gives the use back when the order it was claimed for could not be stored
+def release_voucher(session: Session, promotion_id: int):
+    session.execute(update(Promotion).where(Promotion.id == promotion_id, Promotion.uses > 0).values(uses=Promotion.uses - 1)) # type: ignore
+
+@lru_cache(maxsize=1)
+def get_promotion_engine() -> PromotionEngine:
+    return PromotionEngine()
@@ -0,0 +1,118 @@
+import logging
+
+from typing import TYPE_CHECKING, Iterable, Sequence
+
+from sqlalchemy import Engine, delete
+from sqlalchemy.dialects.postgresql import insert
+from sqlmodel import Session, select
+
+from core.config import settings
+from db.engine import get_engine
+from db.models import OrderItem, Product, ProductCooccurrence
+from db.sharding import get_cart_engines
+from services.product_images import load_product_images
+from services.scheduler import Scheduler
+
+# numpy is imported when the matrix is built, not at startup
+if TYPE_CHECKING:
+    import numpy as np
+
+logger = logging.getLogger(__name__)
+
+WRITE_BATCH_SIZE = 5000
+
+
+# The product x product matrix is sparse, it is kept as COO arrays: product, related product and count, one entry
+# per pair of distinct products bought in the same order (both directions)
+def cooccurrence_counts(order_ids: Sequence[int], product_ids: Sequence[int]) -> tuple["np.ndarray", "np.ndarray", "np.ndarray"]:
+    import numpy as np
+
+    rows = np.unique(np.column_stack([np.asarray(order_ids, dtype=np.int64), np.asarray(product_ids, dtype=np.int64)]).reshape(-1, 2), axis=0)
+    if len(rows) == 0:
+        return np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0, np.int64)
+    # unique sorted the rows by order, every order is a block of its distinct products
+    products = rows[:, 1]
+    _, starts, sizes = np.unique(rows[:, 0], return_index=True, return_counts=True)
+    # each row is paired with every row of its block, row i is repeated as often as its block is long
+    repeats = np.repeat(sizes, sizes)
+    left = np.repeat(np.arange(len(rows)), repeats)
+    offsets = np.arange(len(left)) - np.repeat(np.cumsum(repeats) - repeats, repeats)
+    right = np.repeat(np.repeat(starts, sizes), repeats) + offsets
+    pairs = np.column_stack([products[left], products[right]])
+    pairs = pairs[pairs[:, 0] != pairs[:, 1]]
+    return merge_counts([(pairs[:, 0], pairs[:, 1], np.ones(len(pairs), np.int64))])
+
+# sums the counts of the same pair, orders never span shards so the matrices of all shards just add up
+def merge_counts(parts: Iterable[tuple["np.ndarray", "np.ndarray", "np.ndarray"]]) -> tuple["np.ndarray", "np.ndarray", "np.ndarray"]:
+    import numpy as np
+
+    parts = list(parts)
+    pairs = np.column_stack([np.concatenate([part[0] for part in parts]), np.concatenate([part[1] for part in parts])]).reshape(-1, 2)
+    counts = np.concatenate([part[2] for part in parts])
+    unique_pairs, inverse = np.unique(pairs, axis=0, return_inverse=True)
+    summed = np.bincount(inverse.reshape(-1), weights=counts, minlength=len(unique_pairs)).astype(np.int64)
+    return unique_pairs[:, 0], unique_pairs[:, 1], summed
+
+# keeps the k most frequent related products of every product, ties go to the lower product id
+def top_k(products: "np.ndarray", related: "np.ndarray", counts: "np.ndarray", k: int) -> tuple["np.ndarray", "np.ndarray", "np.ndarray"]:
+    import numpy as np
+
+    order = np.lexsort((related, -counts, products))
+    products, related, counts = products[order], related[order], counts[order]
+    _, starts, sizes = np.unique(products, return_index=True, return_counts=True)
+    rank = np.arange(len(products)) - np.repeat(starts, sizes)
+    keep = rank < k
+    return products[keep], related[keep], counts[keep]
+
+def read_order_products(engine: Engine) -> tuple["np.ndarray", "np.ndarray"]:
+    import numpy as np
+
+    with engine.connect() as connection:
+        rows = connection.execute(select(OrderItem.order_id, OrderItem.product_id).where(OrderItem.product_id.is_not(None)).distinct()).all() # type: ignore
+    matrix = np.array(rows, dtype=np.int64).reshape(-1, 2)
+    return matrix[:, 0], matrix[:, 1]
+
+# Replaces the whole table in one transaction, readers keep seeing the previous neighbours until it commits
+def rebuild_product_cooccurrence(top: int = settings.RELATED_PRODUCTS_TOP_K) -> int:
+    import numpy as np
+
+    products, related, counts = top_k(*merge_counts(cooccurrence_counts(*read_order_products(engine)) for engine in get_cart_engines()), top)
+
+    with Session(get_engine()) as session:
+        # order items keep the id of products that were deleted since
+        existing = np.array(session.exec(select(Product.id)).all(), dtype=np.int64)
+        keep = np.isin(products, existing) & np.isin(related, existing)
+        rows = [{"product_id": a, "related_product_id": b, "count": c} for a, b, c in zip(products[keep].tolist(), related[keep].tolist(), counts[keep].tolist())]
+
+        session.exec(delete(ProductCooccurrence)) # type: ignore
+        # a checkout may insert a pair again while the rebuild runs, the rebuilt count wins
+        statement = insert(ProductCooccurrence)
+        statement = statement.on_conflict_do_update(index_elements=[ProductCooccurrence.product_id, ProductCooccurrence.related_product_id], set_={"count": statement.excluded.count})
+        for start in range(0, len(rows), WRITE_BATCH_SIZE):
+            session.execute(statement, rows[start:start + WRITE_BATCH_SIZE])
+        session.commit()
+    return len(rows)
+
+# Adds the pairs of a new order right away, so recommendations follow sales between rebuilds. The order is already
+# committed at this point, a failure here is logged and left for the next rebuild
+def record_order_products(session: Session, product_ids: Iterable[int]):
+    # sorted, so concurrent checkouts lock the pairs they share in the same order and cannot deadlock
+    distinct = sorted(set(product_ids))
+    rows = [{"product_id": a, "related_product_id": b, "count": 1} for a in distinct for b in distinct if a != b]
+    if not rows:
+        return
+
+    statement = insert(ProductCooccurrence).values(rows)
+    try:
+        session.execute(statement.on_conflict_do_update(index_elements=[ProductCooccurrence.product_id, ProductCooccurrence.related_product_id], set_={"count": ProductCooccurrence.count + statement.excluded.count}))
+        session.commit()
+    except Exception:
+        session.rollback()
+        logger.exception("Recording the co-occurrences of products %s failed", distinct)
+
+def get_related_products(session: Session, product_id: int, limit: int) -> Sequence[Product]:
+    statement = select(Product).join(ProductCooccurrence, ProductCooccurrence.related_product_id == Product.id).where(ProductCooccurrence.product_id == product_id).order_by(ProductCooccurrence.count.desc(), Product.id).limit(limit).options(load_product_images) # type: ignore
+    return session.exec(statement).all()
+
+def register_recommendation_jobs(scheduler: Scheduler):
+    scheduler.add_job("rebuild_product_cooccurrence", rebuild_product_cooccurrence, settings.RELATED_PRODUCTS_REBUILD_INTERVAL_SECONDS, leader_only=True)
@@ -0,0 +1,63 @@
+import asyncio
+import logging
+
+from dataclasses import dataclass
+from typing import Any, Callable
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ScheduledJob:
+    name: str
+    func: Callable[[], Any]
+    interval_seconds: float
+    # jobs that must not run concurrently from several workers only run in the leader worker
+    leader_only: bool = False
+    # runs once right after start instead of waiting a full interval first
+    run_now: bool = False
+
+
+# Periodic maintenance jobs run on the event loop of the app, the job itself is executed in a worker thread
+# so blocking database calls never stall request handling
+class Scheduler:
+    def __init__(self):
+        self.jobs: dict[str, ScheduledJob] = {}
+        self._tasks: list[asyncio.Task] = []
+
+    def add_job(self, name: str, func: Callable[[], Any], interval_seconds: float, leader_only: bool = False, run_now: bool = False):
+        self.jobs[name] = ScheduledJob(name=name, func=func, interval_seconds=interval_seconds, leader_only=leader_only, run_now=run_now)
+
+    def remove_job(self, name: str):
+        self.jobs.pop(name, None)
+
+    async def run_job(self, job: ScheduledJob):
+        try:
+            result = await asyncio.to_thread(job.func)
+            logger.info("Scheduled job %s finished: %s", job.name, result)
+            return result
+        except Exception:
+            logger.exception("Scheduled job %s failed", job.name)
+
+    async def _run_forever(self, job: ScheduledJob):
+        if job.run_now:
+            await self.run_job(job)
+        while True:
+            await asyncio.sleep(job.interval_seconds)
+            await self.run_job(job)
+
+    def start(self, leader: bool = True):
+        if self._tasks:
+            return
+        for job in self.jobs.values():
+            if job.leader_only and not leader:
+                continue
+            self._tasks.append(asyncio.create_task(self._run_forever(job), name=f"scheduler:{job.name}"))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+
+scheduler = Scheduler()
@@ -0,0 +1,21 @@
+from fastapi import HTTPException
+from sqlalchemy import update
+from sqlmodel import Session
+
+from db.models import Product
+
+
+# Takes the ordered quantities off the stock with one conditional UPDATE per product, so two checkouts racing for the
+# last units cannot both succeed. Products are updated in id order, concurrent checkouts cannot deadlock
+def reserve_stock(session: Session, quantities: dict[int, int]) -> list[Product]:
+    products = []
+    for product_id, quantity in sorted(quantities.items()):
+        product = session.scalars(update(Product).where(Product.id == product_id, Product.available_quantity >= quantity).values(available_quantity=Product.available_quantity - quantity).returning(Product)).one_or_none() # type: ignore
+        if product is None:
+            raise HTTPException(status_code=409, detail="Not enough stock")
+        products.append(product)
+    return products
+
+# Puts the quantities of an order that could not be stored back on the stock
+def release_stock(session: Session, quantities: dict[int, int]) -> list[Product]:
+    return [session.scalars(update(Product).where(Product.id == product_id).values(available_quantity=Product.available_quantity + quantity).returning(Product)).one() for product_id, quantity in sorted(quantities.items())] # type: ignore
@@ -0,0 +1,156 @@
+import bisect
+import heapq
+import threading
+import unicodedata
+
+from collections import Counter, OrderedDict
+from dataclasses import dataclass
+from functools import lru_cache
+
+from sqlalchemy import func
+from sqlmodel import Session, select
+
+from core.config import settings
+from db.engine import get_engine
+from db.models import Category, OrderItem, Product
+from db.sharding import get_cart_engines
+from services.metrics import caches
+
+
+# case, accents and repeated spaces are ignored, "Café  Table" and "cafe table" are the same key
+def normalize(text: str) -> str:
+    decomposed = unicodedata.normalize("NFKD", text.casefold())
+    return " ".join("".join(char for char in decomposed if not unicodedata.combining(char)).split())
+
+# every word start is a key, so "electric kettle" is suggested for "ele" and for "ket"
+def keys_of(text: str) -> set[str]:
+    words = normalize(text).split(" ")
+    return {" ".join(words[i:]) for i in range(len(words)) if words[i]}
+
+@dataclass(eq=False)
+class Suggestion:
+    kind: str # product | category
+    id: int
+    text: str
+    weight: int = 0 # units sold, of the product or of every product in the category
+    category_id: int | None = None
+
+# Longest list a prefix is answered with, shorter limits are a slice of it
+MAX_SUGGESTIONS = 20
+# sorts after every character a key can contain, key ranges end before prefix + this
+KEY_END = "\U0010ffff"
+
+# A sorted array of (key, kind, id) answers a prefix with two binary searches for the range of keys starting with
+# it. Answers are memoized per prefix, a new or removed name only drops the answers of the prefixes it matches.
+# Sales only change the order of suggestions, they are not worth dropping answers for and show up after the
+# next rebuild
+class SuggestionIndex:
+    def __init__(self, cache_size: int = settings.SUGGEST_CACHE_SIZE):
+        self.keys: list[tuple[str, str, int]] = []
+        self.suggestions: dict[tuple[str, int], Suggestion] = {}
+        self.cache_size = cache_size
+        self.cache: OrderedDict[str, list[Suggestion]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def load(self, suggestions: list[Suggestion]):
+        keys = sorted((key, suggestion.kind, suggestion.id) for suggestion in suggestions for key in keys_of(suggestion.text))
+        with self._lock:
+            self.keys = keys
+            self.suggestions = {(suggestion.kind, suggestion.id): suggestion for suggestion in suggestions}
+            self.cache.clear()
+        # single letters match the most names and are typed first, they are answered before the first request
+        for letter in sorted({key[0] for key, _, _ in keys})[:self.cache_size]:
+            self.suggest(letter, MAX_SUGGESTIONS)
+
+    def _invalidate(self, text: str):
+        keys = keys_of(text)
+        for prefix in [prefix for prefix in self.cache if any(key.startswith(prefix) for key in keys)]:
+            del self.cache[prefix]
+
+    def _remove(self, kind: str, id: int) -> Suggestion | None:
+        suggestion = self.suggestions.pop((kind, id), None)
+        if suggestion is not None:
+            for key in keys_of(suggestion.text):
+                index = bisect.bisect_left(self.keys, (key, kind, id))
+                if index < len(self.keys) and self.keys[index] == (key, kind, id):
+                    del self.keys[index]
+            self._invalidate(suggestion.text)
+        return suggestion
+
+    def remove(self, kind: str, id: int):
+        with self._lock:
+            self._remove(kind, id)
+
+    # adds a name or replaces the previous name of the same product or category
+    def put(self, suggestion: Suggestion):
+        with self._lock:
+            previous = self._remove(suggestion.kind, suggestion.id)
+            if previous is not None:
+                suggestion.weight = previous.weight
+            self.suggestions[(suggestion.kind, suggestion.id)] = suggestion
+            for key in keys_of(suggestion.text):
+                bisect.insort(self.keys, (key, suggestion.kind, suggestion.id))
+            self._invalidate(suggestion.text)
+
+    def put_product(self, product: Product):
+        self.put(Suggestion(kind="product", id=product.id, text=product.name, category_id=product.category_id)) # type: ignore
+
+    def add_sales(self, quantities: dict[int, int]):
+        with self._lock:
+            for product_id, quantity in quantities.items():
+                product = self.suggestions.get(("product", product_id))
+                if product is None:
+                    continue
+                product.weight += quantity
+                category = self.suggestions.get(("category", product.category_id)) # type: ignore
+                if category is not None:
+                    category.weight += quantity
+
+    def suggest(self, query: str, limit: int) -> list[Suggestion]:
+        prefix = normalize(query)
+        if not prefix:
+            return []
+
+        with self._lock:
+            cached = self.cache.get(prefix)
+            caches.record("product_suggestions", hit=cached is not None)
+            if cached is not None:
+                self.cache.move_to_end(prefix)
+                return cached[:limit]
+
+            start = bisect.bisect_left(self.keys, (prefix,))
+            end = bisect.bisect_left(self.keys, (prefix + KEY_END,), lo=start)
+            matches = {(kind, id) for _, kind, id in self.keys[start:end]}
+            # best sellers first, then the shortest (closest) names
+            result = heapq.nsmallest(MAX_SUGGESTIONS, (self.suggestions[match] for match in matches), key=lambda suggestion: (-suggestion.weight, len(suggestion.text), suggestion.text))
+
+            self.cache[prefix] = result
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+            return result[:limit]
+
+    # reads every product and category name and the units sold from every cart database
+    def rebuild(self) -> int:
+        sales: Counter[int] = Counter()
+        for engine in get_cart_engines():
+            with Session(engine) as session:
+                for product_id, quantity in session.exec(select(OrderItem.product_id, func.sum(OrderItem.quantity)).group_by(OrderItem.product_id)).all(): # type: ignore
+                    sales[product_id] += int(quantity)
+
+        with Session(get_engine()) as session:
+            categories = session.exec(select(Category.id, Category.name)).all()
+            products = session.exec(select(Product.id, Product.name, Product.category_id)).all()
+
+        category_sales: Counter[int] = Counter()
+        for product_id, _, category_id in products:
+            category_sales[category_id] += sales[product_id]
+        suggestions = [Suggestion(kind="category", id=id, text=name, weight=category_sales[id]) for id, name in categories] # type: ignore
+        suggestions += [Suggestion(kind="product", id=id, text=name, weight=sales[id], category_id=category_id) for id, name, category_id in products]
+        self.load(suggestions)
+        return len(suggestions)
+
+# One index per worker process. Writes handled by this worker update it right away, the periodic rebuild picks up
+# the ones handled by the other workers
+@lru_cache(maxsize=1)
+def get_suggestion_index() -> SuggestionIndex:
+    return SuggestionIndex()
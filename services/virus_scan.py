@@ -0,0 +1,201 @@
+# https://docs.clamav.net/manual/Usage/Scanning.html#clamd
+import asyncio
+import datetime
+import logging
+import struct
+
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Awaitable, Callable, Iterator
+
+from sqlalchemy import update
+from sqlmodel import Session, select
+
+from core.config import settings
+from db.engine import get_engine
+from db.models import ProductImage, UploadedFile
+from schemas.file import FileStatus
+from services.blob_storage import BlobStorage, get_blob_storage
+from services.product_images import on_product_image_scanned
+
+logger = logging.getLogger(__name__)
+
+EICAR_SIGNATURE = rb"X5O!P%@AP[4\PZX54(P^)7CC)7}$EICAR-STANDARD-ANTIVIRUS-TEST-FILE!$H+H*"
+
+ScanCallback = Callable[[FileStatus], Awaitable[None]]
+
+
+class VirusScanError(Exception):
+    pass
+
+@dataclass
+class ScanResult:
+    infected: bool
+    signature: str | None = None
+
+async def _iter_in_thread(chunks: Iterator[bytes]):
+    # blob storage reads are blocking, each chunk is fetched in a worker thread
+    while (chunk := await asyncio.to_thread(next, chunks, None)) is not None:
+        yield chunk
+
+class VirusScanner(ABC):
+    @abstractmethod
+    async def scan(self, chunks: Iterator[bytes]) -> ScanResult:
+        ...
+
+# Speaks the clamd INSTREAM protocol: each chunk is prefixed with its length as a 4 byte big endian integer
+# and the stream is terminated by a zero length chunk
+class ClamAVScanner(VirusScanner):
+    def __init__(self, host: str, port: int, timeout: float = settings.VIRUS_SCAN_TIMEOUT_SECONDS):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+
+    async def scan(self, chunks: Iterator[bytes]) -> ScanResult:
+        try:
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port), self.timeout)
+        except (OSError, asyncio.TimeoutError) as e:
+            raise VirusScanError(f"Unable to connect to clamd at {self.host}:{self.port}") from e
+
+        try:
+            writer.write(b"zINSTREAM\0")
+            async for chunk in _iter_in_thread(chunks):
+                writer.write(struct.pack("!L", len(chunk)) + chunk)
+                await writer.drain()
+            writer.write(struct.pack("!L", 0))
+            await writer.drain()
+            reply = await asyncio.wait_for(reader.readuntil(b"\0"), self.timeout)
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError) as e:
+            raise VirusScanError("clamd did not answer the scan request") from e
+        finally:
+            writer.close()
+
+        return self.parse_reply(reply.rstrip(b"\0").decode())
+
+    @staticmethod
+    def parse_reply(reply: str) -> ScanResult:
+        # "stream: OK" | "stream: Eicar-Signature FOUND" | "INSTREAM size limit exceeded. ERROR"
+        result = reply.split(":", 1)[-1].strip()
+        if result == "OK":
+            return ScanResult(infected=False)
+        if result.endswith(" FOUND"):
+            return ScanResult(infected=True, signature=result.removesuffix(" FOUND"))
+        raise VirusScanError(f"clamd returned an error: {reply}")
+
+# Local stand in for clamd, only detects the EICAR test file
+class FakeVirusScanner(VirusScanner):
+    async def scan(self, chunks: Iterator[bytes]) -> ScanResult:
+        tail = b""
+        async for chunk in _iter_in_thread(chunks):
+            # keep the end of the previous chunk so a signature split across chunks is still found
+            window = tail + chunk
+            if EICAR_SIGNATURE in window:
+                return ScanResult(infected=True, signature="Eicar-Test-Signature")
+            tail = window[-len(EICAR_SIGNATURE):]
+        return ScanResult(infected=False)
+
+# Uploads are stored in quarantine (status pending) and scanned by a fixed number of workers,
+# the upload request returns as soon as the file is queued
+class VirusScanService:
+    def __init__(self, scanner: VirusScanner, storage: BlobStorage, concurrency: int = settings.VIRUS_SCAN_CONCURRENCY):
+        self.scanner = scanner
+        self.storage = storage
+        self.concurrency = concurrency
+        self.queue: asyncio.Queue[tuple[int, ScanCallback | None]] = asyncio.Queue()
+        self._workers: list[asyncio.Task] = []
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+    def enqueue(self, file_id: int, on_complete: ScanCallback | None = None):
+        self.queue.put_nowait((file_id, on_complete))
+
+    # files still pending from a previous run, and the ones whose scan failed (clamd down or timing out), are
+    # queued again. Their callbacks are gone with the request that queued them, the ones of product images are
+    # rebuilt so the image is processed once its original turns out clean
+    def requeue(self, statuses: tuple[FileStatus, ...] = (FileStatus.pending, FileStatus.error)) -> int:
+        with Session(get_engine()) as session:
+            rows = session.exec(
+                select(UploadedFile.id, ProductImage.id)
+                .outerjoin(ProductImage, ProductImage.file_id == UploadedFile.id) # type: ignore
+                .where(UploadedFile.status.in_(statuses)) # type: ignore
+            ).all()
+        for file_id, image_id in rows:
+            on_complete = on_product_image_scanned(image_id) if image_id is not None else None
+            if self._loop is None:
+                self.enqueue(file_id, on_complete) # type: ignore
+            else:
+                # the retry job runs in a scheduler thread, the queue is only touched on the event loop
+                self._loop.call_soon_threadsafe(self.enqueue, file_id, on_complete)
+        return len(rows)
+
+    def requeue_failed(self) -> int:
+        return self.requeue((FileStatus.error,))
+
+    def start(self):
+        if self._workers:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._workers = [asyncio.create_task(self._worker(), name=f"virus-scan:{i}") for i in range(self.concurrency)]
+
+    async def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers.clear()
+        self._loop = None
+
+    async def process(self, file_id: int, on_complete: ScanCallback | None = None):
+        status = await self.scan_file(file_id)
+        if on_complete is not None and status is not None:
+            await on_complete(status)
+
+    async def _worker(self):
+        while True:
+            file_id, on_complete = await self.queue.get()
+            try:
+                await self.process(file_id, on_complete)
+            except Exception:
+                logger.exception("Virus scan of file %s failed", file_id)
+            finally:
+                self.queue.task_done()
+
+    # pending -> clean | infected, or error when the scanner failed. Error files are scanned again when requeued.
+    # No session is held while the file is scanned, a scan can take as long as VIRUS_SCAN_TIMEOUT_SECONDS
+    async def scan_file(self, file_id: int) -> FileStatus | None:
+        with Session(get_engine()) as session:
+            file_obj = session.get(UploadedFile, file_id)
+            if file_obj is None:
+                return None
+            if file_obj.status not in (FileStatus.pending, FileStatus.error):
+                return file_obj.status
+            sha256 = file_obj.sha256
+
+        try:
+            result = await self.scanner.scan(self.storage.iter_chunks(sha256))
+        except VirusScanError as e:
+            logger.warning("Virus scan of file %s failed: %s", file_id, e)
+            status, scan_result = FileStatus.error, str(e)
+        else:
+            status = FileStatus.infected if result.infected else FileStatus.clean
+            scan_result = result.signature
+
+        now = datetime.datetime.now(datetime.UTC)
+        if status == FileStatus.infected:
+            # the blob is shared by every upload with the same content, so all of them are infected
+            await asyncio.to_thread(self.storage.delete, sha256)
+            condition = UploadedFile.sha256 == sha256
+        else:
+            condition = UploadedFile.id == file_id
+        with Session(get_engine()) as session:
+            session.exec(update(UploadedFile).where(condition).values(status=status, scan_result=scan_result, scanned_at=now)) # type: ignore
+            session.commit()
+        return status
+
+def get_virus_scanner() -> VirusScanner:
+    if settings.VIRUS_SCANNER == "clamav":
+        return ClamAVScanner(settings.CLAMAV_HOST, settings.CLAMAV_PORT)
+    return FakeVirusScanner()
+
+@lru_cache(maxsize=1)
+def get_virus_scan_service() -> VirusScanService:
+    return VirusScanService(get_virus_scanner(), get_blob_storage())
@@ -0,0 +1,44 @@
+import asyncio
+import os
+
+from functools import lru_cache, partial
+from typing import TYPE_CHECKING, Any, Callable
+
+from core.config import settings
+
+if TYPE_CHECKING:
+    from concurrent.futures import ProcessPoolExecutor
+
+
+# CPU heavy work (image decoding, document rendering) runs in a separate process pool so it never holds the GIL
+# of the API worker. "spawn" is used so children do not inherit the parent's database connections or event loop
+@lru_cache(maxsize=1)
+def get_process_pool() -> "ProcessPoolExecutor":
+    # imported on first use, the module alone adds noticeably to the startup time
+    import multiprocessing
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    return ProcessPoolExecutor(max_workers=settings.PROCESS_POOL_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+
+async def run_in_process(func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_process_pool(), partial(func, *args, **kwargs))
+
+def shutdown_process_pool():
+    if get_process_pool.cache_info().currsize == 0:
+        return
+    get_process_pool().shutdown(wait=False, cancel_futures=True)
+    get_process_pool.cache_clear()
+
+# serve.py numbers its forked workers through WORKER_INDEX (and WORKER_COUNT), a plain uvicorn process is worker 0.
+# It is read from the environment on every call because settings are loaded before the workers are forked
+def get_worker_index() -> int:
+    return int(os.environ.get("WORKER_INDEX", "0"))
+
+def is_leader_worker() -> bool:
+    return get_worker_index() == 0
+
+# only serve.py knows how many processes serve the app, a plain uvicorn process may be one of several
+def is_single_worker() -> bool:
+    return os.environ.get("WORKER_COUNT") == "1"
@@ -0,0 +1,110 @@
+import asyncio
+
+import pytest
+
+from fastapi.testclient import TestClient
+from pydantic import SecretStr
+from sqlmodel import Session
+
+from main import app
+from schemas.user import UserCreate
+from services import virus_scan
+from services.blob_storage import LocalBlobStorage, get_blob_storage
+from services.crud_user import user
+from services.virus_scan import EICAR_SIGNATURE, FakeVirusScanner, VirusScanService, get_virus_scan_service
+
+
+def login(client: TestClient, session: Session, username: str) -> str:
+    user.create(session, UserCreate(username=username, email=f"{username}@example.com", password=SecretStr("Test_1234!")))
+
+    data = client.post("/users/login", data={
+        "username": username,
+        "password": "Test_1234!"
+    })
+
+    return data.json()["access_token"]
+
+@pytest.fixture
+def scan_service(client: TestClient, session: Session, tmp_path, monkeypatch: pytest.MonkeyPatch) -> VirusScanService:
+    storage = LocalBlobStorage(str(tmp_path))
+    scan_service = VirusScanService(FakeVirusScanner(), storage)
+    # queued scans are run by the test, on the test database
+    monkeypatch.setattr(virus_scan, "get_engine", session.get_bind)
+
+    app.dependency_overrides[get_blob_storage] = lambda: storage
+    app.dependency_overrides[get_virus_scan_service] = lambda: scan_service
+
+    return scan_service
+
+def upload(client: TestClient, token: str, data: bytes = b"GIF89a not really a gif") -> dict:
+    response = client.put("/files/upload/image.gif/", content=data, headers={
+        "Authorization": f"Bearer {token}",
+        "Content-Type": "image/gif"
+    })
+
+    assert response.status_code == 201
+    return response.json()
+
+def test_download_pending_file(client: TestClient, session: Session, scan_service: VirusScanService):
+    token = login(client, session, "fileowner")
+    file = upload(client, token)
+
+    response = client.get(f"/files/{file['id']}/", headers={
+        "Authorization": f"Bearer {token}"
+    })
+
+    assert response.status_code == 409
+    assert response.json()["detail"] == "File is not available, virus scan status is pending"
+
+def test_download_other_users_file(client: TestClient, session: Session, scan_service: VirusScanService):
+    file = upload(client, login(client, session, "fileowner"))
+    other_token = login(client, session, "otheruser")
+
+    download = client.get(f"/files/{file['id']}/", headers={
+        "Authorization": f"Bearer {other_token}"
+    })
+    status = client.get(f"/files/{file['id']}/status/", headers={
+        "Authorization": f"Bearer {other_token}"
+    })
+
+    assert download.status_code == 403
+    assert download.json()["detail"] == "Unauthorized to access other user's file"
+    assert status.status_code == 403
+
+def test_file_status_after_clean_scan(client: TestClient, session: Session, scan_service: VirusScanService):
+    token = login(client, session, "fileowner")
+    file = upload(client, token, b"GIF89a clean")
+
+    pending = client.get(f"/files/{file['id']}/status/", headers={
+        "Authorization": f"Bearer {token}"
+    })
+    asyncio.run(scan_service.process(*scan_service.queue.get_nowait()))
+    clean = client.get(f"/files/{file['id']}/status/", headers={
+        "Authorization": f"Bearer {token}"
+    })
+    download = client.get(f"/files/{file['id']}/", headers={
+        "Authorization": f"Bearer {token}"
+    })
+
+    assert pending.json()["status"] == "pending"
+    assert clean.json()["status"] == "clean"
+    assert clean.json()["scanned_at"] is not None
+    assert download.status_code == 200
+    assert download.content == b"GIF89a clean"
+
+def test_file_status_after_infected_scan(client: TestClient, session: Session, scan_service: VirusScanService):
+    token = login(client, session, "fileowner")
+    file = upload(client, token, EICAR_SIGNATURE)
+
+    asyncio.run(scan_service.process(*scan_service.queue.get_nowait()))
+    status = client.get(f"/files/{file['id']}/status/", headers={
+        "Authorization": f"Bearer {token}"
+    })
+    download = client.get(f"/files/{file['id']}/", headers={
+        "Authorization": f"Bearer {token}"
+    })
+
+    assert status.json()["status"] == "infected"
+    assert status.json()["scan_result"] == "Eicar-Test-Signature"
+    assert download.status_code == 409
+    assert not scan_service.storage.exists(file["sha256"])
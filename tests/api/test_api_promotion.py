@@ -0,0 +1,87 @@
+from typing import Any
+
+import pytest
+
+from fastapi.testclient import TestClient
+from pydantic import SecretStr
+from sqlmodel import Session
+
+from db.models import User
+from schemas.user import UserCreate
+from services.crud_user import user
+from services.promotions import PromotionRules, get_promotion_engine
+
+
+# the rules are held by the worker, later tests must not price with promotions of this module
+@pytest.fixture(autouse=True)
+def reset_promotion_rules():
+    yield
+    get_promotion_engine().rules = PromotionRules()
+
+@pytest.fixture
+def login_vendor(client: TestClient, session: Session):
+    user_obj = UserCreate(username="promotionvendor", email="promotionvendor@example.com", password=SecretStr("Test_1234!"), is_vendor=True)
+    
+    user_dict = user.create(session, user_obj)
+    
+    data = client.post("/users/login", data={
+        "username": "promotionvendor",
+        "password": "Test_1234!"
+    })
+    
+    return data.json()["access_token"], user_dict
+
+@pytest.fixture
+def create_product(client: TestClient, login_vendor: tuple[str, User]) -> dict[str, Any]:
+    data = client.post("/products/create/", json={
+        "name": "Promoted Product",
+        "description": "Test Product Description",
+        "original_price": 10,
+        "available_quantity": 10,
+        "category_name": "Others"
+    }, headers={
+        "Authorization": f"Bearer {login_vendor[0]}"
+    })
+    
+    return data.json()
+
+def test_vendor_promotion_lowers_the_listed_price(client: TestClient, session: Session, login_vendor: tuple[str, User], create_product: dict[str, Any]):
+    response = client.post("/promotions/create/", json={
+        "name": "Spring sale",
+        "kind": "percentage",
+        "value": 20,
+        "product_id": create_product["id"]
+    }, headers={
+        "Authorization": f"Bearer {login_vendor[0]}"
+    })
+    
+    assert response.status_code == 201
+    
+    response = client.get(f"/products/{create_product['id']}/", headers={
+        "Authorization": f"Bearer {login_vendor[0]}"
+    })
+    
+    assert response.json()["effective_price"] == "8.00"
+
+def test_vendor_cannot_run_a_catalog_wide_promotion(client: TestClient, session: Session, login_vendor: tuple[str, User]):
+    response = client.post("/promotions/create/", json={
+        "name": "Everything must go",
+        "kind": "fixed",
+        "value": 5
+    }, headers={
+        "Authorization": f"Bearer {login_vendor[0]}"
+    })
+    
+    assert response.status_code == 403
+
+def test_percentage_above_100_is_rejected(client: TestClient, session: Session, login_vendor: tuple[str, User]):
+    response = client.post("/promotions/create/", json={
+        "name": "Too good",
+        "kind": "percentage",
+        "value": 150,
+        "vendor_id": login_vendor[1].id
+    }, headers={
+        "Authorization": f"Bearer {login_vendor[0]}"
+    })
+    
+    assert response.status_code == 422
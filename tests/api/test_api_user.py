@@ -42,6 +42,35 @@ def test_get_username_existing_user(client: TestClient, session: Session, login_
     assert "is_vendor" in response.json() and response.json()["is_vendor"] is False
     assert "is_superuser" in response.json() and response.json()["is_superuser"] is False
     
+def test_get_user_with_included_orders(client: TestClient, session: Session, login_user: tuple[str, User], statements: list[str]):
+    token, user_dict = login_user
+    statements.clear()
+    
+    response = client.get(f"/users/{user_dict.username}/?include=orders", headers={
+        "Authorization": f"Bearer {token}"
+    })
+    
+    assert response.status_code == 200
+    assert response.json()["orders"] == []
+    assert "products" not in response.json()
+    assert "cart" not in response.json()
+    assert any('FROM "order" WHERE "order".user_id IN (' in statement for statement in statements)
+    # the products and the cart of the user are not loaded
+    assert not any("FROM product" in statement or "FROM cart" in statement for statement in statements)
+
+def test_get_user_without_relationships(client: TestClient, session: Session, login_user: tuple[str, User], statements: list[str]):
+    token, user_dict = login_user
+    statements.clear()
+    
+    response = client.get(f"/users/{user_dict.username}/?fields=username,email&include=", headers={
+        "Authorization": f"Bearer {token}"
+    })
+    
+    assert response.status_code == 200
+    assert response.json() == {"id": user_dict.id, "username": user_dict.username, "email": user_dict.email}
+    assert statements[-1].startswith('SELECT "user".username, "user".email, "user".id FROM "user"')
+    assert not any("IN (" in statement for statement in statements)
+
 def test_get_username_without_token(client: TestClient):
     response = client.get("/users/test")
     
@@ -0,0 +1,73 @@
+import datetime
+import itertools
+
+from decimal import Decimal
+
+import pytest
+
+from sqlalchemy import text
+from sqlmodel import Session, select
+
+from db.models import Category, Product, User
+from schemas.product import ProductListQuery, ProductSort
+from services.product_search import listing_filters, order_by
+
+SORTS = [None, *ProductSort]
+LISTINGS = [
+    ProductListQuery(),
+    ProductListQuery(min_price=Decimal(10), max_price=Decimal(100)),
+    ProductListQuery(in_stock=True),
+]
+
+
+def plan_nodes(plan: dict):
+    yield plan
+    for child in plan.get("Plans", []):
+        yield from plan_nodes(child)
+
+def explain(session: Session, statement) -> list[dict]:
+    sql = statement.compile(dialect=session.get_bind().dialect, compile_kwargs={"literal_binds": True})
+    # The test table is tiny, left alone the planner would rightly scan and sort it. With these off it still has to
+    # fall back to them when no index can deliver the rows in the requested order, which is what the tests look for
+    for setting in ("enable_seqscan", "enable_bitmapscan", "enable_sort"):
+        session.execute(text(f"SET LOCAL {setting} = off"))
+    plan = session.execute(text(f"EXPLAIN (FORMAT JSON) {sql}")).scalar_one()
+    return list(plan_nodes(plan[0]["Plan"]))
+
+@pytest.fixture
+def catalog(session: Session) -> Category:
+    now = datetime.datetime.now(datetime.UTC)
+    vendor = User(username="indexvendor", email="indexvendor@example.com", password_hash="x", is_vendor=True, created_at=now)
+    session.add(vendor)
+    session.commit()
+    categories = session.exec(select(Category)).all()
+    for i, category in enumerate(itertools.islice(itertools.cycle(categories), 200)):
+        # prices are spread over the table instead of rising with the insert order. Perfectly correlated, a price
+        # range would read so few heap pages that the planner prefers the price index and filters the category
+        price = Decimal(i * 37 % 200)
+        session.add(Product(name=f"indexed product {i}", description="", category_id=category.id, original_price=price, available_quantity=i % 3, created_at=now, vendor_id=vendor.id)) # type: ignore
+    session.commit()
+    session.execute(text("ANALYZE product"))
+    return categories[0]
+
+@pytest.mark.parametrize("sort", SORTS)
+@pytest.mark.parametrize("listing", LISTINGS)
+def test_product_list_reads_an_index_in_order(session: Session, catalog: Category, listing: ProductListQuery, sort: ProductSort | None):
+    statement = select(Product).where(*listing_filters(listing)).order_by(*order_by(sort, default=None)).limit(100)
+
+    nodes = explain(session, statement)
+
+    assert not any(node["Node Type"] == "Seq Scan" for node in nodes)
+    assert not any(node["Node Type"] in ("Sort", "Incremental Sort") for node in nodes)
+
+@pytest.mark.parametrize("sort", SORTS)
+@pytest.mark.parametrize("listing", LISTINGS)
+def test_category_list_reads_a_category_index_in_order(session: Session, catalog: Category, listing: ProductListQuery, sort: ProductSort | None):
+    statement = select(Product).where(Product.category_id == catalog.id, *listing_filters(listing)).order_by(*order_by(sort))
+
+    nodes = explain(session, statement)
+
+    assert any(node.get("Index Name", "").startswith("ix_product_category_id_") for node in nodes)
+    # the category is an index condition, not a filter applied to rows of every category
+    assert not any("category_id" in node.get("Filter", "") for node in nodes)
+    assert not any(node["Node Type"] in ("Sort", "Incremental Sort") for node in nodes)
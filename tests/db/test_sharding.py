@@ -0,0 +1,59 @@
+from collections import Counter
+
+import pytest
+
+from core.config import settings
+from db.engine import get_engine
+from db.models import Cart, Invoice, Order, Product, User
+from db.sharding import HashRing, get_hash_ring, get_shard_engine, get_shard_engines, shard_metadata, shard_session
+
+
+def test_keys_spread_over_every_shard():
+    ring = HashRing(["shard0", "shard1", "shard2"])
+    
+    counts = Counter(ring.get_node(user_id) for user_id in range(30_000))
+    
+    assert set(counts) == {"shard0", "shard1", "shard2"}
+    assert min(counts.values()) > 30_000 / 3 * 0.7
+
+def test_same_user_always_maps_to_the_same_shard():
+    assert HashRing(["shard0", "shard1"]).get_node(42) == HashRing(["shard1", "shard0"]).get_node(42)
+
+def test_adding_a_shard_only_moves_keys_to_the_new_shard():
+    ring = HashRing(["shard0", "shard1", "shard2"])
+    before = {user_id: ring.get_node(user_id) for user_id in range(10_000)}
+    
+    ring.add_node("shard3")
+    moved = {user_id for user_id, node in before.items() if ring.get_node(user_id) != node}
+    
+    assert all(ring.get_node(user_id) == "shard3" for user_id in moved)
+    assert len(moved) < 10_000 * 0.4
+
+def test_shard_schema_has_no_foreign_keys_to_global_tables():
+    metadata = shard_metadata()
+    
+    assert set(metadata.tables) == {"cart", "cartitem", "order", "orderitem", "invoice"}
+    referred = {foreign_key.target_fullname for table in metadata.tables.values() for foreign_key in table.foreign_keys}
+    assert referred == {"cart.id", "order.id"}
+
+@pytest.fixture
+def two_shards(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(settings, "SHARD_DB_URLS", {
+        "shard0": "postgresql+psycopg2://shard0/db",
+        "shard1": "postgresql+psycopg2://shard1/db"
+    })
+    get_shard_engines.cache_clear()
+    get_hash_ring.cache_clear()
+    yield
+    get_shard_engines.cache_clear()
+    get_hash_ring.cache_clear()
+
+def test_shard_session_routes_carts_and_orders_to_the_users_shard(two_shards):
+    shard = get_shard_engine(42)
+    
+    with shard_session(42) as session:
+        assert session.get_bind(Cart) is shard
+        assert session.get_bind(Order) is shard
+        assert session.get_bind(Invoice) is shard
+        assert session.get_bind(Product) is get_engine()
+        assert session.get_bind(User) is get_engine()
@@ -0,0 +1,94 @@
+import asyncio
+import hashlib
+import io
+import os
+
+import pytest
+
+from services.blob_storage import BlobTooLargeError, LocalBlobStorage, S3BlobStorage
+
+
+async def as_chunks(data: bytes, chunk_size: int = 4):
+    for i in range(0, len(data), chunk_size):
+        yield data[i:i + chunk_size]
+
+@pytest.fixture
+def storage(tmp_path) -> LocalBlobStorage:
+    return LocalBlobStorage(str(tmp_path))
+
+def test_save_content_addressed(storage: LocalBlobStorage):
+    data = b"hello blob storage"
+    
+    blob = asyncio.run(storage.save(as_chunks(data)))
+    
+    assert blob.key == hashlib.sha256(data).hexdigest()
+    assert blob.size == len(data)
+    assert storage.exists(blob.key)
+    assert storage.read(blob.key) == data
+
+def test_save_same_content_twice(storage: LocalBlobStorage):
+    first = asyncio.run(storage.save(as_chunks(b"duplicated")))
+    second = asyncio.run(storage.save(as_chunks(b"duplicated")))
+    
+    assert first.key == second.key
+    assert os.listdir(storage.tmp_dir) == []
+
+def test_save_too_large(storage: LocalBlobStorage):
+    with pytest.raises(BlobTooLargeError):
+        asyncio.run(storage.save(as_chunks(b"x" * 32), max_size=16))
+    
+    assert os.listdir(storage.tmp_dir) == []
+
+def test_delete(storage: LocalBlobStorage):
+    blob = asyncio.run(storage.save(as_chunks(b"to be deleted")))
+    
+    storage.delete(blob.key)
+    
+    assert not storage.exists(blob.key)
+
+# In-memory stand-in for the boto3 S3 client, with the calls S3BlobStorage makes
+class FakeS3Client:
+    def __init__(self):
+        self.objects: dict[tuple[str, str], bytes] = {}
+        self.uploads = 0
+
+    def upload_file(self, path: str, bucket: str, key: str):
+        self.uploads += 1
+        with open(path, "rb") as file:
+            self.objects[(bucket, key)] = file.read()
+
+    def head_object(self, Bucket: str, Key: str):
+        from botocore.exceptions import ClientError
+
+        if (Bucket, Key) not in self.objects:
+            raise ClientError({"Error": {"Code": "404", "Message": "Not Found"}}, "HeadObject")
+        return {"ContentLength": len(self.objects[(Bucket, Key)])}
+
+    def get_object(self, Bucket: str, Key: str):
+        from botocore.response import StreamingBody
+
+        data = self.objects[(Bucket, Key)]
+        return {"Body": StreamingBody(io.BytesIO(data), len(data))}
+
+    def delete_object(self, Bucket: str, Key: str):
+        self.objects.pop((Bucket, Key), None)
+
+def test_s3_storage(tmp_path):
+    pytest.importorskip("boto3")
+    client = FakeS3Client()
+    storage = S3BlobStorage("bucket", prefix="uploads/", chunk_size=4, client=client)
+    storage.tmp_dir = str(tmp_path)
+    data = b"hello s3 storage"
+    
+    blob = asyncio.run(storage.save(as_chunks(data)))
+    asyncio.run(storage.save(as_chunks(data)))
+    
+    assert ("bucket", f"uploads/{blob.key}") in client.objects
+    assert client.uploads == 1
+    assert storage.exists(blob.key)
+    assert storage.read(blob.key) == data
+    assert os.listdir(tmp_path) == []
+    
+    storage.delete(blob.key)
+    
+    assert not storage.exists(blob.key)
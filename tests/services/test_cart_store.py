@@ -0,0 +1,157 @@
+import datetime
+import itertools
+import threading
+
+import pytest
+
+from fastapi import HTTPException
+
+from core.config import settings
+from db.models import Product
+from services.cart_store import CartState, DatabaseCartStore, InMemoryCartStore, get_cart_store
+
+
+# the product checks are the real ones, loading and writing carts is faked
+class FakeBacking(DatabaseCartStore):
+    def __init__(self):
+        self.persisted: list[CartState] = []
+    
+    def load(self, session, user_id):
+        return None
+    
+    def persist(self, state: CartState):
+        self.persisted.append(state)
+
+# holds every write until the test releases it
+class BlockingBacking(FakeBacking):
+    def __init__(self):
+        super().__init__()
+        self.started = threading.Event()
+        self.release = threading.Event()
+    
+    def persist(self, state: CartState):
+        self.started.set()
+        self.release.wait(5)
+        super().persist(state)
+
+class FakeIds:
+    def __init__(self):
+        self.counter = itertools.count(1)
+    
+    def next_id(self, session, model):
+        return next(self.counter)
+
+class FakeSession:
+    def __init__(self, products: dict[int, Product]):
+        self.products = products
+    
+    def get(self, model, product_id):
+        return self.products.get(product_id)
+
+@pytest.fixture
+def store() -> InMemoryCartStore:
+    return InMemoryCartStore(FakeBacking(), FakeIds()) # type: ignore
+
+@pytest.fixture
+def session() -> FakeSession:
+    product = Product(id=1, name="kettle", description="electric kettle", category_id=1, original_price=10, available_quantity=5, created_at=datetime.datetime.now(datetime.UTC), vendor_id=1)
+    return FakeSession({1: product})
+
+def test_cart_changes_are_written_on_flush(store: InMemoryCartStore, session: FakeSession):
+    item = store.add_item(session, 7, 1, 2) # type: ignore
+    store.update_item(session, 7, item.id, 3) # type: ignore
+    
+    assert [cart_item.quantity for cart_item in store.get_items(session, 7)] == [3] # type: ignore
+    assert store.backing.persisted == [] # type: ignore
+    
+    assert store.flush() == 1
+    persisted = store.backing.persisted[0] # type: ignore
+    assert persisted.user_id == 7
+    assert [(cart_item.product_id, cart_item.quantity) for cart_item in persisted.items.values()] == [(1, 3)]
+    assert store.flush() == 0
+
+def test_add_item_checks_product_and_stock(store: InMemoryCartStore, session: FakeSession):
+    with pytest.raises(HTTPException) as e:
+        store.add_item(session, 7, 999, 1) # type: ignore
+    assert e.value.status_code == 404
+    
+    with pytest.raises(HTTPException) as e:
+        store.add_item(session, 7, 1, 6) # type: ignore
+    assert e.value.detail == "Not enough stock"
+    
+    store.add_item(session, 7, 1, 1) # type: ignore
+    with pytest.raises(HTTPException) as e:
+        store.add_item(session, 7, 1, 1) # type: ignore
+    assert e.value.detail == "Product already in cart"
+
+def test_other_users_items_are_not_found(store: InMemoryCartStore, session: FakeSession):
+    item = store.add_item(session, 7, 1, 1) # type: ignore
+    
+    with pytest.raises(HTTPException) as e:
+        store.remove_item(session, 8, item.id) # type: ignore
+    assert e.value.detail == "Cart item not found"
+
+def test_discard_drops_pending_changes(store: InMemoryCartStore, session: FakeSession):
+    store.add_item(session, 7, 1, 1) # type: ignore
+    store.discard(7)
+    
+    assert store.flush() == 0
+
+def test_idle_clean_carts_expire(store: InMemoryCartStore, session: FakeSession):
+    store.add_item(session, 7, 1, 1) # type: ignore
+    
+    # unflushed changes are never dropped
+    assert store.expire(idle_seconds=0) == 0
+    
+    store.flush()
+    assert store.expire(idle_seconds=60) == 0
+    assert store.expire(idle_seconds=0) == 1
+    assert store.carts == {}
+
+def test_checkout_waits_for_a_running_flush(session: FakeSession):
+    backing = BlockingBacking()
+    store = InMemoryCartStore(backing, FakeIds()) # type: ignore
+    store.add_item(session, 7, 1, 1) # type: ignore
+    
+    scheduled = threading.Thread(target=store.flush)
+    scheduled.start()
+    assert backing.started.wait(5)
+    
+    # checkout flushes the same cart and discards it once the order is stored
+    checkout = threading.Thread(target=lambda: (store.flush_user(7), store.discard(7)))
+    checkout.start()
+    checkout.join(0.2)
+    assert checkout.is_alive()
+    
+    backing.release.set()
+    scheduled.join(5)
+    checkout.join(5)
+    
+    assert len(backing.persisted) == 1
+    assert store.carts == {}
+    assert store.flush() == 0
+
+@pytest.mark.parametrize(("backend", "worker_count", "store_type"), [
+    ("database", None, DatabaseCartStore),
+    ("memory", "1", InMemoryCartStore),
+])
+def test_get_cart_store(monkeypatch: pytest.MonkeyPatch, backend: str, worker_count: str | None, store_type: type):
+    monkeypatch.setattr(settings, "CART_STORE_BACKEND", backend)
+    if worker_count is not None:
+        monkeypatch.setenv("WORKER_COUNT", worker_count)
+    get_cart_store.cache_clear()
+    
+    assert type(get_cart_store()) is store_type
+    get_cart_store.cache_clear()
+
+@pytest.mark.parametrize("worker_count", [None, "4"])
+def test_memory_cart_store_needs_a_single_worker(monkeypatch: pytest.MonkeyPatch, worker_count: str | None):
+    monkeypatch.setattr(settings, "CART_STORE_BACKEND", "memory")
+    monkeypatch.delenv("WORKER_COUNT", raising=False)
+    if worker_count is not None:
+        monkeypatch.setenv("WORKER_COUNT", worker_count)
+    get_cart_store.cache_clear()
+    
+    with pytest.raises(RuntimeError):
+        get_cart_store()
+    get_cart_store.cache_clear()
@@ -0,0 +1,63 @@
+import numpy as np
+
+from services.embeddings import EmbeddingStore, HashingEmbedder, new_version
+from services.product_search import reciprocal_rank_fusion
+
+
+def test_hashed_vectors_are_normalized_and_close_for_spelling_variants():
+    embedder = HashingEmbedder(dim=256)
+
+    kettle, kettles, laptop = embedder.embed(["Electric kettle", "electric KETTLES", "Gaming laptop"])
+
+    assert np.isclose(np.linalg.norm(kettle), 1)
+    assert kettle @ kettles > 0.5
+    assert kettle @ kettles > kettle @ laptop
+
+def test_store_returns_the_closest_products_first(tmp_path):
+    embedder = HashingEmbedder(dim=64)
+    store = EmbeddingStore(str(tmp_path))
+    store.write(np.array([10, 20, 30]), embedder.embed(["red wool scarf", "stainless steel kettle", "wool socks"]), embedder.name)
+
+    matches = store.search(embedder.embed(["wool scarf"])[0], 2, embedder.name)
+
+    assert [product_id for product_id, _ in matches] == [10, 30]
+    assert matches[0][1] > matches[1][1]
+
+def test_store_picks_up_a_new_build_and_ignores_other_embedders(tmp_path):
+    embedder = HashingEmbedder(dim=64)
+    store = EmbeddingStore(str(tmp_path))
+    store.write(np.array([1]), embedder.embed(["kettle"]), embedder.name)
+    assert store.search(embedder.embed(["kettle"])[0], 5, embedder.name)[0][0] == 1
+
+    EmbeddingStore(str(tmp_path)).write(np.array([2]), embedder.embed(["kettle"]), embedder.name)
+
+    assert store.search(embedder.embed(["kettle"])[0], 5, embedder.name)[0][0] == 2
+    assert store.search(embedder.embed(["kettle"])[0], 5, "spacy-en_core_web_md") == []
+
+def test_publish_keeps_the_previous_build_and_newer_files(tmp_path):
+    embedder = HashingEmbedder(dim=64)
+    store = EmbeddingStore(str(tmp_path))
+    metas = []
+    for product_id in (1, 2):
+        store.write(np.array([product_id]), embedder.embed(["kettle"]), embedder.name)
+        metas.append(store.read_meta())
+    # a build that started later and is still writing its vectors
+    unfinished = tmp_path / f"vectors-{new_version()}.npy"
+    unfinished.write_bytes(b"")
+
+    store.write(np.array([3]), embedder.embed(["kettle"]), embedder.name)
+
+    files = sorted(path.name for path in tmp_path.iterdir() if path.suffix == ".npy")
+    expected = [metas[1]["ids"], metas[1]["vectors"], store.read_meta()["ids"], store.read_meta()["vectors"], unfinished.name] # type: ignore
+    assert files == sorted(expected)
+
+def test_empty_store_has_no_matches(tmp_path):
+    embedder = HashingEmbedder(dim=64)
+    store = EmbeddingStore(str(tmp_path))
+    assert store.search(embedder.embed(["kettle"])[0], 5, embedder.name) == []
+
+    store.write(np.zeros(0, dtype=np.int64), np.zeros((0, 64), dtype=np.float32), embedder.name)
+    assert store.search(embedder.embed(["kettle"])[0], 5, embedder.name) == []
+
+def test_products_ranked_high_by_both_searches_come_first():
+    assert reciprocal_rank_fusion([[1, 2, 3], [3, 1, 4]]) == [1, 3, 2, 4]
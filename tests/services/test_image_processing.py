@@ -0,0 +1,32 @@
+import io
+
+from PIL import Image
+
+from services.image_processing import render_variants
+
+
+def image_bytes(width: int, height: int, format: str = "PNG", mode: str = "RGB") -> bytes:
+    output = io.BytesIO()
+    Image.new(mode, (width, height), color="red" if mode != "P" else 1).save(output, format=format)
+    return output.getvalue()
+
+def test_render_variants_sizes_and_format():
+    variants = render_variants(image_bytes(800, 400), [160, 320, 640], quality=70)
+    
+    assert [(width, height) for width, height, _ in variants] == [(160, 80), (320, 160), (640, 320)]
+    for width, height, content in variants:
+        with Image.open(io.BytesIO(content)) as image:
+            assert image.format == "WEBP"
+            assert image.size == (width, height)
+
+def test_render_variants_never_upscales():
+    variants = render_variants(image_bytes(200, 100, format="JPEG"), [160, 320, 640])
+    
+    assert [(width, height) for width, height, _ in variants] == [(160, 80), (200, 100)]
+
+def test_render_variants_converts_palette_images():
+    variants = render_variants(image_bytes(100, 100, format="GIF", mode="P"), [50])
+    
+    with Image.open(io.BytesIO(variants[0][2])) as image:
+        assert image.mode in ("RGB", "RGBA")
+        assert image.size == (50, 50)
@@ -0,0 +1,37 @@
+import datetime
+
+import pytest
+
+from services.invoice_rendering import LOCALES, format_date, format_money, render_invoice
+
+
+@pytest.fixture
+def context() -> dict:
+    return {
+        "order": {"id": 42, "created_at": datetime.datetime(2024, 3, 5, 10, 30, tzinfo=datetime.UTC).isoformat(), "total_price": "1234.50"},
+        "customer": {"username": "alice", "email": "alice@example.com"},
+        "items": [{"name": "Kettle <Deluxe>", "quantity": 2, "unit_price": "617.25", "amount": "1234.50"}],
+        "seller": "Online Shopping Platform",
+        "currency": "EUR",
+    }
+
+def test_amounts_and_dates_follow_the_language():
+    assert format_money("1234567.5", LOCALES["en"]["formats"], "USD") == "1,234,567.50 USD"
+    assert format_money("1234567.5", LOCALES["de"]["formats"], "EUR") == "1.234.567,50 EUR"
+    assert format_date("2024-03-05T10:30:00+00:00", LOCALES["de"]["formats"]) == "05. März 2024"
+    assert format_date("2024-03-05T10:30:00+00:00", LOCALES["es"]["formats"]) == "05 de marzo de 2024"
+
+@pytest.mark.parametrize("language", list(LOCALES))
+def test_every_language_renders_the_order(context: dict, language: str):
+    html = render_invoice(context, language).decode()
+
+    assert f'<html lang="{language}">' in html
+    assert LOCALES[language]["labels"]["invoice"] in html
+    assert "alice@example.com" in html
+    assert format_money("1234.50", LOCALES[language]["formats"], "EUR") in html
+
+def test_product_names_are_escaped(context: dict):
+    html = render_invoice(context, "en").decode()
+
+    assert "Kettle &lt;Deluxe&gt;" in html
+    assert "<Deluxe>" not in html
@@ -0,0 +1,47 @@
+import datetime
+
+from sqlmodel import Session, select
+
+from auth.auth import hash_token
+from db.models import Cart, CartItem, EmailVerification
+from services.maintenance import sweep_abandoned_carts, sweep_expired_email_verifications
+
+
+def test_sweep_expired_email_verifications(session: Session):
+    now = datetime.datetime.now(datetime.UTC)
+    for i in range(5):
+        session.add(EmailVerification(email=f"expired{i}@example.com", token_hash=hash_token(f"expired{i}"), expires_at=now - datetime.timedelta(minutes=1)))
+    session.add(EmailVerification(email="valid@example.com", token_hash=hash_token("valid"), expires_at=now + datetime.timedelta(days=1)))
+    session.commit()
+    
+    deleted = sweep_expired_email_verifications(session, batch_size=2, now=now)
+    
+    assert deleted == 5
+    remaining = session.exec(select(EmailVerification)).all()
+    assert len(remaining) == 1
+    assert remaining[0].email == "valid@example.com"
+
+def test_sweep_expired_email_verifications_nothing_expired(session: Session):
+    now = datetime.datetime.now(datetime.UTC)
+    session.add(EmailVerification(email="valid@example.com", token_hash=hash_token("valid"), expires_at=now + datetime.timedelta(days=1)))
+    session.commit()
+    
+    assert sweep_expired_email_verifications(session, batch_size=2, now=now) == 0
+
+def test_sweep_abandoned_carts(session: Session):
+    now = datetime.datetime.now(datetime.UTC)
+    for i in range(3):
+        cart = Cart(created_at=now - datetime.timedelta(days=60))
+        session.add(cart)
+        session.add(CartItem(cart=cart, quantity=1, created_at=now - datetime.timedelta(days=60)))
+    # created long ago but edited recently
+    session.add(Cart(created_at=now - datetime.timedelta(days=60), updated_at=now - datetime.timedelta(days=1)))
+    session.commit()
+    
+    carts, items = sweep_abandoned_carts(session, ttl_seconds=60 * 60 * 24 * 30, batch_size=2, now=now)
+    
+    assert (carts, items) == (3, 3)
+    remaining = session.exec(select(Cart)).all()
+    assert len(remaining) == 1
+    assert remaining[0].updated_at is not None
+    assert session.exec(select(CartItem)).all() == []
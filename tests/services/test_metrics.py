@@ -0,0 +1,69 @@
+import functools
+import threading
+
+from services.metrics import CacheMetrics, Counter, Gauge, Histogram
+
+
+def test_counter_render():
+    counter = Counter("requests_total", "Requests", ["route"])
+    counter.inc("/products/")
+    counter.inc("/products/", amount=2)
+    
+    assert counter.render().splitlines() == [
+        "# HELP requests_total Requests",
+        "# TYPE requests_total counter",
+        'requests_total{route="/products/"} 3',
+    ]
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram("latency_seconds", "Latency", buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 2.0):
+        histogram.observe(value=value)
+    
+    samples = list(histogram.samples())
+    
+    assert 'latency_seconds_bucket{le="0.1"} 2' in samples
+    assert 'latency_seconds_bucket{le="1.0"} 3' in samples
+    assert 'latency_seconds_bucket{le="+Inf"} 4' in samples
+    assert "latency_seconds_count 4" in samples
+    assert "latency_seconds_sum 2.65" in samples
+
+def test_label_values_are_escaped():
+    gauge = Gauge("info", "Info", ["value"])
+    gauge.set('a"b\\c', value=1)
+    
+    assert list(gauge.samples()) == ['info{value="a\\"b\\\\c"} 1']
+
+def test_cache_hit_ratio():
+    caches = CacheMetrics()
+    caches.record("suggest", hit=True)
+    caches.record("suggest", hit=True)
+    caches.record("suggest", hit=False)
+    
+    @functools.lru_cache(maxsize=1)
+    def cached(x: int) -> int:
+        return x
+    
+    cached(1)
+    cached(1)
+    caches.register_lru_cache("cached", cached)
+    
+    assert caches.hit_ratio_by_cache() == {("suggest",): 2 / 3, ("cached",): 0.5}
+
+def test_concurrent_increments_are_not_lost():
+    counter = Counter("jobs_total", "Jobs")
+    histogram = Histogram("job_seconds", "Job time", buckets=(1.0,))
+    
+    def work():
+        for _ in range(10_000):
+            counter.inc()
+            histogram.observe(value=0.5)
+    
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    
+    assert counter.values[()] == 80_000
+    assert "job_seconds_count 80000" in list(histogram.samples())
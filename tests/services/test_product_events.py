@@ -0,0 +1,68 @@
+import asyncio
+import json
+
+from decimal import Decimal
+
+from schemas.product import ProductChange
+from services.product_events import NOTIFY_BATCH_SIZE, ProductBroadcaster, decode_changes, encode_changes, sse_event
+
+
+def change(product_id: int, available_quantity: int = 1, price: str = "9.99") -> ProductChange:
+    return ProductChange(product_id=product_id, available_quantity=available_quantity, original_price=Decimal(price))
+
+def test_changes_survive_a_notification_round_trip():
+    changes = [change(1, 5, "10.50"), change(2, 0, "3")]
+
+    payloads = encode_changes(changes)
+
+    assert len(payloads) == 1
+    assert decode_changes(payloads[0]) == changes
+
+def test_large_checkouts_are_split_below_the_notify_payload_limit():
+    payloads = encode_changes([change(1_000_000 + i, 1_000_000, "99999999.99") for i in range(NOTIFY_BATCH_SIZE * 2 + 1)])
+
+    assert len(payloads) == 3
+    assert all(len(payload.encode()) < 8000 for payload in payloads)
+
+def test_changes_only_reach_the_subscribers_of_the_product():
+    async def run():
+        broadcaster = ProductBroadcaster()
+        kettle, both = broadcaster.subscribe([1]), broadcaster.subscribe([1, 2])
+
+        broadcaster.publish([change(2)])
+
+        assert not kettle.ready.is_set()
+        return await both.changes()
+
+    assert asyncio.run(run()) == [change(2)]
+
+def test_a_slow_subscriber_only_gets_the_latest_change_per_product():
+    async def run():
+        broadcaster = ProductBroadcaster()
+        subscription = broadcaster.subscribe([1, 2])
+
+        broadcaster.publish([change(1, 3), change(2, 7)])
+        broadcaster.publish([change(1, 2)])
+
+        return await subscription.changes()
+
+    assert asyncio.run(run()) == [change(1, 2), change(2, 7)]
+
+def test_unsubscribing_drops_every_product():
+    broadcaster = ProductBroadcaster()
+    subscription = broadcaster.subscribe([1, 2])
+    other = broadcaster.subscribe([2])
+
+    broadcaster.remove(subscription, [1])
+    assert broadcaster.subscribers == {2: {subscription, other}}
+
+    broadcaster.unsubscribe(subscription)
+    broadcaster.unsubscribe(other)
+    assert broadcaster.subscribers == {}
+
+def test_server_sent_events_carry_one_change_each():
+    event = sse_event(change(1, 4, "2.50"))
+
+    assert event.startswith("event: product\ndata: ")
+    assert event.endswith("\n\n")
+    assert json.loads(event.splitlines()[1].removeprefix("data: ")) == {"product_id": 1, "available_quantity": 4, "original_price": "2.50"}
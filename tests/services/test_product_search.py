@@ -0,0 +1,61 @@
+from decimal import Decimal
+
+from sqlmodel import select
+
+from db.models import Product
+from schemas.product import ProductListQuery, ProductSort
+from services.product_search import facet_counts, listing_filters, order_by, search_filters
+
+
+class FakeResult:
+    def __init__(self, rows):
+        self.rows = rows
+    
+    def all(self):
+        return self.rows
+
+class FakeSession:
+    def __init__(self, rows):
+        self.rows = rows
+    
+    def exec(self, statement):
+        return FakeResult(self.rows)
+
+def test_search_filters_only_include_given_terms():
+    assert search_filters() == []
+    assert len(search_filters(product_name="kettle")) == 1
+    assert len(search_filters(product_name="kettle", category="Home")) == 2
+
+def test_listing_filters_only_include_given_bounds():
+    assert listing_filters(ProductListQuery()) == []
+    assert len(listing_filters(ProductListQuery(min_price=Decimal(5), max_price=Decimal(10), in_stock=False))) == 3
+    assert len(search_filters(product_name="kettle", listing=ProductListQuery(in_stock=True))) == 2
+
+def test_every_sort_ends_on_a_unique_column():
+    rendered = {sort: str(select(Product.id).order_by(*order_by(sort, default=None))).split("ORDER BY ")[1] for sort in [None, *ProductSort]}
+    
+    assert rendered == {
+        None: "product.id",
+        ProductSort.name: "product.name",
+        ProductSort.price_asc: "product.original_price, product.id",
+        ProductSort.price_desc: "product.original_price DESC, product.id DESC",
+        ProductSort.newest: "product.created_at DESC, product.id DESC",
+    }
+
+def test_grouping_set_rows_are_split_into_facets():
+    # category, price bucket, in stock, count, grouping(category), grouping(price bucket)
+    rows = [
+        ("Books", None, None, 2, 0, 1),
+        ("Others", None, None, 5, 0, 1),
+        (None, 1, None, 4, 1, 0),
+        (None, 0, None, 3, 1, 0),
+        (None, 2, None, 1, 1, 0),
+        (None, None, True, 6, 1, 1),
+        (None, None, False, 1, 1, 1),
+    ]
+    
+    facets = facet_counts(FakeSession(rows), [], bounds=[0, 10, 50]) # type: ignore
+    
+    assert [(facet.name, facet.count) for facet in facets.categories] == [("Others", 5), ("Books", 2)]
+    assert [(facet.min_price, facet.max_price, facet.count) for facet in facets.price_buckets] == [(Decimal(0), Decimal(10), 3), (Decimal(10), Decimal(50), 4), (Decimal(50), None, 1)]
+    assert (facets.in_stock, facets.out_of_stock) == (6, 1)
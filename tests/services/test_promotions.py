@@ -0,0 +1,66 @@
+import datetime
+
+from decimal import Decimal
+
+import pytest
+
+from fastapi import HTTPException
+
+from db.models import Promotion
+from schemas.promotion import PromotionKind
+from services.promotions import CartLine, PromotionRules
+
+NOW = datetime.datetime(2024, 6, 1, 12, tzinfo=datetime.UTC)
+DAY = datetime.timedelta(days=1)
+
+
+def promotion(id: int, kind: PromotionKind, value: str, **scope) -> Promotion:
+    return Promotion(id=id, name=f"promotion {id}", kind=kind, value=Decimal(value), created_by=1, created_at=NOW, **scope)
+
+@pytest.fixture
+def rules() -> PromotionRules:
+    return PromotionRules([
+        promotion(1, PromotionKind.percentage, "10", category_id=1),
+        promotion(2, PromotionKind.fixed, "5", product_id=10),
+        promotion(3, PromotionKind.percentage, "50", vendor_id=7, starts_at=NOW + DAY),
+        promotion(4, PromotionKind.fixed, "1", ends_at=NOW - DAY),
+        promotion(5, PromotionKind.percentage, "25", voucher_code="SUMMER", category_id=2),
+    ])
+
+def line(product_id: int, category_id: int = 1, vendor_id: int = 1, price: str = "20.00", quantity: int = 1) -> CartLine:
+    return CartLine(product_id=product_id, category_id=category_id, vendor_id=vendor_id, original_price=Decimal(price), quantity=quantity)
+
+def test_the_best_running_promotion_wins(rules: PromotionRules):
+    # 10% of the category beats nothing, 5 off the product beats 10% of 20
+    assert rules.price(11, 1, 1, Decimal("20.00"), NOW) == Decimal("18.00")
+    assert rules.price(10, 1, 1, Decimal("20.00"), NOW) == Decimal("15.00")
+    # the vendor promotion has not started yet and the catalog wide one has ended
+    assert rules.price(12, 3, 7, Decimal("20.00"), NOW) == Decimal("20.00")
+    assert rules.price(12, 3, 7, Decimal("20.00"), NOW + 2 * DAY) == Decimal("10.00")
+
+def test_discounts_round_to_cents_and_never_go_below_zero():
+    rules = PromotionRules([promotion(1, PromotionKind.percentage, "33", product_id=1), promotion(2, PromotionKind.fixed, "50", product_id=2)])
+
+    assert rules.price(1, 1, 1, Decimal("9.99"), NOW) == Decimal("6.69")
+    assert rules.price(2, 1, 1, Decimal("9.99"), NOW) == Decimal("0.00")
+
+def test_the_cart_is_priced_per_line(rules: PromotionRules):
+    priced = rules.price_cart([line(10, quantity=2), line(11, category_id=2, quantity=3)], now=NOW)
+
+    assert [(line.unit_price, line.promotion_id, line.amount) for line in priced] == [
+        (Decimal("15.00"), 2, Decimal("30.00")),
+        (Decimal("20.00"), None, Decimal("60.00")),
+    ]
+
+def test_vouchers_only_apply_when_entered_and_in_scope(rules: PromotionRules):
+    priced = rules.price_cart([line(10), line(11, category_id=2)], voucher_code="SUMMER", now=NOW)
+
+    assert [(line.unit_price, line.promotion_id) for line in priced] == [(Decimal("15.00"), 2), (Decimal("15.00"), 5)]
+
+    with pytest.raises(HTTPException) as e:
+        rules.price_cart([line(10)], voucher_code="SUMMER", now=NOW)
+    assert e.value.detail == "Voucher does not apply to this cart"
+
+    with pytest.raises(HTTPException) as e:
+        rules.price_cart([line(10)], voucher_code="WINTER", now=NOW)
+    assert e.value.detail == "Invalid voucher"
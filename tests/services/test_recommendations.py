@@ -0,0 +1,37 @@
+from services.recommendations import cooccurrence_counts, merge_counts, top_k
+
+
+def as_dict(products, related, counts) -> dict[tuple[int, int], int]:
+    return {(a, b): c for a, b, c in zip(products.tolist(), related.tolist(), counts.tolist())}
+
+def test_products_bought_together_are_counted_both_ways():
+    # order 1: products 10, 20, 30; order 2: 10, 20 (20 twice); order 3: a single product
+    counts = as_dict(*cooccurrence_counts([1, 1, 1, 2, 2, 2, 3], [10, 20, 30, 10, 20, 20, 40]))
+
+    assert counts == {
+        (10, 20): 2, (20, 10): 2,
+        (10, 30): 1, (30, 10): 1,
+        (20, 30): 1, (30, 20): 1,
+    }
+
+def test_no_orders_give_an_empty_matrix():
+    products, related, counts = cooccurrence_counts([], [])
+
+    assert len(products) == len(related) == len(counts) == 0
+
+def test_counts_of_several_shards_add_up():
+    shard_a = cooccurrence_counts([1, 1], [10, 20])
+    shard_b = cooccurrence_counts([1, 1, 2, 2], [10, 20, 20, 30])
+
+    assert as_dict(*merge_counts([shard_a, shard_b])) == {(10, 20): 2, (20, 10): 2, (20, 30): 1, (30, 20): 1}
+
+def test_top_k_keeps_the_most_frequent_neighbours():
+    order_ids = [1, 1, 2, 2, 3, 3, 4, 4, 4]
+    product_ids = [10, 20, 10, 20, 10, 30, 10, 40, 50]
+
+    counts = as_dict(*top_k(*cooccurrence_counts(order_ids, product_ids), 2))
+
+    # 20 was bought with 10 twice, 30/40/50 once each and the tie goes to the lowest id
+    assert {pair: count for pair, count in counts.items() if pair[0] == 10} == {(10, 20): 2, (10, 30): 1}
+    assert counts[(40, 10)] == 1
+    assert counts[(40, 50)] == 1
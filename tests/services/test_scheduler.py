@@ -0,0 +1,31 @@
+import asyncio
+
+from services.scheduler import Scheduler
+
+
+def test_leader_only_jobs_are_skipped_on_other_workers():
+    async def start_and_stop(leader: bool) -> list[str]:
+        scheduler = Scheduler()
+        scheduler.add_job("everywhere", lambda: None, 60)
+        scheduler.add_job("leader", lambda: None, 60, leader_only=True)
+        scheduler.start(leader=leader)
+        names = [task.get_name() for task in scheduler._tasks]
+        await scheduler.stop()
+        return names
+    
+    assert asyncio.run(start_and_stop(leader=True)) == ["scheduler:everywhere", "scheduler:leader"]
+    assert asyncio.run(start_and_stop(leader=False)) == ["scheduler:everywhere"]
+
+def test_run_now_jobs_run_once_on_start():
+    runs = []
+    
+    async def start_and_stop():
+        scheduler = Scheduler()
+        scheduler.add_job("now", lambda: runs.append("now"), 60, run_now=True)
+        scheduler.add_job("later", lambda: runs.append("later"), 60)
+        scheduler.start()
+        await asyncio.sleep(0.1)
+        await scheduler.stop()
+    
+    asyncio.run(start_and_stop())
+    assert runs == ["now"]
@@ -0,0 +1,70 @@
+import pytest
+
+from services.metrics import caches
+from services.suggestions import Suggestion, SuggestionIndex, keys_of, normalize
+
+
+@pytest.fixture
+def index() -> SuggestionIndex:
+    index = SuggestionIndex(cache_size=64)
+    index.load([
+        Suggestion(kind="category", id=1, text="Home and Kitchen", weight=5),
+        Suggestion(kind="product", id=1, text="Electric Kettle", weight=3, category_id=1),
+        Suggestion(kind="product", id=2, text="Kettlebell 8kg", weight=10, category_id=2),
+        Suggestion(kind="product", id=3, text="Café Table", category_id=1),
+    ])
+    return index
+
+def texts(suggestions: list[Suggestion]) -> list[str]:
+    return [suggestion.text for suggestion in suggestions]
+
+def test_names_are_normalized():
+    assert normalize("  Café   TABLE ") == "cafe table"
+    assert keys_of("Electric Kettle") == {"electric kettle", "kettle"}
+
+def test_any_word_of_a_name_is_a_prefix(index: SuggestionIndex):
+    assert texts(index.suggest("ket", 10)) == ["Kettlebell 8kg", "Electric Kettle"]
+    assert texts(index.suggest("cafe t", 10)) == ["Café Table"]
+    assert texts(index.suggest("KITCH", 10)) == ["Home and Kitchen"]
+    assert index.suggest("toaster", 10) == []
+    assert index.suggest("   ", 10) == []
+
+def test_best_sellers_come_first_and_limit_applies(index: SuggestionIndex):
+    assert texts(index.suggest("e", 1)) == ["Electric Kettle"]
+    assert texts(index.suggest("k", 2)) == ["Kettlebell 8kg", "Home and Kitchen"]
+
+def test_products_are_updated_in_place(index: SuggestionIndex):
+    index.suggest("ket", 10)
+
+    index.put(Suggestion(kind="product", id=1, text="Electric Toaster", category_id=1))
+    index.put(Suggestion(kind="product", id=4, text="Kettle Chips", category_id=1))
+    index.remove("product", 2)
+
+    assert texts(index.suggest("ket", 10)) == ["Kettle Chips"]
+    assert texts(index.suggest("toast", 10)) == ["Electric Toaster"]
+    # the renamed product keeps its sales
+    assert index.suggest("toast", 10)[0].weight == 3
+
+def test_sales_count_for_the_product_and_its_category(index: SuggestionIndex):
+    index.add_sales({3: 7, 99: 1})
+
+    assert index.suggestions[("product", 3)].weight == 7
+    assert index.suggestions[("category", 1)].weight == 12
+
+def test_repeated_prefixes_are_answered_from_the_memo(index: SuggestionIndex):
+    hits, misses = caches.snapshot().get("product_suggestions", (0, 0))
+
+    first = index.suggest("ket", 10)
+    second = index.suggest("KET", 1)
+
+    assert second == first[:1]
+    assert caches.snapshot()["product_suggestions"] == (hits + 1, misses + 1)
+
+def test_changes_only_drop_the_answers_they_match(index: SuggestionIndex):
+    index.suggest("ket", 10)
+    index.suggest("caf", 10)
+
+    index.put(Suggestion(kind="product", id=4, text="Kettle Chips", category_id=1))
+
+    assert "caf" in index.cache
+    assert "ket" not in index.cache
@@ -0,0 +1,161 @@
+import asyncio
+import datetime
+import struct
+
+from typing import Iterator
+
+import pytest
+
+from sqlmodel import Session, select
+
+from db.models import Category, Product, ProductImage, UploadedFile, User
+from schemas.file import FileStatus
+from services import product_images, virus_scan
+from services.blob_storage import LocalBlobStorage
+from services.virus_scan import (
+    EICAR_SIGNATURE,
+    ClamAVScanner,
+    FakeVirusScanner,
+    ScanResult,
+    VirusScanError,
+    VirusScanner,
+    VirusScanService,
+)
+
+
+async def fake_clamd(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    assert await reader.readuntil(b"\0") == b"zINSTREAM\0"
+    data = b""
+    while (size := struct.unpack("!L", await reader.readexactly(4))[0]) != 0:
+        data += await reader.readexactly(size)
+    
+    if EICAR_SIGNATURE in data:
+        writer.write(b"stream: Eicar-Test-Signature FOUND\0")
+    else:
+        writer.write(b"stream: OK\0")
+    await writer.drain()
+    writer.close()
+
+async def scan_with_fake_clamd(chunks: list[bytes]):
+    server = await asyncio.start_server(fake_clamd, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    async with server:
+        return await ClamAVScanner("127.0.0.1", port, timeout=5).scan(iter(chunks))
+
+def test_clamav_scanner_clean():
+    result = asyncio.run(scan_with_fake_clamd([b"hello ", b"world"]))
+    
+    assert result.infected is False
+    assert result.signature is None
+
+def test_clamav_scanner_infected():
+    result = asyncio.run(scan_with_fake_clamd([EICAR_SIGNATURE[:20], EICAR_SIGNATURE[20:]]))
+    
+    assert result.infected is True
+    assert result.signature == "Eicar-Test-Signature"
+
+def test_clamav_scanner_error_reply():
+    with pytest.raises(VirusScanError):
+        ClamAVScanner.parse_reply("INSTREAM size limit exceeded. ERROR")
+
+def test_clamav_scanner_unreachable():
+    with pytest.raises(VirusScanError):
+        asyncio.run(ClamAVScanner("127.0.0.1", 1, timeout=1).scan(iter([b"data"])))
+
+def test_fake_scanner_signature_split_across_chunks():
+    chunks = [b"padding" + EICAR_SIGNATURE[:10], EICAR_SIGNATURE[10:] + b"padding"]
+    
+    assert asyncio.run(FakeVirusScanner().scan(iter(chunks))).infected is True
+    assert asyncio.run(FakeVirusScanner().scan(iter([b"clean file"]))).infected is False
+
+class FailingScanner(VirusScanner):
+    async def scan(self, chunks: Iterator[bytes]) -> ScanResult:
+        raise VirusScanError("clamd did not answer the scan request")
+
+@pytest.fixture
+def storage(tmp_path) -> LocalBlobStorage:
+    return LocalBlobStorage(str(tmp_path))
+
+@pytest.fixture
+def scan_engine(session: Session, monkeypatch: pytest.MonkeyPatch):
+    # the service opens its own sessions, on the test database
+    monkeypatch.setattr(virus_scan, "get_engine", session.get_bind)
+
+def stored_file(session: Session, storage: LocalBlobStorage, data: bytes) -> UploadedFile:
+    blob = storage.save_bytes(data)
+    file_obj = UploadedFile(filename="upload.gif", content_type="image/gif", size=blob.size, sha256=blob.key, created_at=datetime.datetime.now(datetime.UTC))
+    session.add(file_obj)
+    session.commit()
+    session.refresh(file_obj)
+    return file_obj
+
+def test_scan_file_clean(session: Session, storage: LocalBlobStorage, scan_engine):
+    file_obj = stored_file(session, storage, b"clean file")
+    
+    status = asyncio.run(VirusScanService(FakeVirusScanner(), storage).scan_file(file_obj.id)) # type: ignore
+    session.refresh(file_obj)
+    
+    assert status == FileStatus.clean
+    assert file_obj.status == FileStatus.clean
+    assert file_obj.scanned_at is not None
+    assert storage.exists(file_obj.sha256)
+
+def test_scan_file_infected_quarantines_every_copy(session: Session, storage: LocalBlobStorage, scan_engine):
+    first = stored_file(session, storage, EICAR_SIGNATURE)
+    second = stored_file(session, storage, EICAR_SIGNATURE)
+    
+    status = asyncio.run(VirusScanService(FakeVirusScanner(), storage).scan_file(first.id)) # type: ignore
+    session.refresh(first)
+    session.refresh(second)
+    
+    assert status == FileStatus.infected
+    assert first.status == FileStatus.infected
+    assert first.scan_result == "Eicar-Test-Signature"
+    assert second.status == FileStatus.infected
+    assert not storage.exists(first.sha256)
+
+def test_failed_scan_is_requeued(session: Session, storage: LocalBlobStorage, scan_engine):
+    file_obj = stored_file(session, storage, b"scanned while clamd was down")
+    
+    status = asyncio.run(VirusScanService(FailingScanner(), storage).scan_file(file_obj.id)) # type: ignore
+    session.refresh(file_obj)
+    
+    assert status == FileStatus.error
+    assert file_obj.status == FileStatus.error
+    
+    service = VirusScanService(FakeVirusScanner(), storage)
+    
+    assert service.requeue_failed() == 1
+    
+    asyncio.run(service.process(*service.queue.get_nowait()))
+    session.refresh(file_obj)
+    
+    assert file_obj.status == FileStatus.clean
+
+def test_requeued_product_image_is_processed(session: Session, storage: LocalBlobStorage, scan_engine, monkeypatch: pytest.MonkeyPatch):
+    now = datetime.datetime.now(datetime.UTC)
+    vendor = User(username="scanvendor", email="scanvendor@example.com", password_hash="x", is_vendor=True, created_at=now)
+    session.add(vendor)
+    session.commit()
+    category = session.exec(select(Category)).first()
+    product = Product(name="scanned product", description="", category_id=category.id, created_at=now, vendor_id=vendor.id) # type: ignore
+    session.add(product)
+    session.commit()
+    # uploaded before a restart, the callback queued with it is lost
+    file_obj = stored_file(session, storage, b"uploaded before the restart")
+    image = ProductImage(product_id=product.id, file_id=file_obj.id, created_at=now) # type: ignore
+    session.add(image)
+    session.commit()
+    
+    processed: list[int] = []
+    async def record(image_id: int):
+        processed.append(image_id)
+    monkeypatch.setattr(product_images, "process_product_image", record)
+    
+    service = VirusScanService(FakeVirusScanner(), storage)
+    
+    assert service.requeue() == 1
+    
+    asyncio.run(service.process(*service.queue.get_nowait()))
+    
+    assert processed == [image.id]
@@ -0,0 +1,111 @@
+import gzip
+import threading
+
+import pytest
+
+from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from fastapi.testclient import TestClient
+
+from utils.compression import CompressedBodyCache, negotiate_encoding
+from utils.middleware import CompressionMiddleware
+
+BODY = b'[{"name": "product"}]' * 200
+OTHER_BODY = b'[{"name": "category"}]' * 200
+
+
+def create_client(thread_minimum_size: int = 64 * 1024) -> TestClient:
+    app = FastAPI()
+    app.add_middleware(CompressionMiddleware, minimum_size=1024, thread_minimum_size=thread_minimum_size)
+
+    @app.get("/large")
+    async def large():
+        return PlainTextResponse(BODY, media_type="application/json", headers={"ETag": '"large"'})
+
+    # the same tag on another path, ETags are only unique per resource
+    @app.get("/other")
+    async def other():
+        return PlainTextResponse(OTHER_BODY, media_type="application/json", headers={"ETag": '"large"'})
+
+    @app.get("/small")
+    async def small():
+        return PlainTextResponse(b"{}", media_type="application/json")
+
+    @app.get("/events")
+    async def events():
+        async def stream():
+            yield b"event: product\n\n" * 200
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    return TestClient(app)
+
+def test_negotiate_encoding():
+    assert negotiate_encoding("gzip, deflate, br", ["zstd", "br", "gzip"]) == "br"
+    assert negotiate_encoding("br;q=0, gzip;q=0.5", ["zstd", "br", "gzip"]) == "gzip"
+    assert negotiate_encoding("*", ["gzip"]) == "gzip"
+    assert negotiate_encoding("identity", ["gzip"]) is None
+    assert negotiate_encoding("", ["gzip"]) is None
+
+def test_compresses_large_bodies():
+    response = create_client().get("/large", headers={"Accept-Encoding": "gzip"})
+
+    assert response.status_code == 200
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["vary"] == "Accept-Encoding"
+    assert response.headers["etag"] == 'W/"large"'
+    assert int(response.headers["content-length"]) < len(BODY)
+    # httpx decodes the body
+    assert response.content == BODY
+
+def test_skips_small_bodies_and_streams():
+    client = create_client()
+
+    small = client.get("/small", headers={"Accept-Encoding": "gzip"})
+    events = client.get("/events", headers={"Accept-Encoding": "gzip"})
+    identity = client.get("/large", headers={"Accept-Encoding": "identity"})
+
+    assert "content-encoding" not in small.headers
+    assert "content-encoding" not in events.headers
+    assert "content-encoding" not in identity.headers
+    assert identity.headers["vary"] == "Accept-Encoding"
+    assert identity.headers["etag"] == '"large"'
+
+def test_compressed_body_cache():
+    cache = CompressedBodyCache(max_bytes=200)
+    first = cache.compress(BODY, "gzip")
+
+    assert gzip.decompress(first) == BODY
+    assert cache.compress(BODY, "gzip") is first
+
+    cache.put("other", "gzip", b"x" * 190)
+
+    # least recently used entries are evicted once the cache is full
+    assert cache.get(cache.key_of(BODY), "gzip") is None
+    assert cache.size <= 200
+
+def test_bodies_with_the_same_etag_are_cached_apart():
+    client = create_client()
+
+    large = client.get("/large", headers={"Accept-Encoding": "gzip"})
+    other = client.get("/other", headers={"Accept-Encoding": "gzip"})
+
+    assert large.content == BODY
+    assert other.content == OTHER_BODY
+
+@pytest.mark.parametrize(("thread_minimum_size", "off_the_loop"), [(1024, True), (len(BODY) + 1, False)])
+def test_large_bodies_are_compressed_off_the_event_loop(monkeypatch: pytest.MonkeyPatch, thread_minimum_size: int, off_the_loop: bool):
+    threads = []
+    compress = CompressedBodyCache.compress
+    def record_thread(self, body, encoding):
+        threads.append(threading.current_thread())
+        return compress(self, body, encoding)
+    monkeypatch.setattr(CompressedBodyCache, "compress", record_thread)
+    client = create_client(thread_minimum_size)
+    loop_threads = []
+    client.app.add_event_handler("startup", lambda: loop_threads.append(threading.current_thread())) # type: ignore
+
+    with client:
+        response = client.get("/large", headers={"Accept-Encoding": "gzip"})
+
+    assert response.content == BODY
+    assert (threads[0] is not loop_threads[0]) == off_the_loop
@@ -1,12 +1,14 @@
 import pytest
 
 from fastapi.testclient import TestClient
+from sqlalchemy import event
 from sqlmodel import Session, SQLModel, create_engine
 from sqlmodel.pool import StaticPool
 
 from core.config import settings
 from db.models import *
 from main import app
+from services.cart_store import DatabaseCartStore, get_cart_store
 from utils.deps import get_session
 from utils.utils import set_default_product_categories
 
@@ -36,7 +38,20 @@ def client_fixture(session: Session):
         return session
     
     app.dependency_overrides[get_session] = get_session_override
+    # carts are read and written through the test session instead of being cached in memory between tests
+    app.dependency_overrides[get_cart_store] = DatabaseCartStore
     
     client = TestClient(app)
     yield client
     app.dependency_overrides.clear()
+
+# every statement the test session runs, for tests that check the SQL an endpoint issues
+@pytest.fixture
+def statements(session: Session):
+    executed: list[str] = []
+    def record(conn, cursor, statement, *args):
+        # one line, the compiler breaks before FROM and WHERE
+        executed.append(" ".join(statement.split()))
+    event.listen(session.get_bind(), "before_cursor_execute", record)
+    yield executed
+    event.remove(session.get_bind(), "before_cursor_execute", record)
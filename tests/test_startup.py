@@ -0,0 +1,23 @@
+import os
+import subprocess
+import sys
+
+from scripts.profile_imports import profile
+
+# generous enough for a slow CI machine, a regression like importing spaCy at startup blows well past it
+IMPORT_BUDGET_MS = float(os.environ.get("IMPORT_BUDGET_MS", 3000))
+# optional subsystems that must only be imported on first use
+LAZY_MODULES = ["fastapi_mail", "boto3", "PIL", "numpy", "spacy"]
+
+
+def test_cold_import_of_main_stays_under_budget():
+    timings, _ = profile("main")
+    main_timing = next(timing for timing in timings if timing.module == "main")
+
+    assert main_timing.cumulative_us / 1000 < IMPORT_BUDGET_MS
+
+def test_optional_subsystems_are_not_imported_at_startup():
+    code = f"import sys, main; print(','.join(module for module in {LAZY_MODULES!r} if module in sys.modules))"
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+    assert result.stdout.strip() == ""
@@ -0,0 +1,112 @@
+import gzip
+import hashlib
+import threading
+
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Callable
+
+from core.config import settings
+from services.metrics import caches
+
+# fast levels, a listing is compressed once and then served from the cache
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+ZSTD_LEVEL = 3
+
+COMPRESSIBLE_TYPES = ("text/", "application/json", "application/javascript", "application/xml", "image/svg+xml")
+
+
+# Encoding name -> compress function, in COMPRESSION_ENCODINGS order. brotli and zstandard are optional, the
+# encodings whose module is not installed are left out
+@lru_cache(maxsize=1)
+def get_encoders() -> dict[str, Callable[[bytes], bytes]]:
+    encoders = {}
+    for encoding in settings.COMPRESSION_ENCODINGS:
+        if encoding == "gzip":
+            # mtime=0 keeps the output the same for the same body
+            encoders[encoding] = lambda body: gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+        elif encoding == "br":
+            try:
+                import brotli
+            except ImportError:
+                continue
+            encoders[encoding] = lambda body, brotli=brotli: brotli.compress(body, quality=BROTLI_QUALITY)
+        elif encoding == "zstd":
+            try:
+                import zstandard
+            except ImportError:
+                continue
+            encoders[encoding] = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress
+    return encoders
+
+def is_compressible(content_type: str) -> bool:
+    # event streams are compressible text, but every event has to reach the client as soon as it is sent
+    return content_type.startswith(COMPRESSIBLE_TYPES) and not content_type.startswith("text/event-stream")
+
+# The encoding to answer a request with: the one the client accepts (q > 0) that comes first in our order, or None
+def negotiate_encoding(accept_encoding: str, encodings: list[str]) -> str | None:
+    accepted: dict[str, float] = {}
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0
+        if name:
+            accepted[name.strip()] = quality
+    for encoding in encodings:
+        if accepted.get(encoding, accepted.get("*", 0)) > 0:
+            return encoding
+    return None
+
+# Compressed bodies keyed by (body digest, encoding), up to max_bytes of them. The same listing or invoice is
+# compressed once per encoding and then copied out of memory, hashing a body is far cheaper than compressing it.
+# An ETag is not a key: the same tag can name different bodies on different paths
+class CompressedBodyCache:
+    def __init__(self, max_bytes: int = settings.COMPRESSION_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries: OrderedDict[tuple[str, str], bytes] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key_of(body: bytes) -> str:
+        return hashlib.blake2b(body, digest_size=16).hexdigest()
+
+    def get(self, key: str, encoding: str) -> bytes | None:
+        with self._lock:
+            compressed = self.entries.get((key, encoding))
+            caches.record("compressed_responses", hit=compressed is not None)
+            if compressed is not None:
+                self.entries.move_to_end((key, encoding))
+            return compressed
+
+    def put(self, key: str, encoding: str, compressed: bytes):
+        if len(compressed) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self.entries.pop((key, encoding), None)
+            if previous is not None:
+                self.size -= len(previous)
+            self.entries[(key, encoding)] = compressed
+            self.size += len(compressed)
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def compress(self, body: bytes, encoding: str) -> bytes:
+        key = self.key_of(body)
+        compressed = self.get(key, encoding)
+        if compressed is None:
+            compressed = get_encoders()[encoding](body)
+            self.put(key, encoding, compressed)
+        return compressed
+
+@lru_cache(maxsize=1)
+def get_compressed_body_cache() -> CompressedBodyCache:
+    return CompressedBodyCache()
@@ -1,10 +1,34 @@
+import time
+
+from fastapi import Depends, Request
 from sqlmodel import Session
+from typing_extensions import Annotated
+
+from db.engine import get_engine
+from db.replicas import get_replica_router
 
-from db.engine import DB_URL, get_db
+# set by ReadYourWritesMiddleware on every successful write, reads go to the primary until it expires
+READ_PRIMARY_COOKIE = "read_primary_until"
+# endpoints reached with GET that still write, read-your-writes treats them like a POST, PUT or DELETE
+WRITING_GET_ROUTES = {"checkout_cart"}
 
 
 def get_session():
-    engine = get_db(DB_URL, {"echo": True})
-    with Session(engine) as session:
+    with Session(get_engine()) as session:
         yield session
 
+def wrote_recently(request: Request) -> bool:
+    try:
+        return float(request.cookies.get(READ_PRIMARY_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+# Session for read only endpoints, served by a replica when one is configured and caught up. It builds on
+# get_session so the primary session (and a dependency override of it in tests) is the fallback
+def get_read_session(request: Request, primary: Annotated[Session, Depends(get_session)]):
+    engine = None if wrote_recently(request) else get_replica_router().choose()
+    if engine is None:
+        yield primary
+        return
+    with Session(engine) as session:
+        yield session
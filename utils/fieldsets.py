@@ -0,0 +1,132 @@
+import typing
+
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, Callable, Sequence
+
+from fastapi import HTTPException, Query, Response
+from pydantic import BaseModel, TypeAdapter
+from sqlalchemy import inspect
+from sqlalchemy.orm import load_only, noload, selectinload
+
+
+# the read model inside List["ProductRead"] or Optional["CartRead"]
+def nested_model(annotation: Any) -> type[BaseModel] | None:
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        return annotation
+    for arg in typing.get_args(annotation):
+        if (model := nested_model(arg)) is not None:
+            return model
+    return None
+
+# relationship name -> read model, for the relationships of the table that the read model embeds
+def embedded_relationships(table_model: type, read_model: type[BaseModel]) -> dict[str, type[BaseModel]]:
+    relationships = inspect(table_model).relationships
+    return {name: model for name, field in read_model.model_fields.items() if name in relationships and (model := nested_model(field.annotation)) is not None}
+
+def computed_fields(read_model: type[BaseModel]) -> set[str]:
+    return set(read_model.__pydantic_decorators__.computed_fields)
+
+# what fields= may list: the serialized columns and computed fields, never the relationships or excluded secrets
+def attribute_fields(table_model: type, read_model: type[BaseModel]) -> set[str]:
+    embedded = embedded_relationships(table_model, read_model)
+    return {name for name, field in read_model.model_fields.items() if name not in embedded and not field.exclude} | computed_fields(read_model)
+
+# Eager loads every relationship the read model embeds, and theirs, with one SELECT ... IN per relationship
+# instead of one lazy load per row. selectinload runs a separate statement per relationship, so it also works
+# when the related table lives on another database (user -> orders on a shard). Loader options are immutable, they
+# are built once per endpoint and include list
+@lru_cache(maxsize=256)
+def eager_options(table_model: type, read_model: type[BaseModel], include: frozenset[str] | None = None) -> tuple:
+    options = []
+    embedded = embedded_relationships(table_model, read_model)
+    for name, relationship in inspect(table_model).relationships.items():
+        attribute = getattr(table_model, name)
+        if name in embedded and (include is None or name in include):
+            options.append(selectinload(attribute).options(*eager_options(relationship.mapper.class_, embedded[name])))
+        else:
+            # never serialized, not even the relationships that load eagerly by default
+            options.append(noload(attribute))
+    return tuple(options)
+
+@lru_cache(maxsize=256)
+def get_adapter(annotation: Any) -> TypeAdapter:
+    return TypeAdapter(annotation)
+
+# A sparse fieldset: fields=name,price lists the columns of the resource, include=vendor the relationships
+# embedded in it. Either one left out keeps every column or every relationship, include= with no value drops
+# all relationships. Unrequested columns are not selected and unrequested relationships are not loaded
+@dataclass
+class Fieldset:
+    table_model: type
+    read_model: type[BaseModel]
+    fields: set[str] | None = None
+    include: set[str] | None = None
+
+    @property
+    def is_full(self) -> bool:
+        return self.fields is None and self.include is None
+
+    def columns(self) -> list[str]:
+        mapper = inspect(self.table_model)
+        columns = {column.key for column in mapper.column_attrs}
+        # computed fields are derived from the row, they need all of it
+        if self.fields is None or self.fields & computed_fields(self.read_model):
+            return sorted(columns)
+        primary_keys = {mapper.get_property_by_column(column).key for column in mapper.primary_key}
+        return sorted((self.fields & columns) | primary_keys)
+
+    def options(self) -> list:
+        options = list(eager_options(self.table_model, self.read_model, None if self.include is None else frozenset(self.include)))
+        if self.fields is not None:
+            options.append(load_only(*[getattr(self.table_model, column) for column in self.columns()]))
+        return options
+
+    def output_fields(self) -> set[str]:
+        embedded = set(embedded_relationships(self.table_model, self.read_model))
+        fields = attribute_fields(self.table_model, self.read_model) if self.fields is None else self.fields | {"id"}
+        return fields | (embedded if self.include is None else self.include)
+
+    # Builds the read model from the loaded attributes only, reading any other one would load it after all
+    def project(self, obj: Any) -> BaseModel:
+        embedded = embedded_relationships(self.table_model, self.read_model)
+        values = {}
+        for name in self.output_fields() | set(self.columns() if self.fields is not None else []):
+            if name in embedded:
+                values[name] = get_adapter(self.read_model.model_fields[name].annotation).validate_python(getattr(obj, name), from_attributes=True)
+            elif name in self.read_model.model_fields:
+                values[name] = getattr(obj, name)
+        return self.read_model.model_construct(**values)
+
+    def response(self, content: Any) -> Any:
+        # the full resource goes through the route's own response model
+        if self.is_full:
+            return content
+        include = self.output_fields()
+        if isinstance(content, Sequence):
+            body = "[" + ",".join(self.project(obj).model_dump_json(include=include) for obj in content) + "]"
+        else:
+            body = self.project(content).model_dump_json(include=include)
+        return Response(body, media_type="application/json")
+
+def parse_names(value: str | None) -> set[str] | None:
+    if value is None:
+        return None
+    return {name.strip() for name in value.split(",") if name.strip()}
+
+# Query parameters of an endpoint returning read_model rows of table_model, unknown names are rejected
+def sparse_fieldset(table_model: type, read_model: type[BaseModel]) -> Callable[..., Fieldset]:
+    embedded = set(embedded_relationships(table_model, read_model))
+    attributes = attribute_fields(table_model, read_model)
+
+    def dependency(fields: str | None = Query(default=None, description=f"Comma separated fields, any of: {', '.join(sorted(attributes))}"), include: str | None = Query(default=None, description=f"Comma separated relationships, any of: {', '.join(sorted(embedded)) or 'none'}")) -> Fieldset:
+        fieldset = Fieldset(table_model, read_model, parse_names(fields), parse_names(include))
+        unknown_fields = (fieldset.fields or set()) - attributes
+        if unknown_fields:
+            raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown_fields))}")
+        unknown_relationships = (fieldset.include or set()) - embedded
+        if unknown_relationships:
+            raise HTTPException(status_code=400, detail=f"Unknown relationships: {', '.join(sorted(unknown_relationships))}")
+        return fieldset
+
+    return dependency
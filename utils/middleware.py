@@ -0,0 +1,174 @@
+import asyncio
+import json
+import logging
+import time
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.responses import Response
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from core.config import settings
+from db.profiler import QueryStats, current_query_stats
+from services.metrics import (
+    db_queries_per_request,
+    db_time_per_request_seconds,
+    http_request_duration_seconds,
+    http_requests_in_progress,
+    http_requests_total,
+)
+from utils.compression import get_compressed_body_cache, get_encoders, is_compressible, negotiate_encoding
+from utils.deps import READ_PRIMARY_COOKIE, WRITING_GET_ROUTES
+
+request_logger = logging.getLogger("db.request_queries")
+
+
+def route_template(scope: Scope) -> str:
+    # the router stores the matched route in the scope, using its path template keeps label cardinality bounded
+    route = scope.get("route")
+    return getattr(route, "path", "unmatched")
+
+# Pure ASGI middleware rather than @app.middleware("http"), which wraps every request in an extra task and memory stream
+class MetricsMiddleware:
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start_ns = time.perf_counter_ns()
+        stats = QueryStats(scope=scope)
+        token = current_query_stats.set(stats)
+        status_code = 500
+
+        async def send_wrapper(message: Message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                headers = MutableHeaders(scope=message)
+                headers["X-Process-Time"] = str((time.perf_counter_ns() - start_ns) / 1e9)
+                if settings.DB_QUERY_DEBUG_HEADER:
+                    headers["X-DB-Queries"] = str(stats.count)
+                    headers["X-DB-Query-Time"] = f"{stats.total_ns / 1e6:.3f}ms"
+            await send(message)
+
+        http_requests_in_progress.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            http_requests_in_progress.dec()
+            current_query_stats.reset(token)
+
+            route = route_template(scope)
+            method = scope["method"]
+            http_requests_total.inc(method, route, str(status_code))
+            http_request_duration_seconds.observe(method, route, value=(time.perf_counter_ns() - start_ns) / 1e9)
+            db_queries_per_request.observe(route, value=stats.count)
+            db_time_per_request_seconds.observe(route, value=stats.total_ns / 1e9)
+            
+            if request_logger.isEnabledFor(logging.DEBUG):
+                request_logger.debug(json.dumps({"event": "request_queries", "method": method, "route": route, "queries": stats.count, "db_time_ms": round(stats.total_ns / 1e6, 3), "slowest_ms": round(stats.slowest_ns / 1e6, 3), "slowest_statement": stats.slowest_statement}))
+
+def is_write(scope: Scope) -> bool:
+    if scope["method"] not in ("GET", "HEAD", "OPTIONS"):
+        return True
+    # checkout is a GET, the matched route tells it apart from the reads
+    return getattr(scope.get("route"), "name", None) in WRITING_GET_ROUTES
+
+# After a successful write the client reads from the primary for READ_YOUR_WRITES_SECONDS, long enough for the
+# replicas to catch up, so it never sees data older than its own changes
+class ReadYourWritesMiddleware:
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or not settings.DB_REPLICA_URLS:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_wrapper(message: Message):
+            # the route is matched by the time the response starts
+            if message["type"] == "http.response.start" and message["status"] < 400 and is_write(scope):
+                cookie = Response()
+                cookie.set_cookie(READ_PRIMARY_COOKIE, str(int(time.time()) + settings.READ_YOUR_WRITES_SECONDS), max_age=settings.READ_YOUR_WRITES_SECONDS, httponly=True, samesite="lax")
+                MutableHeaders(scope=message).append("set-cookie", cookie.headers["set-cookie"])
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+# Compresses text and JSON bodies with the best encoding of Accept-Encoding. Bodies below COMPRESSION_MINIMUM_SIZE
+# go out as they are. Streams are passed through as they are sent, except those with a Content-Length up to
+# COMPRESSION_MAXIMUM_SIZE (invoices), which are buffered. Compressed bodies come from the compressed body cache
+class CompressionMiddleware:
+    def __init__(self, app: ASGIApp, minimum_size: int = settings.COMPRESSION_MINIMUM_SIZE, maximum_size: int = settings.COMPRESSION_MAXIMUM_SIZE, thread_minimum_size: int = settings.COMPRESSION_THREAD_MINIMUM_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.maximum_size = maximum_size
+        self.thread_minimum_size = thread_minimum_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        encoding = negotiate_encoding(Headers(scope=scope).get("accept-encoding", ""), list(get_encoders()))
+        start_message: Message | None = None
+        chunks: list[bytes] = []
+        passthrough = False
+
+        async def send_wrapper(message: Message):
+            nonlocal start_message, passthrough
+            if passthrough or message["type"] not in ("http.response.start", "http.response.body"):
+                await send(message)
+                return
+
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(scope=message)
+                if not is_compressible(headers.get("content-type", "")) or "content-encoding" in headers:
+                    passthrough = True
+                    await send(message)
+                    return
+                headers.add_vary_header("Accept-Encoding")
+                length = headers.get("content-length")
+                if encoding is None or scope["method"] == "HEAD" or (length is not None and not self.minimum_size <= int(length) <= self.maximum_size):
+                    passthrough = True
+                    await send(message)
+                    return
+                start_message = message
+                return
+
+            assert start_message is not None
+            headers = MutableHeaders(scope=start_message)
+            chunks.append(message.get("body", b""))
+            if message.get("more_body", False):
+                # a stream of unknown length, it is sent on as it comes
+                if "content-length" not in headers:
+                    passthrough = True
+                    await send(start_message)
+                    await send({"type": "http.response.body", "body": b"".join(chunks), "more_body": True})
+                return
+
+            body = b"".join(chunks)
+            if len(body) < self.minimum_size:
+                await send(start_message)
+                await send({"type": "http.response.body", "body": body})
+                return
+
+            cache = get_compressed_body_cache()
+            if len(body) >= self.thread_minimum_size:
+                # hashing and compressing a large body would hold up every other request of this worker
+                compressed = await asyncio.to_thread(cache.compress, body, encoding) # type: ignore
+            else:
+                # below the cutoff handing the work to a thread costs more than doing it
+                compressed = cache.compress(body, encoding) # type: ignore
+            etag = headers.get("etag")
+            headers["Content-Encoding"] = encoding # type: ignore
+            headers["Content-Length"] = str(len(compressed))
+            if etag is not None and not etag.startswith("W/"):
+                # the compressed bytes differ from the ones the strong ETag was computed for
+                headers["ETag"] = f"W/{etag}"
+            await send(start_message)
+            await send({"type": "http.response.body", "body": compressed})
+
+        await self.app(scope, receive, send_wrapper)
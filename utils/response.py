@@ -1 +1,51 @@
-# TODO: create a consistent way to return responses to client 
+import asyncio
+import functools
+
+from typing import Any, Callable
+
+from fastapi import Response
+from fastapi.routing import APIRoute
+from pydantic import TypeAdapter
+
+
+# FastAPI turns a response_model result into JSON in three passes: validate into the model, dump the model to
+# python primitives, then json.dumps them. The TypeAdapter below is built once per route and does the last two
+# in a single pass straight to bytes inside pydantic-core.
+def make_serializer(response_model: Any) -> Callable[[Any], bytes]:
+    adapter = TypeAdapter(response_model)
+
+    def serialize(content: Any) -> bytes:
+        # from_attributes reads the ORM rows directly, no intermediate dicts are built
+        return adapter.dump_json(adapter.validate_python(content, from_attributes=True))
+
+    return serialize
+
+# Opt in per router with APIRouter(route_class=FastSerializationRoute). Endpoints keep returning ORM objects and
+# their response_model still drives validation and the OpenAPI schema. Endpoints that return a Response themselves,
+# or that set headers through an injected Response parameter, are left to FastAPI.
+class FastSerializationRoute(APIRoute):
+    def __init__(self, path: str, endpoint: Callable[..., Any], **kwargs: Any):
+        super().__init__(path, endpoint, **kwargs)
+        if self.response_model is None or self.dependant.response_param_name is not None:
+            return
+
+        serialize = make_serializer(self.response_model)
+        status_code = self.status_code or 200
+        call = self.dependant.call
+
+        def to_response(content: Any) -> Any:
+            if isinstance(content, Response):
+                return content
+            return Response(serialize(content), status_code=status_code, media_type="application/json")
+
+        # the request handler already decided whether to await the endpoint, the wrapper must keep the same kind
+        if asyncio.iscoroutinefunction(call):
+            @functools.wraps(call) # type: ignore
+            async def fast_call(**values: Any) -> Any:
+                return to_response(await call(**values)) # type: ignore
+        else:
+            @functools.wraps(call) # type: ignore
+            def fast_call(**values: Any) -> Any:
+                return to_response(call(**values)) # type: ignore
+
+        self.dependant.call = fast_call
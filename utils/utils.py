@@ -1,13 +1,17 @@
 import datetime
 
-from sqlmodel import Session
+from sqlmodel import Session, select
 
 from db.models import Category
 from schemas.product import ProductCategory
 
 
+# safe to run on every startup, only the missing categories are inserted
 def set_default_product_categories(db: Session):
+    existing = set(db.exec(select(Category.name)).all())
     for category in ProductCategory:
+        if category.value in existing:
+            continue
         category_obj = Category(name=category, created_at=datetime.datetime.now(datetime.UTC))
         db.add(category_obj)
-        db.commit()
+    db.commit()